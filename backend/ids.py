@@ -0,0 +1,57 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+def uuid7(timestamp_ms: Optional[int] = None) -> uuid.UUID:
+    """UUIDv7: 48-bit Unix milliseconds, then a 12-bit counter and 62 random bits.
+
+    Ids generated by this process are strictly increasing, so their canonical
+    string form sorts in creation order and can serve as a keyset cursor.
+    """
+    global _last_ms, _counter
+    with _lock:
+        if timestamp_ms is None:
+            timestamp_ms = time.time_ns() // 1_000_000
+            if timestamp_ms <= _last_ms:
+                # Same (or earlier) millisecond: keep ordering through the counter
+                timestamp_ms = _last_ms
+                _counter += 1
+                if _counter > 0xFFF:
+                    timestamp_ms += 1
+                    _counter = 0
+            else:
+                _counter = int.from_bytes(os.urandom(2), "big") & 0x3FF
+            _last_ms = timestamp_ms
+            counter = _counter
+        else:
+            counter = int.from_bytes(os.urandom(2), "big") & 0xFFF
+
+    random_bits = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (timestamp_ms & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76
+    value |= counter << 64
+    value |= 0b10 << 62
+    value |= random_bits
+    return uuid.UUID(int=value)
+
+def new_id() -> str:
+    return str(uuid7())
+
+def id_for_datetime(moment: datetime) -> str:
+    """Time-ordered id for a historical document, used when migrating old ids"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return str(uuid7(int(moment.timestamp() * 1000)))
+
+def is_time_ordered(value: str) -> bool:
+    try:
+        return uuid.UUID(value).version == 7
+    except (ValueError, TypeError, AttributeError):
+        return False
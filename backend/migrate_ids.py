@@ -0,0 +1,211 @@
+"""Rewrite random uuid4 document ids as time-ordered UUIDv7 ids.
+
+Each new id is derived from the document's created_at, so migrated ids
+sort in creation order like freshly generated ones. References in other
+collections are rewritten along with the ids. The old -> new mapping is
+recorded in `id_migrations`, so an interrupted run can be restarted
+safely. Archived copies share their live collection's mapping, and
+payout buckets keyed by technician id are re-keyed. Issued JWTs carry the old user ids, so users must log in again
+after the users collection is migrated.
+
+Each batch looks references up with one $in query per referencing field
+and rewrites them by _id; reference fields without an index get a
+temporary one for the duration of the run.
+
+    python migrate_ids.py [--dry-run] [--batch-size 1000] [--collection users ...]
+"""
+import os
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from ids import id_for_datetime, is_time_ordered
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Collection -> fields elsewhere that hold its ids; "lines[].field" is a field of every array element
+INTERVENTION_REFERENCES = [
+    ("messages", "intervention_id"),
+    ("messages_archive", "intervention_id"),
+    ("payment_transactions", "intervention_id"),
+    ("payment_transactions", "metadata.intervention_id"),
+    ("payout_buckets", "lines[].intervention_id"),
+    ("reviews", "intervention_id"),
+    ("notifications", "data.intervention_id"),
+    ("tasks", "payload.data.intervention_id"),
+]
+REFERENCES = {
+    "users": [
+        ("interventions", "user_id"),
+        ("interventions", "technician_id"),
+        ("interventions", "resolved_by"),
+        ("interventions_archive", "user_id"),
+        ("interventions_archive", "technician_id"),
+        ("interventions_archive", "resolved_by"),
+        ("messages", "sender_id"),
+        ("messages_archive", "sender_id"),
+        ("notifications", "user_id"),
+        ("payment_transactions", "user_id"),
+        ("payment_transactions", "technician_id"),
+        ("payment_transactions", "metadata.user_id"),
+        ("payment_transactions", "metadata.technician_id"),
+        ("reviews", "user_id"),
+        ("reviews", "technician_id"),
+        ("payout_buckets", "technician_id"),
+        ("tasks", "payload.user_id"),
+    ],
+    "interventions": INTERVENTION_REFERENCES,
+    "interventions_archive": INTERVENTION_REFERENCES,
+    "messages": [],
+    "messages_archive": [],
+    "notifications": [],
+    "payment_transactions": [
+        ("payout_buckets", "lines[].payment_id"),
+    ],
+    "reviews": [],
+}
+
+# Archives share their live collection's mapping: a document copied twice gets one new id
+MAPPING_NAMESPACE = {"interventions_archive": "interventions", "messages_archive": "messages"}
+
+# Collections whose _id embeds a reference: (field, _id of the rewritten document)
+REKEYED = {
+    "payout_buckets": ("technician_id", lambda doc: f"{doc['technician_id']}:{doc['month']:%Y-%m}"),
+}
+
+def load_mapping(db, collection_name, old_ids):
+    collection_name = MAPPING_NAMESPACE.get(collection_name, collection_name)
+    mapping = {
+        row["_id"]: row["new_id"]
+        for row in db.id_migrations.find({"_id": {"$in": old_ids}, "collection": collection_name})
+    }
+    return mapping
+
+def get_field(doc, field):
+    for part in field.split("."):
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return doc
+
+def index_path(field):
+    return field.replace("[]", "")
+
+def rekey_references(db, target, field, mapping):
+    make_key = REKEYED[target][1]
+    for doc in db[target].find({field: {"$in": list(mapping)}}):
+        doc[field] = mapping[doc[field]]
+        old_key, doc["_id"] = doc["_id"], make_key(doc)
+        try:
+            db[target].insert_one(doc)
+        except DuplicateKeyError:
+            pass  # copied by an interrupted run
+        db[target].delete_one({"_id": old_key})
+
+def rewrite_references(db, target, field, mapping, batch_size):
+    """One indexed $in lookup for the whole batch, then updates by _id"""
+    if REKEYED.get(target, (None,))[0] == field:
+        return rekey_references(db, target, field, mapping)
+
+    operations = []
+    array, _, item_field = field.partition("[].")
+    if item_field:
+        for doc in db[target].find({index_path(field): {"$in": list(mapping)}}, {array: 1}):
+            items = [
+                {**item, item_field: mapping.get(item.get(item_field), item.get(item_field))}
+                for item in doc[array]
+            ]
+            operations.append(UpdateOne({"_id": doc["_id"], array: doc[array]}, {"$set": {array: items}}))
+    else:
+        for doc in db[target].find({field: {"$in": list(mapping)}}, {field: 1}):
+            old = get_field(doc, field)
+            operations.append(UpdateOne({"_id": doc["_id"], field: old}, {"$set": {field: mapping[old]}}))
+    for start in range(0, len(operations), batch_size):
+        db[target].bulk_write(operations[start:start + batch_size], ordered=False)
+
+def migrate_batch(db, collection_name, docs, dry_run):
+    old_ids = [doc["id"] for doc in docs]
+    mapping = load_mapping(db, collection_name, old_ids)
+    fresh = []
+    for doc in docs:
+        if doc["id"] not in mapping:
+            mapping[doc["id"]] = id_for_datetime(doc.get("created_at") or datetime.utcnow())
+            fresh.append({
+                "_id": doc["id"],
+                "collection": MAPPING_NAMESPACE.get(collection_name, collection_name),
+                "new_id": mapping[doc["id"]]
+            })
+
+    if dry_run:
+        return len(mapping)
+
+    if fresh:
+        try:
+            db.id_migrations.insert_many(fresh, ordered=False)
+        except BulkWriteError:
+            # Another run recorded some of these first: use its ids
+            mapping.update(load_mapping(db, collection_name, old_ids))
+
+    # References first, then the ids themselves, so a rerun finds the mapping again
+    for target, field in REFERENCES[collection_name]:
+        rewrite_references(db, target, field, mapping, len(docs))
+
+    db[collection_name].bulk_write(
+        [UpdateOne({"_id": doc["_id"]}, {"$set": {"id": mapping[doc["id"]]}}) for doc in docs],
+        ordered=False
+    )
+    return len(mapping)
+
+def ensure_reference_indexes(db, collection_names):
+    """Index every reference field that has none; returns what to drop after the run"""
+    created = []
+    for target, field in {reference for name in collection_names for reference in REFERENCES[name]}:
+        path = index_path(field)
+        leading = {info["key"][0][0] for info in db[target].index_information().values()}
+        if path not in leading:
+            name = f"migrate_ids_{path}"
+            db[target].create_index(path, name=name)
+            created.append((target, name))
+    return created
+
+def migrate_collection(db, collection_name, batch_size, dry_run):
+    migrated = 0
+    batch = []
+    cursor = db[collection_name].find({}, {"_id": 1, "id": 1, "created_at": 1}).batch_size(batch_size)
+    for doc in cursor:
+        if "id" not in doc or is_time_ordered(doc["id"]):
+            continue
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            migrated += migrate_batch(db, collection_name, batch, dry_run)
+            batch = []
+    if batch:
+        migrated += migrate_batch(db, collection_name, batch, dry_run)
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate document ids to UUIDv7")
+    parser.add_argument("--dry-run", action="store_true", help="count documents to migrate without writing")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--collection", action="append", choices=list(REFERENCES), help="limit to these collections")
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    collection_names = args.collection or list(REFERENCES)
+    temporary_indexes = [] if args.dry_run else ensure_reference_indexes(db, collection_names)
+    try:
+        for collection_name in collection_names:
+            count = migrate_collection(db, collection_name, args.batch_size, args.dry_run)
+            action = "would migrate" if args.dry_run else "migrated"
+            print(f"{collection_name}: {action} {count} ids")
+    finally:
+        for target, name in temporary_indexes:
+            db[target].drop_index(name)
+    client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import unicodedata
+from typing import List
+
+def normalize_search(text: str) -> str:
+    """Lowercase, accents stripped, single spaces: the form search keys are stored in"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+def search_query_key(query: str) -> str:
+    """Phone-looking queries are matched on digits only, anything else as normalized text"""
+    if any(char.isdigit() for char in query) and all(char.isdigit() or char in " +-.()" for char in query):
+        return "".join(char for char in query if char.isdigit())
+    return normalize_search(query)
+
+def user_search_keys(email: str, name: str, phone: str) -> List[str]:
+    """Indexed prefix keys for admin search: email, full name, each name word and phone digits"""
+    full_name = normalize_search(name)
+    keys = [normalize_search(email), full_name, *full_name.split(" ")]
+    digits = "".join(char for char in phone if char.isdigit())
+    if digits:
+        keys.append(digits)
+    return list(dict.fromkeys(key for key in keys if key))
@@ -0,0 +1,374 @@
+"""Generate a production-scale synthetic dataset to benchmark against.
+
+Users and technicians cluster around French cities, technicians carry
+skills and rates, and interventions span every status with their message
+threads, notifications and payment transactions. The users are split into
+shards that worker processes generate and write independently with
+unordered, batched insert_many, so throughput grows with the number of
+cores. A shard's interventions go to technicians of the same shard.
+
+Every seeded account uses the --password password (hashed once). The
+platform rating counters are totalled once every shard is written; other
+derived data is not: call the admin rebuild endpoints (analytics, pricing,
+payouts) once seeding is done. With --drop, indexes are rebuilt by the API
+on its next startup, which is faster than maintaining them during the load.
+
+    python seed_data.py [--users 1000000] [--workers 8] [--seed 42] [--drop]
+"""
+import os
+import math
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import bcrypt
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from ids import id_for_datetime
+from search import normalize_search, user_search_keys
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+COLLECTIONS = ["users", "interventions", "messages", "notifications", "payment_transactions"]
+COMMISSION_RATE = 0.10
+
+# City: (latitude, longitude, share of the population)
+CITIES = {
+    "Paris": (48.8566, 2.3522, 0.30),
+    "Marseille": (43.2965, 5.3698, 0.09),
+    "Lyon": (45.7640, 4.8357, 0.09),
+    "Toulouse": (43.6047, 1.4442, 0.07),
+    "Nice": (43.7102, 7.2620, 0.05),
+    "Nantes": (47.2184, -1.5536, 0.05),
+    "Strasbourg": (48.5734, 7.7521, 0.05),
+    "Montpellier": (43.6108, 3.8767, 0.05),
+    "Bordeaux": (44.8378, -0.5792, 0.06),
+    "Lille": (50.6292, 3.0573, 0.06),
+    "Rennes": (48.1173, -1.6778, 0.04),
+    "Reims": (49.2583, 4.0317, 0.03),
+    "Grenoble": (45.1885, 5.7245, 0.03),
+    "Dijon": (47.3220, 5.0415, 0.03),
+}
+CITY_SPREAD_DEGREES = 0.08  # standard deviation around the city centre, ~9 km
+
+FIRST_NAMES = ["Jean", "Marie", "Pierre", "Camille", "Lucas", "Léa", "Hugo", "Chloé", "Louis", "Manon",
+               "Thomas", "Emma", "Nicolas", "Inès", "Julien", "Sarah", "Antoine", "Zoé", "Mehdi", "Aïcha",
+               "Karim", "Sophie", "Yanis", "Clément", "Élodie", "François", "Nadia", "Théo", "Margaux", "Rémi"]
+LAST_NAMES = ["Martin", "Bernard", "Dubois", "Thomas", "Robert", "Richard", "Petit", "Durand", "Leroy", "Moreau",
+              "Simon", "Laurent", "Lefèvre", "Michel", "Garcia", "David", "Bertrand", "Roux", "Vincent", "Fournier",
+              "Morel", "Girard", "André", "Mercier", "Dupont", "Lambert", "Bonnet", "François", "Martinez", "Benali"]
+STREETS = ["rue de la République", "avenue Jean Jaurès", "boulevard Victor Hugo", "rue Pasteur", "place de la Mairie",
+           "rue du Général de Gaulle", "avenue de la Gare", "rue des Écoles", "chemin des Vignes", "rue Nationale"]
+SKILLS = {
+    "phone": ["phone", "screen_repair", "battery", "water_damage", "data_recovery"],
+    "computer": ["computer", "virus_removal", "network", "hardware", "software", "data_recovery"],
+}
+ISSUES = {
+    "phone": ["Écran cassé", "Batterie qui ne tient plus", "Téléphone tombé dans l'eau", "Ne charge plus",
+              "Haut-parleur muet", "Récupération de photos"],
+    "computer": ["Ordinateur très lent", "Virus détecté", "Wi-Fi instable", "Écran noir au démarrage",
+                 "Installation d'imprimante", "Disque dur plein"],
+}
+BASE_PRICES = {"phone": 70.0, "computer": 95.0}
+URGENCY_FACTORS = {"low": 0.9, "medium": 1.0, "high": 1.35}
+CHAT_LINES = ["Bonjour, je suis disponible cet après-midi.", "Parfait, à quelle heure ?", "Vers 15h, cela vous convient ?",
+              "Oui c'est parfait.", "Je suis en route.", "J'ai commandé la pièce.", "C'est réparé !", "Merci beaucoup !"]
+
+_clients = {}
+
+def get_db():
+    # One client per worker process
+    pid = os.getpid()
+    if pid not in _clients:
+        _clients[pid] = MongoClient(os.environ['MONGO_URL'])
+    return _clients[pid][os.environ['DB_NAME']]
+
+class BatchWriter:
+    """Buffers documents per collection and writes them with unordered insert_many"""
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.pending = {name: [] for name in COLLECTIONS}
+        self.written = dict.fromkeys(COLLECTIONS, 0)
+
+    def add(self, collection_name, document):
+        batch = self.pending[collection_name]
+        batch.append(document)
+        if len(batch) >= self.batch_size:
+            self.flush(collection_name)
+
+    def flush(self, collection_name=None):
+        for name in [collection_name] if collection_name else COLLECTIONS:
+            if self.pending[name]:
+                self.db[name].insert_many(self.pending[name], ordered=False)
+                self.written[name] += len(self.pending[name])
+                self.pending[name] = []
+
+def geo_point(latitude, longitude):
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+def ascii_name(text):
+    return normalize_search(text).replace(" ", "-")
+
+def random_moment(rng, now, days):
+    # Skewed towards recent dates, like a growing platform
+    return now - timedelta(days=days * rng.random() ** 2, seconds=rng.randrange(86400))
+
+def make_user(rng, shard, index, user_type, city, now, days, password_hash):
+    latitude, longitude, _ = CITIES[city]
+    latitude = round(rng.gauss(latitude, CITY_SPREAD_DEGREES), 6)
+    longitude = round(rng.gauss(longitude, CITY_SPREAD_DEGREES), 6)
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    name = f"{first} {last}"
+    email = f"{ascii_name(first)}.{ascii_name(last)}.{shard}.{index}@seed.example"
+    phone = "0" + rng.choice("67") + " " + " ".join(f"{rng.randrange(100):02d}" for _ in range(4))
+    created_at = random_moment(rng, now, days)
+    user = {
+        "id": id_for_datetime(created_at),
+        "email": email,
+        "name": name,
+        "phone": phone,
+        "user_type": user_type,
+        "address": f"{rng.randrange(1, 120)} {rng.choice(STREETS)}, {city}",
+        "latitude": latitude,
+        "longitude": longitude,
+        "skills": [],
+        "hourly_rate": None,
+        "available": True,
+        "rating": 0.0,
+        "rating_count": 0,
+        "rating_sum": 0.0,
+        "total_interventions": 0,
+        "created_at": created_at,
+        "password": password_hash,
+        "location": geo_point(latitude, longitude),
+        "search_keys": user_search_keys(email, name, phone),
+    }
+    if user_type == "technician":
+        specialities = rng.sample(list(SKILLS), rng.choice([1, 1, 2]))
+        user["skills"] = sorted({skill for speciality in specialities for skill in rng.sample(SKILLS[speciality], 3)})
+        user["hourly_rate"] = float(rng.randrange(25, 80))
+        user["available"] = rng.random() < 0.7
+        user["rating_count"] = int(rng.expovariate(1 / 15))
+        user["rating"] = round(min(5.0, max(1.0, rng.gauss(4.3, 0.5))), 2) if user["rating_count"] else 0.0
+        user["rating_sum"] = user["rating"] * user["rating_count"]
+    return user
+
+def seed_shard(shard, users, options):
+    """Generate and write one shard; returns the number of documents written per collection"""
+    rng = random.Random(options["seed"] * 1_000_003 + shard)
+    writer = BatchWriter(get_db(), options["batch_size"])
+    now = datetime.utcnow()
+    days = options["days"]
+    cities, weights = list(CITIES), [share for _, _, share in CITIES.values()]
+
+    customers = []
+    technicians = {}  # (city, intervention type) -> technicians
+    everyone = []
+    for index in range(users):
+        user_type = "technician" if rng.random() < options["technician_ratio"] else "user"
+        city = rng.choices(cities, weights)[0]
+        user = make_user(rng, shard, index, user_type, city, now, days, options["password_hash"])
+        everyone.append(user)
+        if user_type == "technician":
+            for intervention_type, skills in SKILLS.items():
+                if set(user["skills"]) & set(skills):
+                    technicians.setdefault((city, intervention_type), []).append(user)
+        else:
+            customers.append((user, city))
+    any_technician = [user for user in everyone if user["user_type"] == "technician"]
+
+    def notification(user_id, title, message, kind, data, created_at):
+        read = (now - created_at).days > 3 or rng.random() < 0.5
+        doc = {
+            "id": id_for_datetime(created_at),
+            "user_id": user_id,
+            "title": title,
+            "message": message,
+            "type": kind,
+            "data": data,
+            "read": read,
+            "created_at": created_at,
+        }
+        if read:
+            # The TTL index expires notifications on read_at
+            doc["read_at"] = min(created_at + timedelta(hours=rng.expovariate(1 / 8)), now)
+        writer.add("notifications", doc)
+
+    for user, city in customers:
+        for _ in range(int(rng.expovariate(1 / options["interventions_per_user"]))):
+            created_at = max(random_moment(rng, now, days), user["created_at"])
+            intervention_type = rng.choices(["phone", "computer"], [0.55, 0.45])[0]
+            service_type = rng.choices(["onsite", "remote"], [0.6, 0.4])[0]
+            urgency = rng.choices(["low", "medium", "high"], [0.3, 0.5, 0.2])[0]
+            middle = BASE_PRICES[intervention_type] * URGENCY_FACTORS[urgency]
+            age_days = (now - created_at).days
+            if age_days < 7:
+                status = rng.choices(["pending", "assigned", "in_progress", "completed", "cancelled"], [30, 20, 15, 30, 5])[0]
+            else:
+                status = rng.choices(["completed", "cancelled"], [85, 15])[0]
+
+            title = rng.choice(ISSUES[intervention_type])
+            intervention = {
+                "id": id_for_datetime(created_at),
+                "user_id": user["id"],
+                "technician_id": None,
+                "title": title,
+                "description": f"{title}. Merci de me contacter rapidement.",
+                "intervention_type": intervention_type,
+                "service_type": service_type,
+                "urgency": urgency,
+                "budget_min": round(middle * 0.7),
+                "budget_max": round(middle * 1.4),
+                "final_price": None,
+                "status": status,
+                "user_address": user["address"],
+                "user_latitude": user["latitude"],
+                "user_longitude": user["longitude"],
+                "user_location": geo_point(user["latitude"], user["longitude"]),
+                "created_at": created_at,
+                "assigned_at": None,
+                "completed_at": None,
+            }
+
+            pool = technicians.get((city, intervention_type)) or any_technician
+            technician = None
+            if status != "pending" and pool and not (status == "cancelled" and rng.random() < 0.5):
+                technician = rng.choice(pool)
+                assigned_at = min(created_at + timedelta(minutes=rng.expovariate(1 / 45)), now)
+                intervention["technician_id"] = technician["id"]
+                intervention["assigned_at"] = assigned_at
+                notification(user["id"], "Intervention acceptée", f"Un technicien a accepté votre demande « {title} »",
+                             "success", {"intervention_id": intervention["id"]}, assigned_at)
+            elif status != "pending":
+                status = intervention["status"] = "cancelled"
+
+            if status == "completed":
+                completed_at = min(intervention["assigned_at"] + timedelta(hours=rng.expovariate(1 / 20)), now)
+                final_price = round(max(15.0, rng.lognormvariate(math.log(middle), 0.35)), 2)
+                intervention.update(completed_at=completed_at, final_price=final_price, completion_counted=True)
+                technician["total_interventions"] += 1
+                notification(user["id"], "Statut de l'intervention mis à jour",
+                             f"L'intervention « {title} » est maintenant : completed", "info",
+                             {"intervention_id": intervention["id"], "status": "completed"}, completed_at)
+
+                payment_status = rng.choices(["paid", "pending", "expired", "failed"], [85, 5, 5, 5])[0]
+                paid_at = min(completed_at + timedelta(minutes=rng.expovariate(1 / 30)), now)
+                commission_amount = round(final_price * COMMISSION_RATE, 2)
+                payment_id = id_for_datetime(completed_at)
+                writer.add("payment_transactions", {
+                    "id": payment_id,
+                    "intervention_id": intervention["id"],
+                    "user_id": user["id"],
+                    "technician_id": technician["id"],
+                    "session_id": f"cs_seed_{payment_id}",
+                    "amount": final_price,
+                    "currency": "eur",
+                    "commission_amount": commission_amount,
+                    "technician_amount": round(final_price - commission_amount, 2),
+                    "payment_status": payment_status,
+                    "metadata": {"intervention_id": intervention["id"], "user_id": user["id"],
+                                 "technician_id": technician["id"], "commission_rate": str(COMMISSION_RATE)},
+                    "created_at": completed_at,
+                    "updated_at": paid_at,
+                })
+                if payment_status == "paid":
+                    notification(technician["id"], "Paiement reçu",
+                                 f"Un paiement de {final_price - commission_amount:.2f} € vous a été versé", "success",
+                                 {"intervention_id": intervention["id"]}, paid_at)
+            elif status == "cancelled":
+                intervention.update(cancelled_at=created_at + timedelta(hours=rng.expovariate(1 / 12)), cancellation_counted=True)
+
+            if technician is not None:
+                # Thread between assignment and completion (or now)
+                sent_at = intervention["assigned_at"]
+                thread_end = intervention["completed_at"] or now
+                for position in range(int(rng.expovariate(1 / options["messages_per_intervention"]))):
+                    sent_at = min(sent_at + timedelta(minutes=rng.expovariate(1 / 20)), thread_end)
+                    from_user = position % 2 == 0
+                    writer.add("messages", {
+                        "id": id_for_datetime(sent_at),
+                        "intervention_id": intervention["id"],
+                        "sender_id": user["id"] if from_user else technician["id"],
+                        "sender_type": "user" if from_user else "technician",
+                        "content": rng.choice(CHAT_LINES),
+                        "created_at": sent_at,
+                    })
+
+            writer.add("interventions", intervention)
+
+    # Users last, once the technicians' counters are known
+    for user in everyone:
+        writer.add("users", user)
+    writer.flush()
+    return writer.written
+
+def write_rating_stats(db):
+    """Platform rating counters read by the admin dashboard, totalled over the seeded technicians"""
+    totals = next(db.users.aggregate([
+        {"$match": {"user_type": "technician"}},
+        {"$group": {"_id": None, "rating_sum": {"$sum": "$rating_sum"}, "rating_count": {"$sum": "$rating_count"}}}
+    ]), {"rating_sum": 0, "rating_count": 0})
+    db.platform_stats.update_one(
+        {"_id": "ratings"},
+        {"$set": {"rating_sum": totals["rating_sum"], "rating_count": totals["rating_count"]}},
+        upsert=True
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a synthetic production-scale dataset")
+    parser.add_argument("--users", type=int, default=100_000, help="users and technicians in total")
+    parser.add_argument("--technician-ratio", type=float, default=0.1)
+    parser.add_argument("--interventions-per-user", type=float, default=2.0, help="mean per customer")
+    parser.add_argument("--messages-per-intervention", type=float, default=6.0, help="mean per assigned intervention")
+    parser.add_argument("--days", type=int, default=365, help="history length")
+    parser.add_argument("--shard-size", type=int, default=10_000, help="users generated per task")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default="password123", help="password of every seeded account")
+    parser.add_argument("--drop", action="store_true", help="drop the seeded collections first")
+    args = parser.parse_args()
+
+    if args.drop:
+        db = get_db()
+        for name in COLLECTIONS:
+            db.drop_collection(name)
+
+    options = {
+        "seed": args.seed,
+        "technician_ratio": args.technician_ratio,
+        "interventions_per_user": args.interventions_per_user,
+        "messages_per_intervention": args.messages_per_intervention,
+        "days": args.days,
+        "batch_size": args.batch_size,
+        # bcrypt per account would dominate the run
+        "password_hash": bcrypt.hashpw(args.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+    }
+    shards = [
+        (shard, min(args.shard_size, args.users - start))
+        for shard, start in enumerate(range(0, args.users, args.shard_size))
+    ]
+
+    started = time.monotonic()
+    totals = dict.fromkeys(COLLECTIONS, 0)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(seed_shard, shard, users, options) for shard, users in shards]
+        for done, future in enumerate(as_completed(futures), 1):
+            for name, count in future.result().items():
+                totals[name] += count
+            print(f"shard {done}/{len(shards)}: " + ", ".join(f"{name} {count}" for name, count in totals.items()))
+
+    write_rating_stats(get_db())
+    elapsed = time.monotonic() - started
+    documents = sum(totals.values())
+    print(f"{documents} documents in {elapsed:.1f}s ({documents / elapsed:.0f}/s)")
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,46 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import compile_path
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
+import sys
+import threading
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-import uuid
-from datetime import datetime, timedelta
-import bcrypt
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Tuple, Callable
+import io
+import csv
+import json
+import math
+import time
+import random
+import base64
+import zlib
+import hashlib
+import ipaddress
+import multiprocessing
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
 import jwt
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure, CollectionInvalid
+from ids import new_id
+from search import search_query_key, user_search_keys
+from passwords import hash_password, hash_passwords, verify_password
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from storage import MotorStorage, MemoryStorage, current_session, current_read_preference, for_reads
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionRequest
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -21,12 +49,149 @@ load_dotenv(ROOT_DIR / '.env')
 JWT_SECRET = "your-secret-key-here-change-in-production"
 JWT_ALGORITHM = "HS256"
 COMMISSION_RATE = 0.10
+FEED_DEFAULT_RADIUS_KM = float(os.environ.get('FEED_DEFAULT_RADIUS_KM', 20))
+FEED_MAX_LIMIT = 100
+BULK_CHUNK_SIZE = 500
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+
+# Rate limiting: token bucket budgets as [capacity, tokens refilled per second]
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')  # local, mongo
+RATE_LIMITS = {
+    "ip": [300, 5.0],
+    "user": [120, 2.0],
+    "routes": {
+        # route path: budgets per client IP and for the route as a whole
+        "/api/auth/login": {"ip": [10, 0.2], "route": [200, 20.0]},
+        "/api/auth/register": {"ip": [5, 0.05], "route": [100, 5.0]}
+    }
+}
+RATE_LIMITS.update(json.loads(os.environ.get('RATE_LIMITS', '{}')))
+# Reverse proxies (addresses or CIDR ranges, comma separated) whose X-Forwarded-For is believed
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(value.strip(), strict=False)
+    for value in os.environ.get('TRUSTED_PROXIES', '').split(',') if value.strip()
+]
+
+# Price suggestions
+PRICING_RELATIVE_ACCURACY = 0.01  # quantiles are within 1% of the exact value
+PRICING_CELL_DEGREES = float(os.environ.get('PRICING_CELL_DEGREES', 0.5))  # region cell size, ~50 km
+PRICING_MIN_SAMPLES = int(os.environ.get('PRICING_MIN_SAMPLES', 20))  # below this, quote a wider level
+PRICING_REFRESH_SECONDS = 60
+
+# Load shedding: route groups as [concurrent requests, queued requests, queue deadline in ms, priority]
+# Priority 0 is always admitted up to its own limit; the others also wait while the
+# process has ADMISSION_MAX_IN_FLIGHT requests running, and are served in priority order
+ADMISSION_GROUPS = {
+    "critical": [64, 256, 5000, 0],
+    "default": [128, 128, 2000, 1],
+    "polling": [48, 48, 250, 2],
+    "bulk": [4, 4, 1000, 2]
+}
+ADMISSION_GROUPS.update(json.loads(os.environ.get('ADMISSION_GROUPS', '{}')))
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 160))
+ADMISSION_ROUTES = {
+    # "METHOD route path": group; unlisted routes are "default"
+    "POST /api/payments/checkout/session": "critical",
+    "GET /api/payments/checkout/status/{session_id}": "critical",
+    "PUT /api/interventions/{intervention_id}/assign": "critical",
+    "PUT /api/interventions/{intervention_id}/status": "critical",
+    "GET /api/notifications": "polling",
+    "GET /api/interventions": "polling",
+    "GET /api/interventions/feed": "polling",
+    "GET /api/messages/{intervention_id}": "polling",
+    "PUT /api/technicians/location": "polling",
+    "POST /api/admin/users/import": "bulk",
+    "GET /api/admin/export/payments": "bulk",
+    "GET /api/admin/export/interventions": "bulk",
+    "POST /api/admin/analytics/rebuild": "bulk",
+    "POST /api/admin/pricing/rebuild": "bulk",
+    "POST /api/admin/payouts/rebuild": "bulk"
+}
+ADMISSION_ROUTES.update(json.loads(os.environ.get('ADMISSION_ROUTES', '{}')))
+
+# Read routing (replica sets): listed endpoints read with their read preference, from members
+# at most READ_MAX_STALENESS_SECONDS behind the primary; unlisted endpoints read from the primary.
+# Requests run in causally consistent sessions, so routed reads still see the caller's own writes
+READ_MAX_STALENESS_SECONDS = max(90, int(os.environ.get('READ_MAX_STALENESS_SECONDS', 90)))  # 90 is MongoDB's minimum
+READ_PREFERENCES = {
+    # "METHOD route path": primary, primaryPreferred, secondary, secondaryPreferred or nearest
+    "GET /api/admin/dashboard": "secondaryPreferred",
+    "GET /api/admin/bootstrap": "secondaryPreferred",
+    "GET /api/admin/users": "secondaryPreferred",
+    "GET /api/admin/interventions": "secondaryPreferred",
+    "GET /api/admin/payments": "secondaryPreferred",
+    "GET /api/admin/analytics/timeseries": "secondaryPreferred",
+    "GET /api/admin/export/payments": "secondaryPreferred",
+    "GET /api/admin/export/interventions": "secondaryPreferred",
+    "GET /api/technicians/{technician_id}/earnings": "secondaryPreferred",
+    "GET /api/technicians/{technician_id}/earnings/{month}/statement": "secondaryPreferred"
+}
+READ_PREFERENCES.update(json.loads(os.environ.get('READ_PREFERENCES', '{}')))
+CAUSAL_CLOCK_SIZE = 100000  # users whose last cluster time is kept
+
+# Payment reconciliation
+RECONCILE_INTERVAL_SECONDS = int(os.environ.get('RECONCILE_INTERVAL_SECONDS', 900))
+RECONCILE_STALE_AFTER_MINUTES = 30
+RECONCILE_SESSION_LIFETIME_HOURS = 24  # Stripe checkout sessions expire after 24h
+RECONCILE_PAGE_SIZE = 200
+RECONCILE_CONCURRENCY = 10
+
+# Data lifecycle
+NOTIFICATION_TTL_DAYS = int(os.environ.get('NOTIFICATION_TTL_DAYS', 30))
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_INTERVAL_SECONDS = 24 * 3600
+ARCHIVABLE_STATUSES = {"completed": "completed_at", "cancelled": "cancelled_at", "resolved_by_admin": "resolved_at"}  # status -> its closing timestamp
+
+# Response compression
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4  # fast enough to run per request
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+# Request profiling: off unless a sample rate is set or an admin sends "X-Profile: 1"
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # fraction of requests, 0 to 1
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_COLLECTION_BYTES = 64 * 1024 * 1024  # capped: oldest profiles are dropped first
+PROFILE_MEMORY_CAPACITY = 200
+
+# Participant ACL cache
+PARTICIPANT_CACHE_SIZE = int(os.environ.get('PARTICIPANT_CACHE_SIZE', 50000))
+PARTICIPANT_CACHE_TTL_SECONDS = 60
+
+# Chat message group commit (0 disables batching)
+MESSAGE_BATCH_WINDOW_MS = float(os.environ.get('MESSAGE_BATCH_WINDOW_MS', 0))
+MESSAGE_BATCH_MAX_SIZE = int(os.environ.get('MESSAGE_BATCH_MAX_SIZE', 500))
+
+# Background task queue
+TASK_MAX_ATTEMPTS = 5
+TASK_LEASE_SECONDS = 60
+TASK_BACKOFF_BASE_SECONDS = 2
+TASK_BACKOFF_MAX_SECONDS = 600
+TASK_POLL_INTERVAL_SECONDS = 5
+TASK_CONCURRENCY = {
+    # task type: maximum number running at once in this process
+    "notify": 8
+}
+# Enough workers by default for every type to reach its limit at once
+TASK_WORKERS = int(os.environ.get('TASK_WORKERS', sum(TASK_CONCURRENCY.values())))
+
+# Technician live location: pings stay in memory, moves beyond the threshold are persisted in bulk
+LOCATION_PERSIST_DISTANCE_M = float(os.environ.get('LOCATION_PERSIST_DISTANCE_M', 100))
+LOCATION_FLUSH_INTERVAL_SECONDS = float(os.environ.get('LOCATION_FLUSH_INTERVAL_SECONDS', 5))
+LOCATION_LIVE_TTL_SECONDS = 300  # older pings no longer override the stored position
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Core collections go through the repository layer; "memory" runs the API without MongoDB
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')  # mongo, memory
+repos = MemoryStorage() if STORAGE_BACKEND == "memory" else MotorStorage(db)
+
 # Stripe initialization
 stripe_api_key = os.environ['STRIPE_SECRET_KEY']
 stripe_checkout = StripeCheckout(api_key=stripe_api_key)
@@ -66,6 +231,10 @@ class PaymentStatus(str):
     PAID = "paid"
     FAILED = "failed"
     CANCELLED = "cancelled"
+    EXPIRED = "expired"
+
+# Anything else ("pending", or Stripe's own "unpaid" stored by status polls) can still settle
+PAYMENT_FINAL_STATUSES = [PaymentStatus.PAID, PaymentStatus.FAILED, PaymentStatus.CANCELLED, PaymentStatus.EXPIRED]
 
 # User Models
 class UserCreate(BaseModel):
@@ -86,7 +255,7 @@ class UserLogin(BaseModel):
     password: str
 
 class User(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     email: str
     name: str
     phone: str
@@ -98,6 +267,7 @@ class User(BaseModel):
     hourly_rate: Optional[float] = None
     available: Optional[bool] = True
     rating: Optional[float] = 0.0
+    rating_count: Optional[int] = 0
     total_interventions: Optional[int] = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -115,7 +285,7 @@ class InterventionCreate(BaseModel):
     user_longitude: Optional[float] = None
 
 class Intervention(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     user_id: str
     technician_id: Optional[str] = None
     title: str
@@ -136,7 +306,7 @@ class Intervention(BaseModel):
 
 # Payment Models
 class PaymentTransaction(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     intervention_id: str
     user_id: str
     technician_id: Optional[str] = None
@@ -149,6 +319,7 @@ class PaymentTransaction(BaseModel):
     metadata: Optional[Dict[str, Any]] = {}
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    paid_at: Optional[datetime] = None
 
 class PaymentCreate(BaseModel):
     intervention_id: str
@@ -159,20 +330,29 @@ class MessageCreate(BaseModel):
     content: str
 
 class Message(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     intervention_id: str
     sender_id: str
     sender_type: str  # user, technician
     content: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
-# Utility functions
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# Review Models
+class ReviewCreate(BaseModel):
+    intervention_id: str
+    rating: int = Field(ge=1, le=5)
+    comment: Optional[str] = None
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+class Review(BaseModel):
+    id: str = Field(default_factory=new_id)
+    intervention_id: str
+    user_id: str
+    technician_id: str
+    rating: int
+    comment: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Utility functions
 def create_token(user_id: str, user_type: str) -> str:
     payload = {
         "user_id": user_id,
@@ -191,7 +371,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if user_id is None:
             raise HTTPException(status_code=401, detail="Token invalide")
         
-        user = await db.users.find_one({"id": user_id})
+        user = await repos.users.get(user_id)
         if user is None:
             raise HTTPException(status_code=401, detail="Utilisateur non trouvé")
         
@@ -213,19 +393,1009 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     return R * c
 
+def geo_point(latitude: Optional[float], longitude: Optional[float]) -> Optional[Dict[str, Any]]:
+    """GeoJSON point used by the 2dsphere indexes (longitude first)"""
+    if latitude is None or longitude is None:
+        return None
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+def build_user_document(user: User, hashed_password: str) -> Dict[str, Any]:
+    user_dict = user.dict()
+    user_dict["password"] = hashed_password
+    user_dict["location"] = geo_point(user.latitude, user.longitude)
+    user_dict["search_keys"] = user_search_keys(user.email, user.name, user.phone)
+    return user_dict
+
+async def backfill_user_search_keys():
+    """Search keys for users created before admin search existed"""
+    query = {"search_keys": {"$exists": False}}
+    while True:
+        users = await db.users.find(query, {"_id": 0, "id": 1, "email": 1, "name": 1, "phone": 1}).limit(BULK_CHUNK_SIZE).to_list(BULK_CHUNK_SIZE)
+        if not users:
+            break
+        await db.users.bulk_write([
+            UpdateOne({"id": user["id"]}, {"$set": {
+                "search_keys": user_search_keys(user.get("email", ""), user.get("name", ""), user.get("phone", ""))
+            }})
+            for user in users
+        ], ordered=False)
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data, default=str).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Decode a cursor and check it holds each field with the expected type"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    if not isinstance(data, dict) or not all(isinstance(data.get(name), kind) for name, kind in fields.items()):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    return data
+
+async def replace_collection(name: str, documents: List[Dict[str, Any]]):
+    """Swap a rebuilt derived collection in with one rename, so readers never see it empty or half written"""
+    staging = db[f"{name}_rebuild"]
+    await staging.drop()
+    if not documents:
+        await db[name].delete_many({})
+        return
+    async for index in db[name].list_indexes():
+        if index["name"] != "_id_":
+            await staging.create_index(list(index["key"].items()), name=index["name"])
+    for start in range(0, len(documents), BULK_CHUNK_SIZE):
+        await staging.insert_many(documents[start:start + BULK_CHUNK_SIZE], ordered=False)
+    await staging.rename(name, dropTarget=True)
+
+# Metrics exposed through /admin/metrics; subsystems register a snapshot callable
+metrics_sources: Dict[str, Callable[[], Any]] = {}
+
+def mongo_only():
+    """Dependency for endpoints that work on MongoDB-only collections (rollups, payouts, archives)"""
+    if STORAGE_BACKEND == "memory":
+        raise HTTPException(status_code=501, detail="Indisponible avec le stockage en mémoire")
+
+# Rate limiting
+class LocalRateLimitBackend:
+    """Per-process token buckets; enough for a single worker and for tests"""
+    
+    PRUNE_EVERY = 10000
+    
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float, float, float]] = {}
+        self.takes = 0
+    
+    def _refill(self, key: str, capacity: float, rate: float, now: float) -> float:
+        tokens, updated, _, _ = self.buckets.get(key, (capacity, now, capacity, rate))
+        return min(capacity, tokens + (now - updated) * rate)
+    
+    async def take(self, key: str, capacity: float, rate: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens = self._refill(key, capacity, rate, now)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now, capacity, rate)
+        
+        self.takes += 1
+        if self.takes % self.PRUNE_EVERY == 0:
+            self.prune(now)
+        
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+    
+    def prune(self, now: float):
+        # Full buckets carry no state worth keeping
+        for key, (_, _, capacity, rate) in list(self.buckets.items()):
+            if self._refill(key, capacity, rate, now) >= capacity:
+                del self.buckets[key]
+    
+    async def occupancy(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        levels = [
+            (self._refill(key, capacity, rate, now), capacity)
+            for key, (_, _, capacity, rate) in self.buckets.items()
+        ]
+        return {
+            "buckets": len(levels),
+            "mean_fill": round(sum(tokens / capacity for tokens, capacity in levels) / len(levels), 3) if levels else 1.0,
+            "empty_buckets": sum(1 for tokens, _ in levels if tokens < 1)
+        }
+
+class MongoRateLimitBackend:
+    """Token buckets shared by every worker, refilled atomically inside one update"""
+    
+    def __init__(self, collection):
+        self.collection = collection
+    
+    async def take(self, key: str, capacity: float, rate: float) -> Tuple[bool, float]:
+        now = datetime.utcnow()
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}, rate]}
+        ]}]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"refilled": refilled}},
+                {"$set": {
+                    "allowed": {"$gte": ["$refilled", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$refilled", 1]}, {"$subtract": ["$refilled", 1]}, "$refilled"]},
+                    "capacity": capacity,
+                    "updated_at": now,
+                    "expires_at": now + timedelta(seconds=capacity / rate)
+                }},
+                {"$unset": "refilled"}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (1 - bucket["tokens"]) / rate
+    
+    async def occupancy(self) -> Dict[str, Any]:
+        pipeline = [{"$group": {
+            "_id": None,
+            "buckets": {"$sum": 1},
+            "mean_fill": {"$avg": {"$divide": ["$tokens", "$capacity"]}},
+            "empty_buckets": {"$sum": {"$cond": [{"$lt": ["$tokens", 1]}, 1, 0]}}
+        }}]
+        result = await self.collection.aggregate(pipeline).to_list(1)
+        if not result:
+            return {"buckets": 0, "mean_fill": 1.0, "empty_buckets": 0}
+        result[0].pop("_id")
+        result[0]["mean_fill"] = round(result[0]["mean_fill"], 3)
+        return result[0]
+
+rate_limit_backend = (
+    MongoRateLimitBackend(db.rate_limits) if RATE_LIMIT_BACKEND == "mongo" else LocalRateLimitBackend()
+)
+rate_limit_decisions: Dict[str, Dict[str, int]] = {}
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if not forwarded_for or not is_trusted_proxy(peer):
+        return peer
+    # Clients can prepend anything: the right-most hop our own proxies did not add is the client
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+def token_user_id(request: Request) -> Optional[str]:
+    # Signature check only: the limiter must stay cheaper than the handlers it protects
+    authorization = request.headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.decode(authorization[7:], JWT_SECRET, algorithms=[JWT_ALGORITHM]).get("user_id")
+    except jwt.PyJWTError:
+        return None
+
+async def enforce_rate_limits(request: Request):
+    route = request.scope.get("route")
+    route_path = getattr(route, "path", request.url.path)
+    ip = client_ip(request)
+    user_id = token_user_id(request)
+    route_limits = RATE_LIMITS["routes"].get(route_path, {})
+    
+    # Narrowest first: the shared route budget is only charged once the client's own budgets
+    # have passed, so one client hammering a route cannot lock everyone else out of it
+    checks = []
+    if "ip" in route_limits:
+        checks.append(("route_ip", f"route_ip:{route_path}:{ip}", route_limits["ip"]))
+    checks.append(("ip", f"ip:{ip}", RATE_LIMITS["ip"]))
+    if user_id:
+        checks.append(("user", f"user:{user_id}", RATE_LIMITS["user"]))
+    if "route" in route_limits:
+        checks.append(("route", f"route:{route_path}", route_limits["route"]))
+    
+    for scope, key, (capacity, rate) in checks:
+        allowed, retry_after = await rate_limit_backend.take(key, capacity, rate)
+        decisions = rate_limit_decisions.setdefault(scope, {"allowed": 0, "denied": 0})
+        if not allowed:
+            decisions["denied"] += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Trop de requêtes, veuillez réessayer plus tard",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+        decisions["allowed"] += 1
+
+async def rate_limit_metrics() -> Dict[str, Any]:
+    return {
+        "backend": RATE_LIMIT_BACKEND,
+        "decisions": rate_limit_decisions,
+        "occupancy": await rate_limit_backend.occupancy()
+    }
+
+metrics_sources["rate_limits"] = rate_limit_metrics
+
+# Load shedding
+class AdmissionGroup:
+    def __init__(self, name: str, limit: int, queue_size: int, max_wait_ms: float, priority: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait_ms / 1000
+        self.priority = priority
+        self.active = 0
+        self.waiters: deque = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+    
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": len(self.waiters),
+            "saturation": round(self.active / self.limit, 3) if self.limit else 1.0,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "mean_wait_ms": round(self.wait_seconds / self.queued * 1000, 2) if self.queued else 0
+        }
+
+class AdmissionController:
+    """Concurrency limits per route group with bounded, deadline-limited FIFO queues.
+
+    A request that finds its group's queue full is rejected at once; one that
+    waits past the group's deadline is rejected too, before any work is done.
+    Freed slots go to waiting groups in priority order.
+    """
+    
+    def __init__(self, groups: Dict[str, List[float]], max_in_flight: int):
+        self.groups = {name: AdmissionGroup(name, *settings) for name, settings in groups.items()}
+        self.by_priority = sorted(self.groups.values(), key=lambda group: group.priority)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+    
+    def _admissible(self, group: AdmissionGroup) -> bool:
+        return group.active < group.limit and (group.priority == 0 or self.in_flight < self.max_in_flight)
+    
+    def _admit(self, group: AdmissionGroup):
+        group.active += 1
+        group.admitted += 1
+        self.in_flight += 1
+    
+    async def acquire(self, group: AdmissionGroup) -> bool:
+        if not group.waiters and self._admissible(group):
+            self._admit(group)
+            return True
+        if len(group.waiters) >= group.queue_size:
+            group.rejected += 1
+            return False
+        
+        future = asyncio.get_running_loop().create_future()
+        group.waiters.append(future)
+        group.queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait((future,), timeout=group.max_wait)
+        except asyncio.CancelledError:
+            # Client went away while queued
+            if future.done():
+                self.release(group)
+            else:
+                group.waiters.remove(future)
+            raise
+        finally:
+            group.wait_seconds += time.monotonic() - started
+        if future.done():
+            return True
+        group.waiters.remove(future)
+        group.timed_out += 1
+        return False
+    
+    def release(self, group: AdmissionGroup):
+        group.active -= 1
+        self.in_flight -= 1
+        for candidate in self.by_priority:
+            while candidate.waiters and self._admissible(candidate):
+                self._admit(candidate)
+                candidate.waiters.popleft().set_result(None)
+    
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "groups": {name: group.metrics() for name, group in self.groups.items()}
+        }
+
+admission_controller = AdmissionController(ADMISSION_GROUPS, ADMISSION_MAX_IN_FLIGHT)
+metrics_sources["admission"] = admission_controller.metrics
+
+class AdmissionMiddleware:
+    """Sheds load with a fast 503 before routing, body parsing or authentication"""
+    
+    def __init__(self, app):
+        self.app = app
+        self.routes = [
+            (key.split(" ", 1)[0], compile_path(key.split(" ", 1)[1])[0], admission_controller.groups[group])
+            for key, group in ADMISSION_ROUTES.items()
+        ]
+        self.default_group = admission_controller.groups["default"]
+    
+    def _group(self, scope) -> AdmissionGroup:
+        for method, pattern, group in self.routes:
+            if scope["method"] == method and pattern.match(scope["path"]):
+                return group
+        return self.default_group
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            return await self.app(scope, receive, send)
+        
+        group = self._group(scope)
+        if not await admission_controller.acquire(group):
+            body = json.dumps({"detail": "Service surchargé, veuillez réessayer"}, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"retry-after", b"1")
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_controller.release(group)
+
+# Read routing
+READ_PREFERENCE_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+
+def read_preference(mode: str):
+    if mode == "primary":
+        return Primary()
+    return READ_PREFERENCE_MODES[mode](max_staleness=READ_MAX_STALENESS_SECONDS)
+
+class CausalClock:
+    """Last cluster and operation time of each user's requests (LRU).
+
+    A request's session starts from its user's last times, so a read routed to
+    a secondary waits until that member has applied the user's earlier writes.
+    The clock is per process: with several workers, route a user to one of them.
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.times: OrderedDict = OrderedDict()
+        self.resumed = 0
+    
+    def resume(self, user_id: Optional[str], session):
+        times = self.times.get(user_id) if user_id else None
+        if times is None:
+            return
+        self.times.move_to_end(user_id)
+        session.advance_cluster_time(times[0])
+        session.advance_operation_time(times[1])
+        self.resumed += 1
+    
+    def record(self, user_id: Optional[str], session):
+        if not user_id or session.cluster_time is None or session.operation_time is None:
+            return
+        previous = self.times.get(user_id)
+        if previous is None or previous[1] < session.operation_time:
+            self.times[user_id] = (session.cluster_time, session.operation_time)
+        self.times.move_to_end(user_id)
+        if len(self.times) > self.max_size:
+            self.times.popitem(last=False)
+
+causal_clock = CausalClock(CAUSAL_CLOCK_SIZE)
+read_routing_stats: Counter = Counter()
+
+async def gather_reads(*coroutines):
+    """asyncio.gather for reads in the request session.
+
+    A session runs one operation at a time, so each branch gets its own
+    session, started from the request's times and folded back into them.
+    """
+    parent = current_session.get()
+    if parent is None:
+        return await asyncio.gather(*coroutines)
+    
+    async def branch(coroutine):
+        async with await client.start_session(causal_consistency=True) as session:
+            if parent.cluster_time is not None:
+                session.advance_cluster_time(parent.cluster_time)
+                session.advance_operation_time(parent.operation_time)
+            current_session.set(session)  # task-local: gather runs each branch in its own task
+            try:
+                return await coroutine
+            finally:
+                if session.cluster_time is not None:
+                    parent.advance_cluster_time(session.cluster_time)
+                    parent.advance_operation_time(session.operation_time)
+    
+    return await asyncio.gather(*(branch(coroutine) for coroutine in coroutines))
+
+class ReadRoutingMiddleware:
+    """Runs each API request in a causally consistent session, with its route's read preference"""
+    
+    def __init__(self, app):
+        self.app = app
+        self.routes = [
+            (key.split(" ", 1)[0], compile_path(key.split(" ", 1)[1])[0], read_preference(mode))
+            for key, mode in READ_PREFERENCES.items()
+        ]
+    
+    def _preference(self, scope):
+        for method, pattern, preference in self.routes:
+            if scope["method"] == method and pattern.match(scope["path"]):
+                return preference
+        return None
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or STORAGE_BACKEND == "memory" or not scope["path"].startswith("/api/"):
+            return await self.app(scope, receive, send)
+        
+        preference = self._preference(scope)
+        read_routing_stats[preference.mongos_mode if preference else "primary"] += 1
+        user_id = token_user_id(Request(scope))
+        
+        async with await client.start_session(causal_consistency=True) as session:
+            causal_clock.resume(user_id, session)
+            
+            async def send_and_record(message):
+                # Before the client sees the response, so its next request starts after this one
+                if message["type"] == "http.response.start":
+                    causal_clock.record(user_id, session)
+                await send(message)
+            
+            session_token = current_session.set(session)
+            preference_token = current_read_preference.set(preference)
+            try:
+                await self.app(scope, receive, send_and_record)
+            finally:
+                current_read_preference.reset(preference_token)
+                current_session.reset(session_token)
+
+def read_routing_metrics() -> Dict[str, Any]:
+    return {
+        "max_staleness_seconds": READ_MAX_STALENESS_SECONDS,
+        "requests": dict(read_routing_stats),
+        "causal_clock_users": len(causal_clock.times),
+        "sessions_resumed": causal_clock.resumed
+    }
+
+metrics_sources["read_routing"] = read_routing_metrics
+
+# Response compression
+def no_compression(endpoint):
+    """Opt a route out of response compression"""
+    endpoint.no_compression = True
+    return endpoint
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    
+    def chunk(self, data: bytes) -> bytes:
+        # Flushed per chunk so streamed rows reach the client as they are produced
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+    
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.finish()
+        return self.compressor.compress(data) + self.compressor.flush()
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+class CompressionMiddleware:
+    """gzip/brotli by Accept-Encoding, for whole bodies over a size threshold and for streams"""
+    
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        encoding = negotiate_encoding(headers.get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        
+        start_message = None
+        compressor = None
+        passthrough = False
+        
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                response_headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in message.get("headers", [])}
+                content_type = response_headers.get("content-type", "")
+                passthrough = (
+                    "content-encoding" in response_headers or
+                    message["status"] < 200 or message["status"] in (204, 304) or
+                    not content_type.startswith(COMPRESSIBLE_TYPES) or
+                    getattr(scope.get("endpoint"), "no_compression", False)
+                )
+                if passthrough:
+                    await send(message)
+                return
+            
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    # Small complete body: not worth the CPU
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                response_headers = [
+                    (key, value) for key, value in start_message.get("headers", [])
+                    if key.lower() not in (b"content-length", b"vary")
+                ]
+                vary = [value for key, value in start_message.get("headers", []) if key.lower() == b"vary"]
+                response_headers.append((b"content-encoding", encoding.encode("latin-1")))
+                response_headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+                if not more_body:
+                    compressed = compressor.finish(body)
+                    response_headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+                    await send({**start_message, "headers": response_headers})
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send({**start_message, "headers": response_headers})
+            
+            if more_body:
+                await send({"type": "http.response.body", "body": compressor.chunk(body), "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": compressor.finish(body)})
+        
+        await self.app(scope, receive, send_compressed)
+
+# Request profiling
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+class RequestProfiler:
+    """Samples the stacks of profiled request tasks from a background thread.
+
+    While the task runs, its real call stack is recorded; while it is suspended
+    (awaiting MongoDB, Stripe or the scheduler) its chain of awaiting coroutines
+    is recorded with an [await] leaf, so I/O shows up in the profile. The thread
+    only starts with the first profiled request and idles when none is active.
+    """
+    
+    def __init__(self, interval_ms: float):
+        self.interval = interval_ms / 1000
+        self.active: Dict[asyncio.Task, Counter] = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.captured = 0
+    
+    def start(self, task: asyncio.Task):
+        with self.lock:
+            self.loop = task.get_loop()
+            self.loop_thread_id = threading.get_ident()
+            self.active[task] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._sample_forever, name="request-profiler", daemon=True)
+                self.thread.start()
+        self.wake.set()
+    
+    def stop(self, task: asyncio.Task) -> Counter:
+        """The task's samples; the sampler only writes counters under the lock, so it is done with them"""
+        with self.lock:
+            samples = self.active.pop(task, Counter())
+            if not self.active:
+                self.wake.clear()
+        self.captured += 1
+        return samples
+    
+    def _sample_forever(self):
+        while True:
+            self.wake.wait()
+            time.sleep(self.interval)
+            with self.lock:
+                active = list(self.active)
+            if not active:
+                continue
+            running = asyncio.current_task(self.loop)
+            thread_frame = sys._current_frames().get(self.loop_thread_id)
+            stacks = []
+            for task in active:
+                stack = self._running_stack(task, thread_frame) if task is running else self._awaiting_stack(task)
+                if stack:
+                    stacks.append((task, ";".join(stack)))
+            with self.lock:
+                # Tasks stopped while their stacks were walked have handed their counters over
+                for task, stack in stacks:
+                    if task in self.active:
+                        self.active[task][stack] += 1
+    
+    @staticmethod
+    def _running_stack(task: asyncio.Task, frame) -> List[str]:
+        # Thread stack from the task's outermost coroutine up to the executing frame
+        root = getattr(task.get_coro(), "cr_frame", None)
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            if frame is root:
+                break
+            frame = frame.f_back
+        return labels[::-1]
+    
+    @staticmethod
+    def _awaiting_stack(task: asyncio.Task) -> List[str]:
+        labels = []
+        awaitable = task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None) or getattr(awaitable, "ag_frame", None)
+            if frame is not None:
+                labels.append(_frame_label(frame))
+            awaitable = (getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+                         or getattr(awaitable, "ag_await", None))
+        if labels:
+            labels.append("[await]")
+        return labels
+    
+    def metrics(self) -> Dict[str, Any]:
+        return {"active": len(self.active), "captured": self.captured, "sample_rate": PROFILE_SAMPLE_RATE}
+
+request_profiler = RequestProfiler(PROFILE_INTERVAL_MS)
+metrics_sources["profiler"] = request_profiler.metrics
+recent_profiles: deque = deque(maxlen=PROFILE_MEMORY_CAPACITY)  # memory backend only
+
+async def ensure_profiles_collection():
+    if "profiles" not in await db.list_collection_names():
+        try:
+            await db.create_collection("profiles", capped=True, size=PROFILE_COLLECTION_BYTES)
+        except (CollectionInvalid, OperationFailure):
+            pass  # created concurrently by another worker
+    await db.profiles.create_index("id")
+    await db.profiles.create_index("route")
+
+async def save_profile(profile: Dict[str, Any]):
+    if STORAGE_BACKEND == "memory":
+        recent_profiles.append(profile)
+    else:
+        await db.profiles.insert_one(dict(profile))
+
+def _profile_requested(scope) -> Optional[str]:
+    """Why this request should be profiled ("header" or "sampled"), if at all"""
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    headers = dict(scope["headers"])
+    if headers.get(b"x-profile") != b"1":
+        return None
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:], JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return "header" if payload.get("user_type") == UserType.ADMIN else None
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            return await self.app(scope, receive, send)
+        trigger = _profile_requested(scope)
+        if trigger is None:
+            return await self.app(scope, receive, send)
+        
+        profile_id = new_id()
+        response_status = None
+        
+        async def send_with_profile_id(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode("latin-1"))]}
+            await send(message)
+        
+        task = asyncio.current_task()
+        request_profiler.start(task)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            samples = request_profiler.stop(task)
+            duration_ms = (time.perf_counter() - started) * 1000
+            profile = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": getattr(scope.get("route"), "path", scope["path"]),
+                "status": response_status,
+                "trigger": trigger,
+                "duration_ms": round(duration_ms, 2),
+                "interval_ms": PROFILE_INTERVAL_MS,
+                "samples": sum(samples.values()),
+                "stacks": [{"stack": stack, "count": count} for stack, count in samples.most_common()],
+                "created_at": datetime.utcnow()
+            }
+            try:
+                await save_profile(profile)
+            except Exception as error:
+                logger.error(f"Saving profile {profile_id} failed: {error}")
+
+# Conditional GET: list endpoints are validated against change versions bumped by writers
+class LocalChangeVersions:
+    def __init__(self):
+        self.versions: Dict[str, Tuple[int, datetime]] = {}
+    
+    async def bump(self, scopes: List[str]):
+        now = datetime.utcnow().replace(microsecond=0)
+        for scope in scopes:
+            version, _ = self.versions.get(scope, (0, now))
+            self.versions[scope] = (version + 1, now)
+    
+    async def read(self, scopes: List[str]) -> Dict[str, Tuple[int, Optional[datetime]]]:
+        return {scope: self.versions.get(scope, (0, None)) for scope in scopes}
+
+class MongoChangeVersions:
+    def __init__(self, collection):
+        self.collection = collection
+    
+    async def bump(self, scopes: List[str]):
+        now = datetime.utcnow().replace(microsecond=0)
+        await self.collection.bulk_write([
+            UpdateOne({"_id": scope}, {"$inc": {"version": 1}, "$set": {"updated_at": now}}, upsert=True)
+            for scope in scopes
+        ], ordered=False, session=current_session.get())
+    
+    async def read(self, scopes: List[str]) -> Dict[str, Tuple[int, Optional[datetime]]]:
+        # Always on the primary and in the request session: reads routed to a secondary
+        # afterwards wait until it has caught up with the versions they are tagged with
+        versions = {scope: (0, None) for scope in scopes}
+        async for doc in self.collection.find({"_id": {"$in": scopes}}, session=current_session.get()):
+            versions[doc["_id"]] = (doc["version"], doc["updated_at"])
+        return versions
+
+change_versions = LocalChangeVersions() if STORAGE_BACKEND == "memory" else MongoChangeVersions(db.change_versions)
+
+async def bump_versions(*scopes: str):
+    await change_versions.bump(list(scopes))
+
+async def not_modified(request: Request, response: Response, scopes: List[str], viewer_id: str) -> Optional[Response]:
+    """Set ETag/Last-Modified on `response`, or return a 304 when the client copy is current"""
+    versions = await change_versions.read(scopes)
+    fingerprint = "|".join(
+        [viewer_id, request.url.path, str(request.query_params)] +
+        [f"{scope}={version}" for scope, (version, _) in sorted(versions.items())]
+    )
+    headers = {
+        "ETag": f'W/"{hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()}"',
+        "Cache-Control": "private, no-cache"
+    }
+    modified_times = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+    last_modified = max(modified_times) if len(modified_times) == len(versions) else None
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        current = if_none_match == "*" or headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]
+    elif request.headers.get("if-modified-since") and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(request.headers["if-modified-since"]).replace(tzinfo=None)
+            current = last_modified <= since
+        except (TypeError, ValueError):
+            current = False
+    else:
+        current = False
+    
+    if current:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# Background task queue
+task_handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+task_wakeup = asyncio.Event()
+task_workers: List[asyncio.Task] = []
+task_running: Dict[str, int] = {}
+task_claim_lock = asyncio.Lock()
+task_stats = {"succeeded": 0, "retried": 0, "dead_lettered": 0}
+memory_tasks: set = set()  # strong references: the loop only keeps weak ones
+
+def task_handler(task_type: str):
+    def register(handler):
+        task_handlers[task_type] = handler
+        return handler
+    return register
+
+async def enqueue_task(task_type: str, payload: Dict[str, Any], max_attempts: int = TASK_MAX_ATTEMPTS):
+    if STORAGE_BACKEND == "memory":
+        # No durable queue without MongoDB: run the handler in the background once
+        task = asyncio.create_task(task_handlers[task_type](payload))
+        memory_tasks.add(task)
+        task.add_done_callback(memory_tasks.discard)
+        return
+    now = datetime.utcnow()
+    await repos.tasks.insert({
+        "id": new_id(),
+        "type": task_type,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_at": now,
+        "created_at": now
+    })
+    task_wakeup.set()
+
+async def _claim_task() -> Optional[Dict[str, Any]]:
+    # Saturation check, claim and slot count under one lock: a claim in flight would
+    # otherwise let other workers see a free slot for the same type
+    async with task_claim_lock:
+        now = datetime.utcnow()
+        saturated = [
+            task_type for task_type, limit in TASK_CONCURRENCY.items()
+            if task_running.get(task_type, 0) >= limit
+        ]
+        task = await repos.tasks.claim(now, now + timedelta(seconds=TASK_LEASE_SECONDS), saturated)
+        if task is not None:
+            task_running[task["type"]] = task_running.get(task["type"], 0) + 1
+        return task
+
+async def _run_task(task: Dict[str, Any]):
+    """Run a claimed task and record the outcome; releases the slot _claim_task took"""
+    task_type = task["type"]
+    try:
+        handler = task_handlers.get(task_type)
+        if handler is None:
+            raise RuntimeError(f"No handler registered for task type {task_type}")
+        await handler(task["payload"])
+    except Exception as error:
+        if task["attempts"] >= task["max_attempts"]:
+            task.update(status="dead", last_error=repr(error), failed_at=datetime.utcnow())
+            await repos.tasks.bury(task)
+            task_stats["dead_lettered"] += 1
+            logger.error("Task %s (%s) moved to dead letter: %r", task["id"], task_type, error)
+        else:
+            backoff = min(TASK_BACKOFF_MAX_SECONDS, TASK_BACKOFF_BASE_SECONDS * 2 ** (task["attempts"] - 1))
+            run_at = datetime.utcnow() + timedelta(seconds=backoff * random.uniform(0.5, 1.5))
+            await repos.tasks.retry(task["id"], run_at, repr(error))
+            task_stats["retried"] += 1
+    else:
+        await repos.tasks.complete(task["id"])
+        task_stats["succeeded"] += 1
+    finally:
+        task_running[task_type] -= 1
+        task_wakeup.set()
+
+async def _task_worker():
+    while True:
+        try:
+            task = await _claim_task()
+        except Exception:
+            logger.exception("Task queue claim failed")
+            task = None
+        if task is None:
+            task_wakeup.clear()
+            try:
+                await asyncio.wait_for(task_wakeup.wait(), TASK_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await _run_task(task)
+        except Exception:
+            # Recording the outcome failed; the task's lease expires and it is claimed again
+            logger.exception("Task %s bookkeeping failed", task["id"])
+            await asyncio.sleep(TASK_POLL_INTERVAL_SECONDS)
+
+async def start_task_workers():
+    for _ in range(TASK_WORKERS):
+        task_workers.append(asyncio.create_task(_task_worker()))
+
+async def stop_task_workers():
+    for worker in task_workers:
+        worker.cancel()
+    await asyncio.gather(*task_workers, return_exceptions=True)
+    task_workers.clear()
+
+async def task_queue_metrics() -> Dict[str, Any]:
+    if STORAGE_BACKEND == "memory":
+        return {**task_stats, "queued": 0, "dead_letter_size": 0, "running": {"memory": len(memory_tasks)}}
+    return {
+        **task_stats,
+        "queued": await repos.tasks.count_queued(),
+        "dead_letter_size": await repos.tasks.count_dead(),
+        "running": dict(task_running)
+    }
+
+metrics_sources["tasks"] = task_queue_metrics
+
+@task_handler("notify")
+async def notify_task(payload: Dict[str, Any]):
+    notification = Notification(**payload)
+    # Keyed on the notification id so a retried task never duplicates it
+    await repos.notifications.insert_if_absent(notification.dict())
+    await bump_versions(f"notifications:{notification.user_id}")
+
+async def notify(user_id: Optional[str], title: str, message: str, type: str = "info", data: Optional[Dict[str, Any]] = None):
+    if not user_id:
+        return
+    await enqueue_task("notify", {
+        "id": new_id(),
+        "user_id": user_id,
+        "title": title,
+        "message": message,
+        "type": type,
+        "data": data or {}
+    })
+
 # Authentication endpoints
 @api_router.post("/auth/register")
+@no_compression  # token next to caller-chosen fields: avoid BREACH-style leaks
 async def register(user_data: UserCreate):
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await repos.users.get_by_email(user_data.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Cet email est déjà utilisé")
     
     hashed_password = hash_password(user_data.password)
     user = User(**user_data.dict(exclude={"password"}))
-    user_dict = user.dict()
-    user_dict["password"] = hashed_password
+    user_dict = build_user_document(user, hashed_password)
     
-    await db.users.insert_one(user_dict)
+    try:
+        await repos.users.insert(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Cet email est déjà utilisé")
+    await bump_versions("users")
     token = create_token(user.id, user.user_type)
     
     return {
@@ -235,8 +1405,9 @@ async def register(user_data: UserCreate):
     }
 
 @api_router.post("/auth/login")
+@no_compression
 async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email})
+    user = await repos.users.get_by_email(credentials.email)
     if not user or not verify_password(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Email ou mot de passe incorrect")
     
@@ -253,7 +1424,114 @@ async def login(credentials: UserLogin):
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
+@api_router.get("/bootstrap")
+async def bootstrap(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    """Everything the app loads after login (/auth/me, unread notifications, interventions) in one round trip"""
+    cached = await not_modified(request, response, ["users", "interventions", f"notifications:{current_user.id}"], current_user.id)
+    if cached:
+        return cached
+    
+    notifications, interventions = await gather_reads(
+        repos.notifications.list_for_user(current_user.id, True, 50),
+        load_interventions(current_user)
+    )
+    return {
+        "user": current_user,
+        "unread_notifications": [Notification(**notification) for notification in notifications],
+        "interventions": interventions
+    }
+
 # Technician endpoints
+class LocationUpdate(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+
+class LocationTracker:
+    """Latest position pinged by each technician, held in memory.
+
+    A technician is written back only once they have moved more than
+    `persist_distance_m` from their stored position, and all such moves are
+    flushed together every `flush_interval` seconds in one bulk write. Nearby
+    search overlays the live positions on the stored ones, so the store never
+    lags the truth by more than the threshold.
+    """
+    
+    def __init__(self, persist_distance_m: float, flush_interval: float, live_ttl: float):
+        self.persist_distance_km = persist_distance_m / 1000
+        self.flush_interval = flush_interval
+        self.live_ttl = live_ttl
+        self.live: Dict[str, Tuple[float, float, float, datetime]] = {}
+        self.persisted: Dict[str, Tuple[float, float]] = {}
+        self.dirty: set = set()
+        self.pings = 0
+        self.writes = 0
+        self.flushes = 0
+    
+    def ping(self, technician_id: str, latitude: float, longitude: float):
+        self.pings += 1
+        self.live[technician_id] = (latitude, longitude, time.monotonic(), datetime.utcnow())
+        stored = self.persisted.get(technician_id)
+        if stored is None or calculate_distance(stored[0], stored[1], latitude, longitude) > self.persist_distance_km:
+            self.dirty.add(technician_id)
+    
+    def position(self, technician_id: str) -> Optional[Tuple[float, float]]:
+        entry = self.live.get(technician_id)
+        if entry is None or time.monotonic() - entry[2] > self.live_ttl:
+            return None
+        return entry[0], entry[1]
+    
+    async def flush(self):
+        dirty, self.dirty = self.dirty, set()
+        updates = {}
+        for technician_id in dirty:
+            latitude, longitude, _, pinged_at = self.live[technician_id]
+            updates[technician_id] = {
+                "latitude": latitude,
+                "longitude": longitude,
+                "location": geo_point(latitude, longitude),
+                "location_updated_at": pinged_at
+            }
+        if updates:
+            try:
+                await repos.users.bulk_update(updates)
+            except Exception:
+                self.dirty |= dirty
+                raise
+            for technician_id, fields in updates.items():
+                self.persisted[technician_id] = (fields["latitude"], fields["longitude"])
+            self.writes += len(updates)
+            self.flushes += 1
+            await bump_versions("users")
+        
+        expired_before = time.monotonic() - self.live_ttl
+        for technician_id in [key for key, entry in self.live.items() if entry[2] < expired_before]:
+            if technician_id not in self.dirty:
+                del self.live[technician_id]
+    
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "live": len(self.live),
+            "pending": len(self.dirty),
+            "pings": self.pings,
+            "writes": self.writes,
+            "flushes": self.flushes
+        }
+
+location_tracker = LocationTracker(LOCATION_PERSIST_DISTANCE_M, LOCATION_FLUSH_INTERVAL_SECONDS, LOCATION_LIVE_TTL_SECONDS)
+metrics_sources["technician_locations"] = location_tracker.metrics
+
+async def _location_flush_loop():
+    while True:
+        await asyncio.sleep(location_tracker.flush_interval)
+        try:
+            await location_tracker.flush()
+        except Exception as error:
+            logger.error(f"Location flush failed: {error}")
+
 @api_router.get("/technicians/nearby")
 async def get_nearby_technicians(
     latitude: float,
@@ -261,30 +1539,38 @@ async def get_nearby_technicians(
     radius: float = 20,  # km
     intervention_type: Optional[str] = None
 ):
-    technicians = await db.users.find({
-        "user_type": UserType.TECHNICIAN,
-        "available": True,
-        "latitude": {"$exists": True},
-        "longitude": {"$exists": True}
-    }).to_list(100)
+    # Stored positions are within the persist threshold of the live ones
+    technicians = await repos.users.near(
+        latitude, longitude, radius + location_tracker.persist_distance_km,
+        {"user_type": UserType.TECHNICIAN, "available": True}, limit=100
+    )
     
     nearby_technicians = []
     for tech in technicians:
-        if tech.get("latitude") and tech.get("longitude"):
-            distance = calculate_distance(
-                latitude, longitude, 
-                tech["latitude"], tech["longitude"]
-            )
-            if distance <= radius:
-                tech_obj = User(**tech)
-                tech_dict = tech_obj.dict()
-                tech_dict["distance"] = round(distance, 2)
-                nearby_technicians.append(tech_dict)
+        live_position = location_tracker.position(tech["id"])
+        if live_position is not None:
+            tech["latitude"], tech["longitude"] = live_position
+        distance = calculate_distance(latitude, longitude, tech["latitude"], tech["longitude"])
+        if distance <= radius:
+            tech_dict = User(**tech).dict()
+            tech_dict["distance"] = round(distance, 2)
+            nearby_technicians.append(tech_dict)
     
     # Sort by distance
     nearby_technicians.sort(key=lambda x: x["distance"])
     return nearby_technicians
 
+@api_router.put("/technicians/location")
+async def update_location(
+    location: LocationUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.TECHNICIAN:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    location_tracker.ping(current_user.id, location.latitude, location.longitude)
+    return {"message": "Position mise à jour"}
+
 @api_router.put("/technicians/availability")
 async def update_availability(
     available: bool,
@@ -293,13 +1579,95 @@ async def update_availability(
     if current_user.user_type != UserType.TECHNICIAN:
         raise HTTPException(status_code=403, detail="Accès refusé")
     
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$set": {"available": available}}
-    )
+    await repos.users.update(current_user.id, {"available": available})
+    await bump_versions("users")
     
     return {"message": "Disponibilité mise à jour"}
 
+@app.websocket("/api/technicians/location/ws")
+async def technician_location_socket(websocket: WebSocket, token: str):
+    """Stream of {"latitude", "longitude"} pings from a technician app"""
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.PyJWTError:
+        await websocket.close(code=1008)
+        return
+    user = await repos.users.get(payload.get("user_id"))
+    if user is None or user["user_type"] != UserType.TECHNICIAN:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                location = LocationUpdate(**await websocket.receive_json())
+            except (ValueError, TypeError):
+                await websocket.send_json({"error": "Position invalide"})
+                continue
+            location_tracker.ping(user["id"], location.latitude, location.longitude)
+    except WebSocketDisconnect:
+        pass
+
+# Participant ACL cache
+class ParticipantCache:
+    """LRU of intervention id -> participants, status and title for access checks.
+
+    Writers in this process invalidate entries; the TTL bounds how long another
+    worker's writes can go unseen. Denials are re-checked against the database,
+    so a technician assigned through another worker is never refused.
+    """
+    
+    FIELDS = ("user_id", "technician_id", "status", "title")
+    
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.entries: OrderedDict = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+    
+    async def get(self, intervention_id: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        entry = self.entries.get(intervention_id)
+        if entry is not None and not refresh and entry[0] > now:
+            self.entries.move_to_end(intervention_id)
+            self.hits += 1
+            return entry[1]
+        
+        self.misses += 1
+        intervention = await repos.interventions.get(intervention_id)
+        if intervention is None:
+            self.entries.pop(intervention_id, None)
+            return None
+        participants = {field: intervention.get(field) for field in self.FIELDS}
+        self.entries[intervention_id] = (now + self.ttl, participants)
+        self.entries.move_to_end(intervention_id)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return participants
+    
+    def invalidate(self, intervention_id: str):
+        self.entries.pop(intervention_id, None)
+    
+    def metrics(self) -> Dict[str, Any]:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+participant_cache = ParticipantCache(PARTICIPANT_CACHE_SIZE, PARTICIPANT_CACHE_TTL_SECONDS)
+metrics_sources["participant_cache"] = participant_cache.metrics
+
+async def get_participants(intervention_id: str, allowed: Callable[[Dict[str, Any]], bool]) -> Optional[Dict[str, Any]]:
+    """Cached participants of an intervention; raises 403 when `allowed` refuses them twice"""
+    participants = await participant_cache.get(intervention_id)
+    if participants is not None and not allowed(participants):
+        participants = await participant_cache.get(intervention_id, refresh=True)
+        if participants is not None and not allowed(participants):
+            raise HTTPException(status_code=403, detail="Accès refusé")
+    return participants
+
+def is_participant(current_user: User) -> Callable[[Dict[str, Any]], bool]:
+    return lambda participants: current_user.id in (participants["user_id"], participants.get("technician_id"))
+
 # Intervention endpoints
 @api_router.post("/interventions", response_model=Intervention)
 async def create_intervention(
@@ -310,27 +1678,117 @@ async def create_intervention(
         raise HTTPException(status_code=403, detail="Seuls les utilisateurs peuvent créer des demandes")
     
     intervention = Intervention(**intervention_data.dict(), user_id=current_user.id)
-    await db.interventions.insert_one(intervention.dict())
+    intervention_dict = intervention.dict()
+    intervention_dict["user_location"] = geo_point(intervention.user_latitude, intervention.user_longitude)
+    await repos.interventions.insert(intervention_dict)
+    await bump_versions("interventions")
+    await record_rollup(intervention.created_at, created=1)
     
     return intervention
 
 @api_router.get("/interventions")
-async def get_interventions(current_user: User = Depends(get_current_user)):
+async def get_interventions(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    cached = await not_modified(request, response, ["interventions"], current_user.id)
+    if cached:
+        return cached
+    
+    return await load_interventions(current_user)
+
+async def load_interventions(current_user: User) -> List[Intervention]:
     if current_user.user_type == UserType.USER:
-        interventions = await db.interventions.find({"user_id": current_user.id}).to_list(100)
+        interventions = await repos.interventions.list_for_user(current_user.id, 100)
+        if len(interventions) < 100 and STORAGE_BACKEND == "mongo":
+            # Older history lives in the archive
+            remaining = 100 - len(interventions)
+            interventions += await db.interventions_archive.find({"user_id": current_user.id}).sort("created_at", -1).limit(remaining).to_list(remaining)
     elif current_user.user_type == UserType.TECHNICIAN:
         # Show available interventions and assigned ones
-        interventions = await db.interventions.find({
-            "$or": [
-                {"status": InterventionStatus.PENDING},
-                {"technician_id": current_user.id}
-            ]
-        }).to_list(100)
+        interventions = await repos.interventions.list_for_technician(current_user.id, 100)
     else:  # Admin
-        interventions = await db.interventions.find().to_list(100)
+        interventions = await repos.interventions.list(limit=100)
     
     return [Intervention(**intervention) for intervention in interventions]
 
+async def _onsite_feed(current_user: User, radius: float, limit: int, cursor: Optional[str]):
+    if current_user.latitude is None or current_user.longitude is None:
+        return [], None
+    
+    after = None
+    if cursor:
+        last = decode_cursor(cursor, {"distance": (int, float), "ids": list})
+        after = (last["distance"], last["ids"])
+    docs = await repos.interventions.nearest(
+        current_user.latitude, current_user.longitude, radius,
+        {"status": InterventionStatus.PENDING, "service_type": ServiceType.ONSITE}, limit, after
+    )
+    jobs = []
+    for doc in docs:
+        job = Intervention(**doc).dict()
+        job["distance"] = round(doc["distance"] / 1000, 2)  # km
+        jobs.append(job)
+    
+    next_cursor = None
+    if len(docs) == limit:
+        distance = docs[-1]["distance"]
+        served = [doc["id"] for doc in docs if doc["distance"] == distance]
+        if after and distance == after[0]:
+            served += after[1]
+        next_cursor = encode_cursor({"distance": distance, "ids": served})
+    return jobs, next_cursor
+
+async def _remote_feed(current_user: User, limit: int, cursor: Optional[str]):
+    # Remote jobs are only offered to technicians with the matching skill
+    skills = {skill.lower() for skill in (current_user.skills or [])}
+    matching_types = [t for t in (InterventionType.PHONE, InterventionType.COMPUTER) if t in skills]
+    if not matching_types:
+        return [], None
+    query = {
+        "status": InterventionStatus.PENDING,
+        "service_type": ServiceType.REMOTE,
+        "intervention_type": {"$in": matching_types}
+    }
+    
+    before = None
+    if cursor:
+        last = decode_cursor(cursor, {"created_at": str, "id": str})
+        try:
+            before = (datetime.fromisoformat(last["created_at"]), last["id"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Curseur invalide")
+    
+    docs = await repos.interventions.list_newest(query, before, limit)
+    
+    next_cursor = None
+    if len(docs) == limit:
+        next_cursor = encode_cursor({"created_at": docs[-1]["created_at"].isoformat(), "id": docs[-1]["id"]})
+    return [Intervention(**doc) for doc in docs], next_cursor
+
+@api_router.get("/interventions/feed")
+async def get_intervention_feed(
+    radius: float = FEED_DEFAULT_RADIUS_KM,  # km
+    limit: int = 20,
+    onsite_cursor: Optional[str] = None,
+    remote_cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.TECHNICIAN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux techniciens")
+    
+    limit = max(1, min(limit, FEED_MAX_LIMIT))
+    onsite, next_onsite_cursor = await _onsite_feed(current_user, radius, limit, onsite_cursor)
+    remote, next_remote_cursor = await _remote_feed(current_user, limit, remote_cursor)
+    
+    return {
+        "onsite": onsite,
+        "remote": remote,
+        "onsite_cursor": next_onsite_cursor,
+        "remote_cursor": next_remote_cursor
+    }
+
 @api_router.put("/interventions/{intervention_id}/assign")
 async def assign_intervention(
     intervention_id: str,
@@ -339,22 +1797,24 @@ async def assign_intervention(
     if current_user.user_type != UserType.TECHNICIAN:
         raise HTTPException(status_code=403, detail="Seuls les techniciens peuvent accepter des interventions")
     
-    intervention = await db.interventions.find_one({"id": intervention_id})
+    intervention = await repos.interventions.get(intervention_id)
     if not intervention:
         raise HTTPException(status_code=404, detail="Intervention non trouvée")
     
     if intervention["status"] != InterventionStatus.PENDING:
         raise HTTPException(status_code=400, detail="Cette intervention n'est plus disponible")
     
-    await db.interventions.update_one(
-        {"id": intervention_id},
-        {
-            "$set": {
-                "technician_id": current_user.id,
-                "status": InterventionStatus.ASSIGNED,
-                "assigned_at": datetime.utcnow()
-            }
-        }
+    if not await repos.interventions.assign(intervention_id, current_user.id, datetime.utcnow()):
+        raise HTTPException(status_code=400, detail="Cette intervention n'est plus disponible")
+    participant_cache.invalidate(intervention_id)
+    await bump_versions("interventions")
+    
+    await notify(
+        intervention["user_id"],
+        "Intervention acceptée",
+        f"{current_user.name} a accepté votre demande « {intervention['title']} »",
+        "success",
+        {"intervention_id": intervention_id}
     )
     
     return {"message": "Intervention acceptée avec succès"}
@@ -366,30 +1826,64 @@ async def update_intervention_status(
     final_price: Optional[float] = None,
     current_user: User = Depends(get_current_user)
 ):
-    intervention = await db.interventions.find_one({"id": intervention_id})
+    # Check permissions
+    def allowed(participants: Dict[str, Any]) -> bool:
+        if current_user.user_type == UserType.USER:
+            return participants["user_id"] == current_user.id
+        if current_user.user_type == UserType.TECHNICIAN:
+            return participants["technician_id"] == current_user.id
+        return True
+    
+    intervention = await get_participants(intervention_id, allowed)
     if not intervention:
         raise HTTPException(status_code=404, detail="Intervention non trouvée")
     
-    # Check permissions
-    if current_user.user_type == UserType.USER and intervention["user_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Accès refusé")
-    elif current_user.user_type == UserType.TECHNICIAN and intervention["technician_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Accès refusé")
-    
     update_data = {"status": new_status}
     if new_status == InterventionStatus.COMPLETED:
         update_data["completed_at"] = datetime.utcnow()
         if final_price:
             update_data["final_price"] = final_price
+    elif new_status == InterventionStatus.CANCELLED:
+        update_data["cancelled_at"] = datetime.utcnow()
+    
+    await repos.interventions.update(intervention_id, update_data)
+    participant_cache.invalidate(intervention_id)
+    await bump_versions("interventions")
     
-    await db.interventions.update_one(
-        {"id": intervention_id},
-        {"$set": update_data}
+    if new_status == InterventionStatus.COMPLETED:
+        await record_intervention_completion(intervention_id)
+    elif new_status == InterventionStatus.CANCELLED:
+        await record_intervention_cancellation(intervention_id)
+    
+    # Tell the other party about the change
+    recipient_id = intervention.get("technician_id") if current_user.id == intervention["user_id"] else intervention["user_id"]
+    await notify(
+        recipient_id,
+        "Statut de l'intervention mis à jour",
+        f"L'intervention « {intervention['title']} » est maintenant : {new_status}",
+        "info",
+        {"intervention_id": intervention_id, "status": new_status}
     )
     
     return {"message": "Statut mis à jour"}
 
 # Payment endpoints
+async def apply_paid_payment(payment_transaction: Dict[str, Any], paid_at: datetime):
+    # Side effects of a transaction turning paid; callers guarantee this runs once
+    await record_rollup(
+        paid_at,
+        revenue=payment_transaction["amount"],
+        commission=payment_transaction["commission_amount"]
+    )
+    await record_payout(payment_transaction, paid_at)
+    await notify(
+        payment_transaction.get("technician_id"),
+        "Paiement reçu",
+        f"Un paiement de {payment_transaction['technician_amount']:.2f} € vous a été versé",
+        "success",
+        {"intervention_id": payment_transaction["intervention_id"]}
+    )
+
 @api_router.post("/payments/checkout/session")
 async def create_checkout_session(
     payment_data: PaymentCreate,
@@ -397,7 +1891,7 @@ async def create_checkout_session(
     current_user: User = Depends(get_current_user)
 ):
     # Get intervention details
-    intervention = await db.interventions.find_one({"id": payment_data.intervention_id})
+    intervention = await repos.interventions.get(payment_data.intervention_id)
     if not intervention:
         raise HTTPException(status_code=404, detail="Intervention non trouvée")
     
@@ -443,7 +1937,8 @@ async def create_checkout_session(
         metadata=checkout_request.metadata
     )
     
-    await db.payment_transactions.insert_one(payment_transaction.dict())
+    await repos.payments.insert(payment_transaction.dict())
+    await bump_versions("payments")
     
     return {"url": session.url, "session_id": session.session_id}
 
@@ -451,50 +1946,499 @@ async def create_checkout_session(
 async def get_checkout_status(session_id: str):
     checkout_status = await stripe_checkout.get_checkout_status(session_id)
     
-    # Update payment transaction
-    payment_transaction = await db.payment_transactions.find_one({"session_id": session_id})
+    update_data = {
+        "payment_status": checkout_status.payment_status,
+        "updated_at": datetime.utcnow()
+    }
+    if checkout_status.payment_status != PaymentStatus.PAID:
+        if await repos.payments.update_by_session(session_id, update_data):
+            await bump_versions("payments")
+        return checkout_status
+    
+    # Conditional on the previous status: only the poll that moves the transaction to paid
+    # records paid_at and completes the intervention, later polls leave an admin's resolution alone
+    update_data["paid_at"] = update_data["updated_at"]
+    payment_transaction = await repos.payments.update_by_session(session_id, update_data, unless_status=PaymentStatus.PAID)
     if payment_transaction:
-        update_data = {
-            "payment_status": checkout_status.payment_status,
-            "updated_at": datetime.utcnow()
-        }
-        
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": update_data}
+        await bump_versions("payments")
+        await apply_paid_payment(payment_transaction, update_data["paid_at"])
+        await repos.interventions.update(payment_transaction["intervention_id"], {"status": InterventionStatus.COMPLETED})
+        participant_cache.invalidate(payment_transaction["intervention_id"])
+        await bump_versions("interventions")
+        await record_intervention_completion(payment_transaction["intervention_id"])
+    
+    return checkout_status
+
+# Technician earnings: one payout bucket per technician and month, holding the month's lines
+def _payout_month(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _payout_key(technician_id: str, month: datetime) -> str:
+    return f"{technician_id}:{month.strftime('%Y-%m')}"
+
+def _payout_line(payment_transaction: Dict[str, Any], paid_at: datetime) -> Dict[str, Any]:
+    return {
+        "payment_id": payment_transaction["id"],
+        "intervention_id": payment_transaction["intervention_id"],
+        "paid_at": paid_at,
+        "amount": payment_transaction["amount"],
+        "commission_amount": payment_transaction["commission_amount"],
+        "technician_amount": payment_transaction["technician_amount"]
+    }
+
+async def record_payout(payment_transaction: Dict[str, Any], paid_at: datetime):
+    technician_id = payment_transaction.get("technician_id")
+    if STORAGE_BACKEND == "memory" or not technician_id:
+        return
+    month = _payout_month(paid_at)
+    line = _payout_line(payment_transaction, paid_at)
+    try:
+        # The line filter keeps a replayed payment from being counted twice
+        await db.payout_buckets.update_one(
+            {"_id": _payout_key(technician_id, month), "lines.payment_id": {"$ne": line["payment_id"]}},
+            {
+                "$inc": {
+                    "payments": 1,
+                    "amount": line["amount"],
+                    "commission_amount": line["commission_amount"],
+                    "technician_amount": line["technician_amount"]
+                },
+                "$push": {"lines": line},
+                "$setOnInsert": {"technician_id": technician_id, "month": month}
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return  # already in the bucket
+    await bump_versions(f"payouts:{technician_id}")
+
+async def rebuild_payouts() -> Dict[str, int]:
+    """Recompute every payout bucket from paid transactions"""
+    pipeline = [
+        {"$match": {"payment_status": PaymentStatus.PAID, "technician_id": {"$ne": None}}},
+        # Transactions paid before paid_at was recorded fall back to their last update
+        {"$addFields": {"paid_at": {"$ifNull": ["$paid_at", "$updated_at"]}}},
+        {"$sort": {"paid_at": 1}},
+        {"$group": {
+            "_id": {"technician_id": "$technician_id", "month": {"$dateTrunc": {"date": "$paid_at", "unit": "month"}}},
+            "payments": {"$sum": 1},
+            "amount": {"$sum": "$amount"},
+            "commission_amount": {"$sum": "$commission_amount"},
+            "technician_amount": {"$sum": "$technician_amount"},
+            "lines": {"$push": {
+                "payment_id": "$id",
+                "intervention_id": "$intervention_id",
+                "paid_at": "$paid_at",
+                "amount": "$amount",
+                "commission_amount": "$commission_amount",
+                "technician_amount": "$technician_amount"
+            }}
+        }}
+    ]
+    documents = []
+    technicians = set()
+    async for row in db.payment_transactions.aggregate(pipeline, allowDiskUse=True):
+        technician_id, month = row["_id"]["technician_id"], row["_id"]["month"]
+        technicians.add(technician_id)
+        documents.append({**row, "_id": _payout_key(technician_id, month), "technician_id": technician_id, "month": month})
+    
+    await replace_collection("payout_buckets", documents)
+    await bump_versions(*(f"payouts:{technician_id}" for technician_id in technicians))
+    
+    return {"technicians": len(technicians), "buckets": len(documents)}
+
+def _check_earnings_access(technician_id: str, current_user: User):
+    if current_user.id != technician_id and current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+
+@api_router.get("/technicians/{technician_id}/earnings", dependencies=[Depends(mongo_only)])
+async def get_technician_earnings(
+    technician_id: str,
+    request: Request,
+    response: Response,
+    months: int = 12,
+    current_user: User = Depends(get_current_user)
+):
+    """Monthly payout totals, most recent first"""
+    _check_earnings_access(technician_id, current_user)
+    
+    cached = await not_modified(request, response, [f"payouts:{technician_id}"], current_user.id)
+    if cached:
+        return cached
+    
+    months = max(1, min(months, 120))
+    buckets = await for_reads(db.payout_buckets).find(
+        {"technician_id": technician_id}, {"_id": 0, "lines": 0}, session=current_session.get()
+    ).sort("month", -1).limit(months).to_list(months)
+    
+    totals = {
+        field: round(sum(bucket[field] for bucket in buckets), 2)
+        for field in ("amount", "commission_amount", "technician_amount")
+    }
+    totals["payments"] = sum(bucket["payments"] for bucket in buckets)
+    return {"technician_id": technician_id, "months": buckets, "totals": totals}
+
+@api_router.get("/technicians/{technician_id}/earnings/{month}/statement", dependencies=[Depends(mongo_only)])
+async def get_earnings_statement(
+    technician_id: str,
+    month: str,  # YYYY-MM
+    request: Request,
+    response: Response,
+    format: str = "json",
+    current_user: User = Depends(get_current_user)
+):
+    _check_earnings_access(technician_id, current_user)
+    try:
+        month_start = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Mois invalide (AAAA-MM)")
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="Format d'export invalide")
+    
+    cached = await not_modified(request, response, [f"payouts:{technician_id}"], current_user.id)
+    if cached:
+        return cached
+    
+    # One precomputed document per statement, however many payments the month had
+    bucket = await for_reads(db.payout_buckets).find_one(
+        {"_id": _payout_key(technician_id, month_start)}, {"_id": 0}, session=current_session.get()
+    )
+    if bucket is None:
+        bucket = {"technician_id": technician_id, "month": month_start, "payments": 0, "amount": 0,
+                  "commission_amount": 0, "technician_amount": 0, "lines": []}
+    if format == "json":
+        return bucket
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    columns = ["paid_at", "intervention_id", "payment_id", "amount", "commission_amount", "technician_amount"]
+    writer.writerow(columns)
+    for line in bucket["lines"]:
+        writer.writerow([_export_value(line.get(column)) for column in columns])
+    writer.writerow(["total", "", "", bucket["amount"], bucket["commission_amount"], bucket["technician_amount"]])
+    return Response(
+        buffer.getvalue(),
+        media_type="text/csv",
+        headers={**response.headers, "Content-Disposition": f'attachment; filename="statement-{technician_id}-{month}.csv"'}
+    )
+
+@api_router.post("/admin/payouts/rebuild", dependencies=[Depends(mongo_only)])
+async def admin_rebuild_payouts(current_user: User = Depends(get_current_user)):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return await rebuild_payouts()
+
+# Payment reconciliation
+reconciliation_stats: Dict[str, Any] = {"runs": 0, "last_run": None}
+
+async def acquire_job_lock(name: str, seconds: int) -> bool:
+    """Lease a named lock so only one worker process runs a periodic job"""
+    now = datetime.utcnow()
+    try:
+        await db.job_locks.update_one(
+            {"_id": name, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + timedelta(seconds=seconds)}},
+            upsert=True
         )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def reconcile_payments(checkout_client=None, dry_run: bool = False) -> Dict[str, Any]:
+    checkout_client = checkout_client or stripe_checkout
+    started = time.monotonic()
+    now = datetime.utcnow()
+    expire_before = now - timedelta(hours=RECONCILE_SESSION_LIFETIME_HOURS)
+    run = {"dry_run": dry_run, "scanned": 0, "paid": 0, "expired": 0, "still_pending": 0, "errors": 0}
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    
+    async def check(transaction: Dict[str, Any]):
+        async with semaphore:
+            try:
+                return transaction, await checkout_client.get_checkout_status(transaction["session_id"])
+            except Exception as error:
+                logger.warning("Reconciliation of session %s failed: %r", transaction["session_id"], error)
+                return transaction, None
+    
+    # Keyset walk over (updated_at, id) on the {payment_status, updated_at} index
+    stale_before = now - timedelta(minutes=RECONCILE_STALE_AFTER_MINUTES)
+    last = None
+    while True:
+        page = await repos.payments.list_unsettled(PAYMENT_FINAL_STATUSES, stale_before, last, RECONCILE_PAGE_SIZE)
+        if not page:
+            break
+        last = (page[-1]["updated_at"], page[-1]["id"])
+        run["scanned"] += len(page)
         
-        # If payment successful, mark intervention as paid
-        if checkout_status.payment_status == "paid":
-            await db.interventions.update_one(
-                {"id": payment_transaction["intervention_id"]},
-                {"$set": {"status": InterventionStatus.COMPLETED}}
-            )
+        settlements = []
+        for transaction, checkout_status in await asyncio.gather(*(check(transaction) for transaction in page)):
+            if checkout_status is None:
+                run["errors"] += 1
+                continue
+            if checkout_status.payment_status == PaymentStatus.PAID:
+                new_status = PaymentStatus.PAID
+            elif checkout_status.status == "expired" or transaction["created_at"] < expire_before:
+                new_status = PaymentStatus.EXPIRED
+            else:
+                run["still_pending"] += 1
+                continue
+            run[new_status] += 1
+            fields = {"payment_status": new_status, "updated_at": now}
+            if new_status == PaymentStatus.PAID:
+                fields["paid_at"] = now
+            settlements.append((transaction, fields))
+        
+        if dry_run or not settlements:
+            continue
+        # Guarded on a non-final status so a concurrent get_checkout_status keeps the upper hand
+        settled = await asyncio.gather(*(
+            repos.payments.settle(transaction["id"], PAYMENT_FINAL_STATUSES, fields)
+            for transaction, fields in settlements
+        ))
+        await bump_versions("payments")
+        for (transaction, fields), moved in zip(settlements, settled):
+            # Only side-effect transactions this run actually moved to paid
+            if moved and fields["payment_status"] == PaymentStatus.PAID:
+                await apply_paid_payment(transaction, now)
+                await repos.interventions.update(transaction["intervention_id"], {"status": InterventionStatus.COMPLETED})
+                participant_cache.invalidate(transaction["intervention_id"])
+                await bump_versions("interventions")
+                await record_intervention_completion(transaction["intervention_id"])
     
-    return checkout_status
+    run["duration_seconds"] = round(time.monotonic() - started, 3)
+    run["finished_at"] = datetime.utcnow()
+    if not dry_run:
+        reconciliation_stats["runs"] += 1
+        reconciliation_stats["last_run"] = run
+    return run
+
+async def _reconciliation_loop():
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+        try:
+            if await acquire_job_lock("payment_reconciliation", RECONCILE_INTERVAL_SECONDS):
+                run = await reconcile_payments()
+                logger.info("Payment reconciliation: %s", run)
+        except Exception:
+            logger.exception("Payment reconciliation failed")
+
+metrics_sources["payment_reconciliation"] = lambda: reconciliation_stats
+
+# Data lifecycle
+archive_stats: Dict[str, Any] = {"runs": 0, "last_run": None}
+
+async def find_intervention(intervention_id: str) -> Optional[Dict[str, Any]]:
+    """Load an intervention from the hot collection, falling back to the archive"""
+    intervention = await repos.interventions.get(intervention_id)
+    if intervention is None and STORAGE_BACKEND == "mongo":
+        intervention = await db.interventions_archive.find_one({"id": intervention_id})
+    return intervention
+
+async def count_interventions(filters: Optional[Dict[str, Any]] = None) -> int:
+    """Live plus archived interventions matching filters"""
+    count = await repos.interventions.count(filters)
+    if STORAGE_BACKEND == "mongo":
+        count += await for_reads(db.interventions_archive).count_documents(filters or {}, session=current_session.get())
+    return count
+
+async def _copy_to_archive(archive, documents: List[Dict[str, Any]]):
+    if not documents:
+        return
+    try:
+        await archive.insert_many(documents, ordered=False)
+    except BulkWriteError as error:
+        # Duplicates were copied by an earlier, interrupted run
+        if any(write_error["code"] != 11000 for write_error in error.details.get("writeErrors", [])):
+            raise
+
+async def _archive_messages(intervention_ids: List[str]) -> int:
+    """Move the messages of these interventions to the archive, deleting only what was copied"""
+    archived = 0
+    messages = []
+    async for message in db.messages.find({"intervention_id": {"$in": intervention_ids}}).batch_size(ARCHIVE_BATCH_SIZE):
+        messages.append(message)
+        if len(messages) >= ARCHIVE_BATCH_SIZE:
+            await _copy_to_archive(db.messages_archive, messages)
+            await db.messages.delete_many({"_id": {"$in": [message["_id"] for message in messages]}})
+            archived += len(messages)
+            messages = []
+    await _copy_to_archive(db.messages_archive, messages)
+    if messages:
+        await db.messages.delete_many({"_id": {"$in": [message["_id"] for message in messages]}})
+    return archived + len(messages)
+
+def _closed_before(cutoff: datetime) -> Dict[str, Any]:
+    """Interventions closed (by their status's closing timestamp) before cutoff"""
+    clauses = []
+    for status, closed_at in ARCHIVABLE_STATUSES.items():
+        clauses.append({"status": status, closed_at: {"$lt": cutoff}})
+        # Closed before the timestamp was recorded: the creation date is all there is
+        clauses.append({"status": status, closed_at: None, "created_at": {"$lt": cutoff}})
+    return {"$or": clauses}
+
+async def archive_interventions(older_than_days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, Any]:
+    started = time.monotonic()
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    run = {"interventions": 0, "messages": 0}
+    
+    while True:
+        batch = await db.interventions.find(_closed_before(cutoff)).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        intervention_ids = [intervention["id"] for intervention in batch]
+        
+        # Copy first, delete second: a crash in between only leaves duplicates to skip
+        run["messages"] += await _archive_messages(intervention_ids)
+        await _copy_to_archive(db.interventions_archive, batch)
+        await db.interventions.delete_many({"id": {"$in": intervention_ids}})
+        # Messages sent while the batch was being copied
+        run["messages"] += await _archive_messages(intervention_ids)
+        for intervention_id in intervention_ids:
+            participant_cache.invalidate(intervention_id)
+        await bump_versions("interventions")
+        run["interventions"] += len(batch)
+    
+    run["duration_seconds"] = round(time.monotonic() - started, 3)
+    run["finished_at"] = datetime.utcnow()
+    archive_stats["runs"] += 1
+    archive_stats["last_run"] = run
+    return run
+
+async def _archive_loop():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        try:
+            if await acquire_job_lock("archive_interventions", ARCHIVE_INTERVAL_SECONDS):
+                run = await archive_interventions()
+                logger.info("Intervention archival: %s", run)
+        except Exception:
+            logger.exception("Intervention archival failed")
+
+async def ensure_notification_ttl():
+    ttl_seconds = NOTIFICATION_TTL_DAYS * 24 * 3600
+    try:
+        await db.notifications.create_index("read_at", expireAfterSeconds=ttl_seconds)
+    except OperationFailure:
+        # The index exists with another age: change it in place
+        await db.command("collMod", "notifications", index={"keyPattern": {"read_at": 1}, "expireAfterSeconds": ttl_seconds})
+    # Notifications read before read_at was recorded would never expire; date them from creation
+    await db.notifications.update_many(
+        {"read": True, "read_at": {"$exists": False}},
+        [{"$set": {"read_at": "$created_at"}}]
+    )
+
+metrics_sources["archive"] = lambda: archive_stats
 
 # Message endpoints
+class MessageWriteBuffer:
+    """Coalesces concurrent message inserts into one unordered insert_many.
+
+    submit() resolves only once the batch holding the document has been
+    acknowledged by MongoDB, so callers keep per-message durability.
+    """
+    
+    def __init__(self, repository, window_ms: float, max_size: int):
+        self.repository = repository
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+        self.writes: set = set()
+        self.batches = 0
+        self.documents = 0
+    
+    async def submit(self, document: Dict[str, Any]):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((document, future))
+        if len(self.pending) >= self.max_size:
+            self._flush_now()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_after_window())
+        await future
+    
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        await self._write(self._take_batch())
+    
+    def _flush_now(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        write = asyncio.create_task(self._write(self._take_batch()))
+        self.writes.add(write)
+        write.add_done_callback(self.writes.discard)
+    
+    def _take_batch(self) -> List[Tuple[Dict[str, Any], asyncio.Future]]:
+        batch, self.pending = self.pending, []
+        return batch
+    
+    async def _write(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        if not batch:
+            return
+        # The batch mixes several requests: write it outside the session of the one that started it
+        current_session.set(None)
+        failed: Dict[int, Exception] = {}
+        try:
+            errors = await self.repository.insert_many([document for document, _ in batch])
+            failed = {index: RuntimeError(message) for index, message in errors.items()}
+        except Exception as error:
+            failed = {index: error for index in range(len(batch))}
+        
+        self.batches += 1
+        self.documents += len(batch) - len(failed)
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(None)
+    
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self._write(self._take_batch())
+        await asyncio.gather(*self.writes, return_exceptions=True)
+    
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "batches": self.batches,
+            "messages": self.documents,
+            "mean_batch_size": round(self.documents / self.batches, 2) if self.batches else 0,
+            "pending": len(self.pending)
+        }
+
+message_buffer = (
+    MessageWriteBuffer(repos.messages, MESSAGE_BATCH_WINDOW_MS, MESSAGE_BATCH_MAX_SIZE)
+    if MESSAGE_BATCH_WINDOW_MS > 0 else None
+)
+if message_buffer is not None:
+    metrics_sources["message_buffer"] = message_buffer.metrics
+
 @api_router.post("/messages")
 async def send_message(
     message_data: MessageCreate,
     current_user: User = Depends(get_current_user)
 ):
     # Verify user has access to this intervention
-    intervention = await db.interventions.find_one({"id": message_data.intervention_id})
+    intervention = await get_participants(message_data.intervention_id, is_participant(current_user))
     if not intervention:
         raise HTTPException(status_code=404, detail="Intervention non trouvée")
     
-    if (intervention["user_id"] != current_user.id and 
-        intervention.get("technician_id") != current_user.id):
-        raise HTTPException(status_code=403, detail="Accès refusé")
-    
     message = Message(
         **message_data.dict(),
         sender_id=current_user.id,
         sender_type=current_user.user_type
     )
     
-    await db.messages.insert_one(message.dict())
+    if message_buffer is not None:
+        await message_buffer.submit(message.dict())
+    else:
+        await repos.messages.insert(message.dict())
     return message
 
 @api_router.get("/messages/{intervention_id}")
@@ -503,7 +2447,11 @@ async def get_messages(
     current_user: User = Depends(get_current_user)
 ):
     # Verify access
-    intervention = await db.interventions.find_one({"id": intervention_id})
+    intervention = await get_participants(intervention_id, is_participant(current_user))
+    archived = False
+    if not intervention and STORAGE_BACKEND == "mongo":
+        intervention = await db.interventions_archive.find_one({"id": intervention_id})
+        archived = True
     if not intervention:
         raise HTTPException(status_code=404, detail="Intervention non trouvée")
     
@@ -511,32 +2459,389 @@ async def get_messages(
         intervention.get("technician_id") != current_user.id):
         raise HTTPException(status_code=403, detail="Accès refusé")
     
-    messages = await db.messages.find({"intervention_id": intervention_id}).sort("created_at", 1).to_list(100)
+    if archived:
+        messages = await db.messages_archive.find({"intervention_id": intervention_id}).sort("created_at", 1).to_list(100)
+    else:
+        messages = await repos.messages.list_for_intervention(intervention_id, 100)
     return [Message(**message) for message in messages]
 
+# Review endpoints
+async def _claim_intervention_event(intervention_id: str, flag: str) -> Optional[Dict[str, Any]]:
+    # Flags make counters idempotent across repeated status updates and payment confirmations
+    return await repos.interventions.claim_flag(intervention_id, flag)
+
+async def record_intervention_completion(intervention_id: str):
+    intervention = await _claim_intervention_event(intervention_id, "completion_counted")
+    if not intervention:
+        return
+    await record_rollup(datetime.utcnow(), completed=1)
+    if intervention.get("final_price"):
+        await record_price(intervention)
+    if intervention.get("technician_id"):
+        await repos.users.increment(intervention["technician_id"], {"total_interventions": 1})
+        await bump_versions("users")
+
+async def record_intervention_cancellation(intervention_id: str):
+    if await _claim_intervention_event(intervention_id, "cancellation_counted"):
+        await record_rollup(datetime.utcnow(), cancelled=1)
+
+@api_router.post("/reviews", response_model=Review)
+async def create_review(
+    review_data: ReviewCreate,
+    current_user: User = Depends(get_current_user)
+):
+    intervention = await find_intervention(review_data.intervention_id)
+    if not intervention:
+        raise HTTPException(status_code=404, detail="Intervention non trouvée")
+    
+    if intervention["user_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    
+    if intervention["status"] != InterventionStatus.COMPLETED or not intervention.get("technician_id"):
+        raise HTTPException(status_code=400, detail="Seules les interventions terminées peuvent être évaluées")
+    
+    review = Review(
+        **review_data.dict(),
+        user_id=current_user.id,
+        technician_id=intervention["technician_id"]
+    )
+    try:
+        await repos.reviews.insert(review.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Cette intervention a déjà été évaluée")
+    
+    await repos.users.add_rating(review.technician_id, review.rating)
+    await repos.stats.increment("ratings", {"rating_sum": review.rating, "rating_count": 1})
+    await bump_versions("users", "reviews")
+    
+    return review
+
+@api_router.get("/technicians/{technician_id}/reviews")
+async def get_technician_reviews(technician_id: str, limit: int = 50):
+    limit = max(1, min(limit, 100))
+    reviews = await repos.reviews.list_for_technician(technician_id, limit)
+    return [Review(**review) for review in reviews]
+
+# Analytics rollups
+ROLLUP_METRICS = ("created", "completed", "cancelled", "revenue", "commission")
+ROLLUP_GRANULARITIES = ("hour", "day")
+
+def _truncate(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _rollup_key(granularity: str, bucket: datetime) -> str:
+    return f"{granularity}:{bucket.isoformat()}"
+
+async def record_rollup(moment: datetime, **increments):
+    if STORAGE_BACKEND == "memory":
+        return
+    operations = []
+    for granularity in ROLLUP_GRANULARITIES:
+        bucket = _truncate(moment, granularity)
+        operations.append(UpdateOne(
+            {"_id": _rollup_key(granularity, bucket)},
+            {
+                "$inc": increments,
+                "$setOnInsert": {"granularity": granularity, "bucket": bucket}
+            },
+            upsert=True
+        ))
+    await db.analytics_rollups.bulk_write(operations, ordered=False)
+
+async def rebuild_rollups() -> Dict[str, int]:
+    """Recompute every hourly and daily bucket from interventions and payments"""
+    hourly: Dict[datetime, Dict[str, float]] = {}
+    
+    async def accumulate(collection, match: Dict[str, Any], time_expr: Any, sums: Dict[str, Any]):
+        pipeline = [
+            {"$match": match},
+            {"$addFields": {"_rollup_time": time_expr}},
+            {"$match": {"_rollup_time": {"$type": "date"}}},
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$_rollup_time", "unit": "hour"}},
+                **sums
+            }}
+        ]
+        async for row in collection.aggregate(pipeline):
+            bucket = hourly.setdefault(row["_id"], dict.fromkeys(ROLLUP_METRICS, 0))
+            for metric in sums:
+                bucket[metric] += row[metric]
+    
+    # Older documents predate the counted flags and event timestamps, hence the fallbacks
+    for interventions in (db.interventions, db.interventions_archive):
+        await accumulate(interventions, {}, "$created_at", {"created": {"$sum": 1}})
+        await accumulate(
+            interventions,
+            {"$or": [{"completion_counted": True}, {"status": InterventionStatus.COMPLETED}]},
+            {"$ifNull": ["$completed_at", "$assigned_at", "$created_at"]},
+            {"completed": {"$sum": 1}}
+        )
+        await accumulate(
+            interventions,
+            {"$or": [{"cancellation_counted": True}, {"status": InterventionStatus.CANCELLED}]},
+            {"$ifNull": ["$cancelled_at", "$created_at"]},
+            {"cancelled": {"$sum": 1}}
+        )
+    await accumulate(
+        db.payment_transactions,
+        {"payment_status": PaymentStatus.PAID},
+        {"$ifNull": ["$paid_at", "$updated_at"]},
+        {"revenue": {"$sum": "$amount"}, "commission": {"$sum": "$commission_amount"}}
+    )
+    
+    daily: Dict[datetime, Dict[str, float]] = {}
+    for hour, metrics in hourly.items():
+        day = daily.setdefault(_truncate(hour, "day"), dict.fromkeys(ROLLUP_METRICS, 0))
+        for metric, value in metrics.items():
+            day[metric] += value
+    
+    documents = [
+        {"_id": _rollup_key(granularity, bucket), "granularity": granularity, "bucket": bucket, **metrics}
+        for granularity, buckets in (("hour", hourly), ("day", daily))
+        for bucket, metrics in buckets.items()
+    ]
+    await replace_collection("analytics_rollups", documents)
+    
+    return {"hourly_buckets": len(hourly), "daily_buckets": len(daily)}
+
+@api_router.get("/admin/analytics/timeseries")
+async def admin_analytics_timeseries(
+    start: datetime,
+    end: datetime,
+    granularity: str = "day",  # hour, day, month
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    if granularity not in ("hour", "day", "month"):
+        raise HTTPException(status_code=400, detail="Granularité invalide")
+    
+    # Months are summed from daily buckets: at most a few hundred documents per year
+    source = "hour" if granularity == "hour" else "day"
+    rows = [] if STORAGE_BACKEND == "memory" else await for_reads(db.analytics_rollups).find(
+        {"granularity": source, "bucket": {"$gte": _truncate(start, source), "$lt": end}},
+        session=current_session.get()
+    ).sort("bucket", 1).to_list(None)
+    
+    buckets: Dict[datetime, Dict[str, float]] = {}
+    for row in rows:
+        bucket = buckets.setdefault(_truncate(row["bucket"], granularity), dict.fromkeys(ROLLUP_METRICS, 0))
+        for metric in ROLLUP_METRICS:
+            bucket[metric] += row.get(metric, 0)
+    
+    totals = dict.fromkeys(ROLLUP_METRICS, 0)
+    for metrics in buckets.values():
+        for metric, value in metrics.items():
+            totals[metric] += value
+    
+    return {
+        "granularity": granularity,
+        "buckets": [{"bucket": bucket, **metrics} for bucket, metrics in buckets.items()],
+        "totals": totals
+    }
+
+@api_router.post("/admin/analytics/rebuild", dependencies=[Depends(mongo_only)])
+async def admin_rebuild_analytics(current_user: User = Depends(get_current_user)):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return await rebuild_rollups()
+
+# Price suggestions
+PRICING_QUANTILES = {"p10": 0.1, "p25": 0.25, "median": 0.5, "p75": 0.75, "p90": 0.9}
+PRICING_GAMMA = (1 + PRICING_RELATIVE_ACCURACY) / (1 - PRICING_RELATIVE_ACCURACY)
+PRICING_LEVELS = ("cell", "urgency", "service", "type")
+
+def price_bucket(price: float) -> int:
+    return math.ceil(math.log(price, PRICING_GAMMA))
+
+class PriceSketch:
+    """Counts of prices in log-spaced buckets (DDSketch): mergeable, incrementally updatable.
+
+    Quantiles are recomputed on every add, so reading them is a dict lookup.
+    """
+    
+    def __init__(self, buckets: Optional[Dict[int, int]] = None):
+        self.buckets: Dict[int, int] = buckets or {}
+        self.count = sum(self.buckets.values())
+        self.quantiles = self._quantiles()
+    
+    def add(self, price: float):
+        index = price_bucket(price)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.quantiles = self._quantiles()
+    
+    def _quantiles(self) -> Dict[str, float]:
+        if not self.count:
+            return {}
+        quantiles = {}
+        targets = sorted(PRICING_QUANTILES.items(), key=lambda item: item[1])
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            while targets and seen > targets[0][1] * (self.count - 1):
+                # Bucket midpoint in the relative-error sense
+                quantiles[targets.pop(0)[0]] = round(2 * PRICING_GAMMA ** index / (PRICING_GAMMA + 1), 2)
+        return quantiles
+
+def pricing_keys(intervention_type: str, service_type: str, urgency: str,
+                 latitude: Optional[float], longitude: Optional[float]) -> List[str]:
+    """Sketch keys from the most specific level (region cell) to the widest (type only)"""
+    cell = "*"
+    if service_type == ServiceType.ONSITE and latitude is not None and longitude is not None:
+        cell = f"{math.floor(latitude / PRICING_CELL_DEGREES)}:{math.floor(longitude / PRICING_CELL_DEGREES)}"
+    return [
+        f"{intervention_type}|{service_type}|{urgency}|{cell}",
+        f"{intervention_type}|{service_type}|{urgency}|*",
+        f"{intervention_type}|{service_type}|*|*",
+        f"{intervention_type}|*|*|*"
+    ]
+
+class PriceBook:
+    """Sketches of completed final prices, held in memory for quoting.
+
+    Completions are applied locally at once and persisted as $inc on bucket
+    counts; every worker reloads the persisted sketches periodically to pick
+    up completions recorded elsewhere.
+    """
+    
+    def __init__(self):
+        self.sketches: Dict[str, PriceSketch] = {}
+        self.loaded_at: Optional[datetime] = None
+    
+    def add(self, keys: List[str], price: float):
+        for key in dict.fromkeys(keys):
+            self.sketches.setdefault(key, PriceSketch()).add(price)
+    
+    def quote(self, keys: List[str], min_samples: int = PRICING_MIN_SAMPLES) -> Dict[str, Any]:
+        for level, key in zip(PRICING_LEVELS, keys):
+            sketch = self.sketches.get(key)
+            if sketch is not None and sketch.count >= min_samples:
+                return {"level": level, "samples": sketch.count, **sketch.quantiles}
+        return {"level": None, "samples": 0, **dict.fromkeys(PRICING_QUANTILES)}
+    
+    async def load(self):
+        sketches = {}
+        async for doc in db.price_sketches.find():
+            sketches[doc["_id"]] = PriceSketch({int(index): count for index, count in doc.get("buckets", {}).items()})
+        self.sketches = sketches
+        self.loaded_at = datetime.utcnow()
+    
+    def metrics(self) -> Dict[str, Any]:
+        return {"sketches": len(self.sketches), "loaded_at": self.loaded_at}
+
+price_book = PriceBook()
+metrics_sources["pricing"] = price_book.metrics
+
+async def record_price(intervention: Dict[str, Any]):
+    price = intervention["final_price"]
+    if price <= 0:
+        return
+    keys = pricing_keys(
+        intervention["intervention_type"], intervention["service_type"], intervention["urgency"],
+        intervention.get("user_latitude"), intervention.get("user_longitude")
+    )
+    price_book.add(keys, price)
+    if STORAGE_BACKEND == "memory":
+        return
+    index = price_bucket(price)
+    await db.price_sketches.bulk_write(
+        [UpdateOne({"_id": key}, {"$inc": {f"buckets.{index}": 1}}, upsert=True) for key in dict.fromkeys(keys)],
+        ordered=False
+    )
+
+async def rebuild_price_sketches() -> Dict[str, int]:
+    """Recompute every sketch from completed interventions (live and archived)"""
+    rebuilt = PriceBook()
+    projection = {"_id": 0, "final_price": 1, "intervention_type": 1, "service_type": 1, "urgency": 1,
+                  "user_latitude": 1, "user_longitude": 1}
+    query = {"status": InterventionStatus.COMPLETED, "final_price": {"$gt": 0}}
+    samples = 0
+    for collection in (db.interventions, db.interventions_archive):
+        async for intervention in collection.find(query, projection):
+            keys = pricing_keys(
+                intervention["intervention_type"], intervention["service_type"], intervention["urgency"],
+                intervention.get("user_latitude"), intervention.get("user_longitude")
+            )
+            rebuilt.add(keys, intervention["final_price"])
+            samples += 1
+    
+    documents = [
+        {"_id": key, "buckets": {str(index): count for index, count in sketch.buckets.items()}}
+        for key, sketch in rebuilt.sketches.items()
+    ]
+    await replace_collection("price_sketches", documents)
+    price_book.sketches = rebuilt.sketches
+    price_book.loaded_at = datetime.utcnow()
+    
+    return {"interventions": samples, "sketches": len(documents)}
+
+async def _pricing_refresh_loop():
+    while True:
+        try:
+            await price_book.load()
+        except Exception as error:
+            logger.error(f"Price sketch refresh failed: {error}")
+        await asyncio.sleep(PRICING_REFRESH_SECONDS)
+
+@api_router.get("/pricing/quote")
+async def get_price_quote(
+    intervention_type: str,
+    service_type: str,
+    urgency: str,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None
+):
+    """Final price quantiles of similar completed interventions, from the in-memory price book"""
+    quote = price_book.quote(pricing_keys(intervention_type, service_type, urgency, latitude, longitude))
+    quote["suggested_budget_min"] = quote["p25"]
+    quote["suggested_budget_max"] = quote["p75"]
+    return quote
+
+@api_router.post("/admin/pricing/rebuild", dependencies=[Depends(mongo_only)])
+async def admin_rebuild_pricing(current_user: User = Depends(get_current_user)):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return await rebuild_price_sketches()
+
 # Admin endpoints
 @api_router.get("/admin/dashboard")
-async def admin_dashboard(current_user: User = Depends(get_current_user)):
+async def admin_dashboard(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
     
-    # Get key metrics
-    total_users = await db.users.count_documents({"user_type": "user"})
-    total_technicians = await db.users.count_documents({"user_type": "technician"}) 
-    total_interventions = await db.interventions.count_documents({})
-    completed_interventions = await db.interventions.count_documents({"status": "completed"})
-    pending_interventions = await db.interventions.count_documents({"status": "pending"})
+    cached = await not_modified(request, response, ["users", "interventions", "payments", "reviews"], current_user.id)
+    if cached:
+        return cached
     
-    # Revenue calculation
-    completed_payments = await db.payment_transactions.find({"payment_status": "paid"}).to_list(1000)
+    return await load_dashboard()
+
+async def load_dashboard() -> Dict[str, Any]:
+    # Key metrics, revenue and the average rating (maintained incrementally by create_review), concurrently
+    (total_users, total_technicians, total_interventions, completed_interventions,
+     pending_interventions, completed_payments, rating_stats) = await gather_reads(
+        repos.users.count({"user_type": "user"}),
+        repos.users.count({"user_type": "technician"}),
+        count_interventions(),
+        count_interventions({"status": "completed"}),
+        repos.interventions.count({"status": "pending"}),
+        repos.payments.list({"payment_status": "paid"}, limit=1000),
+        repos.stats.get("ratings")
+    )
     total_revenue = sum(payment.get("commission_amount", 0) for payment in completed_payments)
-    
-    # Average rating calculation
-    avg_rating_pipeline = [
-        {"$group": {"_id": None, "avg_rating": {"$avg": "$rating"}}}
-    ]
-    avg_rating_result = await db.users.aggregate(avg_rating_pipeline).to_list(1)
-    avg_rating = avg_rating_result[0]["avg_rating"] if avg_rating_result else 0
+    rating_count = rating_stats.get("rating_count", 0)
+    avg_rating = rating_stats.get("rating_sum", 0) / rating_count if rating_count else 0
     
     return {
         "total_users": total_users,
@@ -551,54 +2856,120 @@ async def admin_dashboard(current_user: User = Depends(get_current_user)):
 
 @api_router.get("/admin/users")
 async def admin_get_users(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 50,
     user_type: Optional[str] = None,
+    after: Optional[str] = None,
+    q: Optional[str] = None,  # prefix of email, name (any word) or phone
+    available: Optional[bool] = None,
+    active: Optional[bool] = None,
+    skills: Optional[List[str]] = Query(None),
     current_user: User = Depends(get_current_user)
 ):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
     
+    cached = await not_modified(request, response, ["users"], current_user.id)
+    if cached:
+        return cached
+    
     query = {}
     if user_type:
         query["user_type"] = user_type
+    if available is not None:
+        query["available"] = available
+    if active is not None:
+        # Users never suspended have no active field
+        query["active"] = {"$ne": False} if active else False
+    if skills:
+        query["skills"] = {"$all": skills}
     
-    users = await db.users.find(query).skip(skip).limit(limit).to_list(limit)
-    # Remove passwords from response
+    prefix = search_query_key(q) if q else ""
+    if prefix:
+        users = await repos.users.search(prefix, query, after, skip, limit)
+    else:
+        users = await repos.users.list(query, after, skip, limit)
+    return without_passwords(users)
+
+def without_passwords(users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     for user in users:
         user.pop("password", None)
-    
     return users
 
 @api_router.get("/admin/interventions")
 async def admin_get_interventions(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 50,
     status: Optional[str] = None,
+    after: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
     
+    cached = await not_modified(request, response, ["interventions"], current_user.id)
+    if cached:
+        return cached
+    
     query = {}
     if status:
         query["status"] = status
     
-    interventions = await db.interventions.find(query).skip(skip).limit(limit).to_list(limit)
+    interventions = await repos.interventions.list(query, after, skip, limit)
     return [Intervention(**intervention) for intervention in interventions]
 
 @api_router.get("/admin/payments")
 async def admin_get_payments(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 50,
+    after: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
     
-    payments = await db.payment_transactions.find({}).skip(skip).limit(limit).to_list(limit)
+    cached = await not_modified(request, response, ["payments"], current_user.id)
+    if cached:
+        return cached
+    
+    payments = await repos.payments.list(after=after, skip=skip, limit=limit)
     return [PaymentTransaction(**payment) for payment in payments]
 
+@api_router.get("/admin/bootstrap")
+async def admin_bootstrap(
+    request: Request,
+    response: Response,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """Dashboard plus the first page of users, interventions and payments in one round trip"""
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    cached = await not_modified(request, response, ["users", "interventions", "payments", "reviews"], current_user.id)
+    if cached:
+        return cached
+    
+    dashboard, users, interventions, payments = await gather_reads(
+        load_dashboard(),
+        repos.users.list(limit=limit),
+        repos.interventions.list(limit=limit),
+        repos.payments.list(limit=limit)
+    )
+    return {
+        "user": current_user,
+        "dashboard": dashboard,
+        "users": without_passwords(users),
+        "interventions": [Intervention(**intervention) for intervention in interventions],
+        "payments": [PaymentTransaction(**payment) for payment in payments]
+    }
+
 @api_router.put("/admin/users/{user_id}/status")
 async def admin_update_user_status(
     user_id: str,
@@ -608,13 +2979,9 @@ async def admin_update_user_status(
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
     
-    result = await db.users.update_one(
-        {"id": user_id},
-        {"$set": {"active": active}}
-    )
-    
-    if result.matched_count == 0:
+    if not await repos.users.update(user_id, {"active": active}):
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    await bump_versions("users")
     
     return {"message": "Statut utilisateur mis à jour"}
 
@@ -627,23 +2994,485 @@ async def admin_resolve_intervention(
     if current_user.user_type != UserType.ADMIN:
         raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
     
-    result = await db.interventions.update_one(
-        {"id": intervention_id},
-        {
-            "$set": {
-                "status": "resolved_by_admin",
-                "admin_resolution": resolution,
-                "resolved_at": datetime.utcnow(),
-                "resolved_by": current_user.id
-            }
-        }
-    )
+    resolved = await repos.interventions.update(intervention_id, {
+        "status": "resolved_by_admin",
+        "admin_resolution": resolution,
+        "resolved_at": datetime.utcnow(),
+        "resolved_by": current_user.id
+    })
     
-    if result.matched_count == 0:
+    if not resolved:
         raise HTTPException(status_code=404, detail="Intervention non trouvée")
+    participant_cache.invalidate(intervention_id)
+    await bump_versions("interventions")
     
     return {"message": "Intervention résolue par l'administrateur"}
 
+# Bulk admin operations
+class UserBulkFilter(BaseModel):
+    user_type: Optional[str] = None
+    active: Optional[bool] = None
+    available: Optional[bool] = None
+
+class InterventionBulkFilter(BaseModel):
+    status: Optional[str] = None
+    user_id: Optional[str] = None
+    technician_id: Optional[str] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+class UserBulkStatusUpdate(BaseModel):
+    ids: Optional[List[str]] = None
+    filter: Optional[UserBulkFilter] = None
+    active: bool
+    dry_run: bool = False
+
+class InterventionBulkResolve(BaseModel):
+    ids: Optional[List[str]] = None
+    filter: Optional[InterventionBulkFilter] = None
+    resolution: str
+    dry_run: bool = False
+
+def _bulk_filter_query(bulk_filter: Optional[BaseModel]) -> Dict[str, Any]:
+    query = {}
+    if bulk_filter is None:
+        return query
+    for field, value in bulk_filter.dict(exclude_none=True).items():
+        if field == "created_after":
+            query.setdefault("created_at", {})["$gte"] = value
+        elif field == "created_before":
+            query.setdefault("created_at", {})["$lt"] = value
+        elif field == "active" and value:
+            # Users never suspended have no active field
+            query["active"] = {"$ne": False}
+        else:
+            query[field] = value
+    return query
+
+async def _apply_bulk_update(repository, scope: str, ids: Optional[List[str]], query: Dict[str, Any],
+                             fields: Dict[str, Any], dry_run: bool):
+    if ids is None and not query:
+        raise HTTPException(status_code=400, detail="Une liste d'identifiants ou un filtre est requis")
+    
+    results = []
+    matched = 0
+    modified = 0
+    
+    async def apply_chunk(chunk_ids: List[str]):
+        nonlocal matched, modified
+        matched += len(chunk_ids)
+        if dry_run:
+            results.extend({"id": item_id, "status": "would_update"} for item_id in chunk_ids)
+            return
+        modified += await repository.update_many(chunk_ids, fields)
+        if scope == "interventions":
+            for item_id in chunk_ids:
+                participant_cache.invalidate(item_id)
+        await bump_versions(scope)
+        results.extend({"id": item_id, "status": "updated"} for item_id in chunk_ids)
+    
+    if ids is not None:
+        # Explicit ids: one $in lookup per chunk tells which ones exist (and match the filter)
+        unique_ids = list(dict.fromkeys(ids))
+        for start in range(0, len(unique_ids), BULK_CHUNK_SIZE):
+            chunk = unique_ids[start:start + BULK_CHUNK_SIZE]
+            found = {doc["id"] for doc in await repository.list({**query, "id": {"$in": chunk}}, limit=len(chunk))}
+            results.extend({"id": item_id, "status": "not_found"} for item_id in chunk if item_id not in found)
+            await apply_chunk([item_id for item_id in chunk if item_id in found])
+    elif dry_run:
+        matched = await repository.count(query)
+    else:
+        # Filter only: walk matching ids in keyset order so updated documents are never revisited
+        last_id = None
+        while True:
+            docs = await repository.list(query, last_id, limit=BULK_CHUNK_SIZE)
+            if not docs:
+                break
+            await apply_chunk([doc["id"] for doc in docs])
+            last_id = docs[-1]["id"]
+    
+    return {
+        "dry_run": dry_run,
+        "matched": matched,
+        "modified": modified,
+        "results": results
+    }
+
+@api_router.post("/admin/users/bulk-status")
+async def admin_bulk_update_user_status(
+    bulk_data: UserBulkStatusUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return await _apply_bulk_update(
+        repos.users,
+        "users",
+        bulk_data.ids,
+        _bulk_filter_query(bulk_data.filter),
+        {"active": bulk_data.active},
+        bulk_data.dry_run
+    )
+
+@api_router.post("/admin/interventions/bulk-resolve")
+async def admin_bulk_resolve_interventions(
+    bulk_data: InterventionBulkResolve,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return await _apply_bulk_update(
+        repos.interventions,
+        "interventions",
+        bulk_data.ids,
+        _bulk_filter_query(bulk_data.filter),
+        {
+            "status": "resolved_by_admin",
+            "admin_resolution": bulk_data.resolution,
+            "resolved_at": datetime.utcnow(),
+            "resolved_by": current_user.id
+        },
+        bulk_data.dry_run
+    )
+
+# Technician bulk import: bcrypt dominates, so hashing fans out over a process pool
+_hash_pool: Optional[ProcessPoolExecutor] = None
+
+def get_hash_pool() -> ProcessPoolExecutor:
+    global _hash_pool
+    if _hash_pool is None:
+        # Spawned, not forked: a fork copies locks held by the server's other threads.
+        # Workers unpickle passwords.hash_passwords, so they import that module, not this one
+        _hash_pool = ProcessPoolExecutor(max_workers=IMPORT_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _hash_pool
+
+def close_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown()
+        _hash_pool = None
+
+async def hash_passwords_parallel(passwords: List[str]) -> List[str]:
+    loop = asyncio.get_running_loop()
+    size = math.ceil(len(passwords) / IMPORT_HASH_WORKERS) or 1
+    slices = [passwords[start:start + size] for start in range(0, len(passwords), size)]
+    hashed = await asyncio.gather(*(loop.run_in_executor(get_hash_pool(), hash_passwords, part) for part in slices))
+    return [value for part in hashed for value in part]
+
+async def _import_lines(request: Request):
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+def _csv_row(header: List[str], line: str) -> Dict[str, Any]:
+    values = next(csv.reader([line]))
+    row = {column: value.strip() for column, value in zip(header, values) if value.strip() != ""}
+    if "skills" in row:
+        row["skills"] = [skill.strip() for skill in row["skills"].split(";") if skill.strip()]
+    return row
+
+async def _import_rows(request: Request, import_format: str):
+    """(row number, fields or None when the line cannot be parsed) for each non-empty line"""
+    header = None
+    number = 0
+    async for line in _import_lines(request):
+        if not line.strip():
+            continue
+        if import_format == "csv" and header is None:
+            header = [column.strip() for column in next(csv.reader([line]))]
+            continue
+        number += 1
+        try:
+            row = _csv_row(header, line) if import_format == "csv" else json.loads(line)
+        except (ValueError, csv.Error):
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+async def _import_chunk(rows: List[Tuple[int, Optional[Dict[str, Any]]]], seen: set, dry_run: bool) -> List[Dict[str, Any]]:
+    report = []
+    candidates = []
+    for number, row in rows:
+        if row is None:
+            report.append({"row": number, "status": "invalid", "error": "Ligne illisible"})
+            continue
+        try:
+            user_data = UserCreate(**{**row, "user_type": UserType.TECHNICIAN})
+        except ValidationError as error:
+            problems = "; ".join(f"{'.'.join(map(str, item['loc']))}: {item['msg']}" for item in error.errors())
+            report.append({"row": number, "email": row.get("email"), "status": "invalid", "error": problems})
+            continue
+        if user_data.email in seen:
+            report.append({"row": number, "email": user_data.email, "status": "duplicate", "error": "Email présent plusieurs fois dans le fichier"})
+            continue
+        seen.add(user_data.email)
+        candidates.append((number, user_data))
+    
+    # One $in lookup per chunk instead of a find_one per row
+    existing = await repos.users.existing_emails([user_data.email for _, user_data in candidates]) if candidates else set()
+    new_users = []
+    for number, user_data in candidates:
+        if user_data.email in existing:
+            report.append({"row": number, "email": user_data.email, "status": "duplicate", "error": "Cet email est déjà utilisé"})
+        else:
+            new_users.append((number, user_data))
+    
+    if dry_run:
+        report.extend({"row": number, "email": user_data.email, "status": "would_create"} for number, user_data in new_users)
+        return report
+    if not new_users:
+        return report
+    
+    hashed = await hash_passwords_parallel([user_data.password for _, user_data in new_users])
+    documents = []
+    for (_, user_data), hashed_password in zip(new_users, hashed):
+        documents.append(build_user_document(User(**user_data.dict(exclude={"password"})), hashed_password))
+    
+    failed = await repos.users.insert_many(documents)
+    for index, ((number, user_data), document) in enumerate(zip(new_users, documents)):
+        if index in failed:
+            status_name = "duplicate" if "E11000" in failed[index] or "duplicate" in failed[index] else "failed"
+            report.append({"row": number, "email": user_data.email, "status": status_name, "error": failed[index]})
+        else:
+            report.append({"row": number, "email": user_data.email, "status": "created", "id": document["id"]})
+    return report
+
+@api_router.post("/admin/users/import")
+async def admin_import_technicians(
+    request: Request,
+    format: str = "csv",
+    dry_run: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Create technicians from a CSV (header row; skills separated by ';') or NDJSON body"""
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format d'import invalide")
+    
+    report = []
+    seen = set()
+    chunk = []
+    async for row in _import_rows(request, format):
+        chunk.append(row)
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            report.extend(await _import_chunk(chunk, seen, dry_run))
+            chunk = []
+    if chunk:
+        report.extend(await _import_chunk(chunk, seen, dry_run))
+    
+    report.sort(key=lambda entry: entry["row"])
+    counts = {}
+    for entry in report:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    if counts.get("created"):
+        await bump_versions("users")
+    
+    return {"dry_run": dry_run, "total": len(report), "counts": counts, "rows": report}
+
+# Export endpoints
+def _export_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: _export_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_export_value(item) for item in value]
+    return value
+
+async def _next_or_none(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def _merge_by_created_at(cursors):
+    """One created_at-ordered stream from cursors that are each sorted by created_at"""
+    iterators = [cursor.__aiter__() for cursor in cursors]
+    heads = [await _next_or_none(iterator) for iterator in iterators]
+    while True:
+        live = [index for index, doc in enumerate(heads) if doc is not None]
+        if not live:
+            return
+        index = min(live, key=lambda index: heads[index].get("created_at") or datetime.min)
+        yield heads[index]
+        heads[index] = await _next_or_none(iterators[index])
+
+async def _export_documents(collections, repository, query: Dict[str, Any]):
+    if STORAGE_BACKEND == "memory":
+        # Time-ordered ids: paging by id is paging in creation order
+        after = None
+        while True:
+            page = await repository.list(query, after, limit=EXPORT_BATCH_SIZE)
+            for doc in page:
+                yield doc
+            if len(page) < EXPORT_BATCH_SIZE:
+                return
+            after = page[-1]["id"]
+    cursors = [
+        collection.find(query, {"_id": 0}, session=current_session.get()).sort("created_at", 1).batch_size(EXPORT_BATCH_SIZE)
+        for collection in collections
+    ]
+    async for doc in _merge_by_created_at(cursors):
+        yield doc
+
+async def _export_rows(documents, columns: List[str], export_format: str):
+    # Raw documents go straight from the cursor to the wire: no to_list, no model validation
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for doc in documents:
+            row = []
+            for column in columns:
+                value = _export_value(doc.get(column))
+                row.append(json.dumps(value) if isinstance(value, (dict, list)) else value)
+            writer.writerow(row)
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        # Rows are grouped into ~64 KiB chunks so each compressed flush carries many of them
+        lines = []
+        size = 0
+        async for doc in documents:
+            line = json.dumps(_export_value(doc)) + "\n"
+            lines.append(line)
+            size += len(line)
+            if size >= 64 * 1024:
+                yield "".join(lines)
+                lines = []
+                size = 0
+        yield "".join(lines)
+
+def _export_response(collections, repository, name: str, columns: List[str], export_format: str,
+                     start: Optional[datetime], end: Optional[datetime], query: Dict[str, Any]):
+    if export_format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format d'export invalide")
+    
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_rows(_export_documents(collections, repository, query), columns, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format}"'}
+    )
+
+@api_router.get("/admin/export/payments")
+async def admin_export_payments(
+    format: str = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    payment_status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    query = {}
+    if payment_status:
+        query["payment_status"] = payment_status
+    return _export_response(
+        [for_reads(db.payment_transactions)], repos.payments, "payments", list(PaymentTransaction.model_fields), format, start, end, query
+    )
+
+@api_router.get("/admin/export/interventions")
+async def admin_export_interventions(
+    format: str = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    query = {}
+    if status:
+        query["status"] = status
+    return _export_response(
+        [for_reads(db.interventions), for_reads(db.interventions_archive)], repos.interventions, "interventions", list(Intervention.model_fields), format, start, end, query
+    )
+
+@api_router.get("/admin/metrics")
+async def admin_metrics(current_user: User = Depends(get_current_user)):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    metrics = {}
+    for name, source in metrics_sources.items():
+        snapshot = source()
+        metrics[name] = await snapshot if asyncio.iscoroutine(snapshot) else snapshot
+    return metrics
+
+@api_router.get("/admin/profiles")
+async def admin_list_profiles(
+    limit: int = 50,
+    route: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    limit = min(limit, PROFILE_MEMORY_CAPACITY)
+    if STORAGE_BACKEND == "memory":
+        profiles = [profile for profile in reversed(recent_profiles) if route in (None, profile["route"])][:limit]
+        return [{key: value for key, value in profile.items() if key != "stacks"} for profile in profiles]
+    
+    query = {"route": route} if route else {}
+    cursor = db.profiles.find(query, {"_id": 0, "stacks": 0}).sort("$natural", -1).limit(limit)
+    return await cursor.to_list(limit)
+
+@api_router.get("/admin/profiles/{profile_id}/flamegraph")
+async def admin_profile_flamegraph(profile_id: str, current_user: User = Depends(get_current_user)):
+    """Collapsed stacks ("frame;frame;frame count" per line), as read by flamegraph.pl and speedscope"""
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    if STORAGE_BACKEND == "memory":
+        profile = next((profile for profile in recent_profiles if profile["id"] == profile_id), None)
+    else:
+        profile = await db.profiles.find_one({"id": profile_id})
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profil non trouvé")
+    
+    folded = "".join(f"{entry['stack']} {entry['count']}\n" for entry in profile["stacks"])
+    return PlainTextResponse(folded, headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'})
+
+@api_router.post("/admin/payments/reconcile")
+async def admin_reconcile_payments(
+    dry_run: bool = True,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return await reconcile_payments(dry_run=dry_run)
+
+@api_router.post("/admin/lifecycle/archive", dependencies=[Depends(mongo_only)])
+async def admin_archive_interventions(
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    
+    return await archive_interventions(older_than_days)
+
 # Notification endpoints
 class NotificationCreate(BaseModel):
     user_id: str
@@ -653,7 +3482,7 @@ class NotificationCreate(BaseModel):
     data: Optional[Dict[str, Any]] = {}
 
 class Notification(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     user_id: str
     title: str
     message: str
@@ -672,19 +3501,22 @@ async def create_notification(
         raise HTTPException(status_code=403, detail="Accès refusé")
     
     notification = Notification(**notification_data.dict())
-    await db.notifications.insert_one(notification.dict())
+    await repos.notifications.insert(notification.dict())
+    await bump_versions(f"notifications:{notification.user_id}")
     return notification
 
 @api_router.get("/notifications")
 async def get_notifications(
+    request: Request,
+    response: Response,
     unread_only: bool = False,
     current_user: User = Depends(get_current_user)
 ):
-    query = {"user_id": current_user.id}
-    if unread_only:
-        query["read"] = False
+    cached = await not_modified(request, response, [f"notifications:{current_user.id}"], current_user.id)
+    if cached:
+        return cached
     
-    notifications = await db.notifications.find(query).sort("created_at", -1).limit(50).to_list(50)
+    notifications = await repos.notifications.list_for_user(current_user.id, unread_only, 50)
     return [Notification(**notification) for notification in notifications]
 
 @api_router.put("/notifications/{notification_id}/read")
@@ -692,13 +3524,9 @@ async def mark_notification_read(
     notification_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    result = await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user.id},
-        {"$set": {"read": True}}
-    )
-    
-    if result.matched_count == 0:
+    if not await repos.notifications.mark_read(notification_id, current_user.id, datetime.utcnow()):
         raise HTTPException(status_code=404, detail="Notification non trouvée")
+    await bump_versions(f"notifications:{current_user.id}")
     
     return {"message": "Notification marquée comme lue"}
 
@@ -719,7 +3547,8 @@ async def send_push_notification(
         message=message,
         type="info"
     )
-    await db.notifications.insert_one(notification.dict())
+    await repos.notifications.insert(notification.dict())
+    await bump_versions(f"notifications:{user_id}")
     
     # TODO: Integrate with push notification service (Firebase, OneSignal, etc.)
     # For now, just store in database
@@ -727,7 +3556,15 @@ async def send_push_notification(
     return {"message": "Notification push envoyée"}
 
 # Include the router in the main app
-app.include_router(api_router)
+app.include_router(api_router, dependencies=[Depends(enforce_rate_limits)])
+
+app.add_middleware(ReadRoutingMiddleware)
+
+app.add_middleware(ProfilingMiddleware)
+
+app.add_middleware(CompressionMiddleware)
+
+app.add_middleware(AdmissionMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -744,6 +3581,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+background_jobs: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def create_indexes():
+    if STORAGE_BACKEND == "memory":
+        return
+    await db.users.create_index("id", unique=True)
+    await db.users.create_index("email", unique=True)
+    await ensure_profiles_collection()
+    await db.interventions.create_index("id", unique=True)
+    await db.reviews.create_index("intervention_id", unique=True)
+    await db.reviews.create_index([("technician_id", 1), ("created_at", -1)])
+    await db.analytics_rollups.create_index([("granularity", 1), ("bucket", 1)])
+    await db.payout_buckets.create_index([("technician_id", 1), ("month", -1)])
+    await db.interventions.create_index("created_at")
+    await db.payment_transactions.create_index("created_at")
+    await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+    await db.tasks.create_index([("status", 1), ("run_at", 1)])
+    await db.tasks.create_index([("status", 1), ("locked_until", 1)])
+    await db.payment_transactions.create_index([("payment_status", 1), ("updated_at", 1)])
+    await db.payment_transactions.create_index("session_id", unique=True)
+    # Time-ordered ids make these unique indexes append-mostly and usable as sort keys
+    await db.payment_transactions.create_index("id", unique=True)
+    await db.messages.create_index("id", unique=True)
+    await db.messages.create_index([("intervention_id", 1), ("created_at", 1)])
+    await db.notifications.create_index("id", unique=True)
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+    await ensure_notification_ttl()
+    await db.interventions.create_index([("status", 1), ("created_at", 1)])
+    await db.interventions_archive.create_index("id", unique=True)
+    await db.interventions_archive.create_index([("user_id", 1), ("created_at", -1)])
+    await db.interventions_archive.create_index("created_at")
+    await db.messages_archive.create_index("id", unique=True)
+    await db.messages_archive.create_index([("intervention_id", 1), ("created_at", 1)])
+    # Technician job feed: geo scan over pending onsite jobs, keyset scan over remote ones
+    await db.interventions.create_index(
+        [("user_location", "2dsphere"), ("status", 1), ("service_type", 1)]
+    )
+    await db.interventions.create_index(
+        [("status", 1), ("service_type", 1), ("intervention_type", 1), ("created_at", -1), ("id", -1)]
+    )
+    await db.users.create_index([("location", "2dsphere"), ("user_type", 1), ("available", 1)])
+    # Admin search: prefix ranges on normalized keys, never an unanchored regex
+    await db.users.create_index([("search_keys", 1), ("id", 1)])
+    await backfill_user_search_keys()
+    await db.users.update_many(
+        {"location": {"$exists": False}, "latitude": {"$ne": None}, "longitude": {"$ne": None}},
+        [{"$set": {"location": {"type": "Point", "coordinates": ["$longitude", "$latitude"]}}}]
+    )
+    # Backfill GeoJSON locations for interventions created before the feed existed
+    await db.interventions.update_many(
+        {"user_location": {"$exists": False}, "user_latitude": {"$ne": None}, "user_longitude": {"$ne": None}},
+        [{"$set": {"user_location": {"type": "Point", "coordinates": ["$user_longitude", "$user_latitude"]}}}]
+    )
+
+@app.on_event("startup")
+async def start_background_workers():
+    background_jobs.append(asyncio.create_task(_location_flush_loop()))
+    if STORAGE_BACKEND == "memory":
+        return
+    await start_task_workers()
+    background_jobs.append(asyncio.create_task(_pricing_refresh_loop()))
+    background_jobs.append(asyncio.create_task(_reconciliation_loop()))
+    background_jobs.append(asyncio.create_task(_archive_loop()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for job in background_jobs:
+        job.cancel()
+    await asyncio.gather(*background_jobs, return_exceptions=True)
+    background_jobs.clear()
+    try:
+        await location_tracker.flush()
+    except Exception as error:
+        logger.error(f"Location flush failed: {error}")
+    if message_buffer is not None:
+        await message_buffer.close()
+    await stop_task_workers()
+    close_hash_pool()
     client.close()
\ No newline at end of file
@@ -0,0 +1,794 @@
+"""Repository layer for the core collections.
+
+`MotorStorage` runs every operation against MongoDB; `MemoryStorage` keeps
+documents in dicts with secondary indexes so the API can be profiled and
+load tested without a database. Both return plain dicts shaped like the
+Mongo documents and are held to the same contract (tests/test_storage.py).
+"""
+import copy
+import math
+import bisect
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.read_concern import ReadConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lon / 2) ** 2)
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def search_position(doc: Optional[Dict[str, Any]], prefix: str, after: Optional[str]) -> Tuple[str, str]:
+    """Where a search page resumes: the previous user's first key matching prefix, and its id"""
+    upper = prefix_upper_bound(prefix)
+    keys = [key for key in (doc or {}).get("search_keys", []) if prefix <= key < upper]
+    return min(keys, default=prefix), after or ""
+
+# Request-scoped database context, bound by the API for each request: the causally
+# consistent session every operation joins, and the read preference for reads
+current_session: ContextVar = ContextVar("current_session", default=None)
+current_read_preference: ContextVar = ContextVar("current_read_preference", default=None)
+_readers: Dict[Tuple[int, str, str, Optional[int]], Any] = {}
+
+def for_reads(collection):
+    """`collection` as seen by reads of the current request: its read preference, majority read concern"""
+    preference = current_read_preference.get()
+    if preference is None:
+        return collection
+    key = (id(collection.database.client), collection.full_name, preference.mongos_mode, preference.max_staleness)
+    if key not in _readers:
+        _readers[key] = collection.with_options(read_preference=preference, read_concern=ReadConcern("majority"))
+    return _readers[key]
+
+# Motor implementation
+class MotorRepository:
+    def __init__(self, collection):
+        self.collection = collection
+
+    @property
+    def reader(self):
+        return for_reads(self.collection)
+
+    async def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return await self.reader.find_one({"id": doc_id}, session=current_session.get())
+
+    async def insert(self, doc: Dict[str, Any]):
+        await self.collection.insert_one(dict(doc), session=current_session.get())
+
+    async def insert_many(self, docs: List[Dict[str, Any]]) -> Dict[int, str]:
+        """Unordered insert; returns the error message of each document that failed, by index"""
+        try:
+            await self.collection.insert_many([dict(doc) for doc in docs], ordered=False, session=current_session.get())
+        except BulkWriteError as error:
+            return {
+                write_error["index"]: write_error.get("errmsg", "write failed")
+                for write_error in error.details.get("writeErrors", [])
+            }
+        return {}
+
+    async def update(self, doc_id: str, fields: Dict[str, Any]) -> bool:
+        result = await self.collection.update_one({"id": doc_id}, {"$set": fields}, session=current_session.get())
+        return result.matched_count > 0
+
+    async def increment(self, doc_id: str, fields: Dict[str, float]) -> bool:
+        result = await self.collection.update_one({"id": doc_id}, {"$inc": fields}, session=current_session.get())
+        return result.matched_count > 0
+
+    async def update_many(self, doc_ids: List[str], fields: Dict[str, Any]) -> int:
+        """Set the same fields on every listed document; returns how many changed"""
+        result = await self.collection.update_many({"id": {"$in": doc_ids}}, {"$set": fields}, session=current_session.get())
+        return result.modified_count
+
+    async def list(self, filters: Optional[Dict[str, Any]] = None, after: Optional[str] = None,
+                   skip: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        query = dict(filters or {})
+        if after:
+            query["id"] = {"$gt": after}
+        cursor = self.reader.find(query, session=current_session.get())
+        return await cursor.sort("id", 1).skip(skip).limit(limit).to_list(limit)
+
+    async def count(self, filters: Optional[Dict[str, Any]] = None) -> int:
+        return await self.reader.count_documents(filters or {}, session=current_session.get())
+
+    async def bulk_update(self, updates: Dict[str, Dict[str, Any]]):
+        """Set fields on many documents, keyed by id, in one unordered round trip"""
+        if updates:
+            await self.collection.bulk_write(
+                [UpdateOne({"id": doc_id}, {"$set": fields}) for doc_id, fields in updates.items()],
+                ordered=False,
+                session=current_session.get()
+            )
+
+class MotorUserRepository(MotorRepository):
+    async def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return await self.reader.find_one({"email": email}, session=current_session.get())
+
+    async def existing_emails(self, emails: List[str]) -> set:
+        cursor = self.reader.find({"email": {"$in": emails}}, {"_id": 0, "email": 1}, session=current_session.get())
+        return {doc["email"] async for doc in cursor}
+
+    async def search(self, prefix: str, filters: Optional[Dict[str, Any]] = None, after: Optional[str] = None,
+                     skip: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        """Users with a normalized search key starting with prefix, by (first matching key, id)
+
+        Sorting a multikey range by id cannot use the index, so results follow the
+        {search_keys, id} index; `after` is the last user id of the previous page.
+        """
+        previous = None
+        if after:
+            previous = await self.reader.find_one({"id": after}, {"search_keys": 1}, session=current_session.get())
+        start = search_position(previous, prefix, after)
+        # Seek on the compound (key, id) bound: the resume key's later ids, then the keys past it.
+        # A user is returned at its first matching key, so one whose first key comes earlier was already served.
+        # $elemMatch lets the multikey index intersect both ends of the key range
+        scans = [
+            ({"search_keys": start[0], "id": {"$gt": start[1]}}, lambda first: first < start[0]),
+            ({"search_keys": {"$elemMatch": {"$gt": start[0], "$lt": prefix_upper_bound(prefix)}}},
+             lambda first: first <= start[0])
+        ]
+        results = []
+        for bounds, served in scans:
+            query = {**(filters or {}), **bounds}
+            cursor = self.reader.find(query, session=current_session.get()).hint([("search_keys", 1), ("id", 1)])
+            async for doc in cursor.batch_size(skip + limit):
+                if served(search_position(doc, prefix, doc["id"])[0]):
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                results.append(doc)
+                if len(results) >= limit:
+                    break
+            await cursor.close()
+            if len(results) >= limit:
+                break
+        return results
+
+    async def near(self, latitude: float, longitude: float, radius_km: float,
+                   filters: Optional[Dict[str, Any]] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Users within radius_km of a point, nearest first, with a `distance` in km"""
+        pipeline = [
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [longitude, latitude]},
+                "key": "location",
+                "distanceField": "distance",
+                "distanceMultiplier": 0.001,
+                "maxDistance": radius_km * 1000,
+                "spherical": True,
+                "query": filters or {}
+            }},
+            {"$limit": limit}
+        ]
+        return await self.reader.aggregate(pipeline, session=current_session.get()).to_list(limit)
+
+    async def add_rating(self, doc_id: str, rating: float):
+        # Running sum/count and the derived rating move together in one atomic update
+        await self.collection.update_one(
+            {"id": doc_id},
+            [{"$set": {
+                "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", 0]}, rating]},
+                "rating_count": {"$add": [{"$ifNull": ["$rating_count", 0]}, 1]}
+            }}, {"$set": {
+                "rating": {"$divide": ["$rating_sum", "$rating_count"]}
+            }}],
+            session=current_session.get()
+        )
+
+class MotorInterventionRepository(MotorRepository):
+    async def assign(self, doc_id: str, technician_id: str, assigned_at: datetime) -> bool:
+        # Conditional on pending so two technicians cannot both win
+        result = await self.collection.update_one(
+            {"id": doc_id, "status": "pending"},
+            {"$set": {"technician_id": technician_id, "status": "assigned", "assigned_at": assigned_at}},
+            session=current_session.get()
+        )
+        return result.modified_count > 0
+
+    async def claim_flag(self, doc_id: str, flag: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one_and_update(
+            {"id": doc_id, flag: {"$ne": True}},
+            {"$set": {flag: True}},
+            session=current_session.get()
+        )
+
+    async def list_for_user(self, user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        cursor = self.reader.find({"user_id": user_id}, session=current_session.get())
+        return await cursor.sort("created_at", -1).limit(limit).to_list(limit)
+
+    async def list_for_technician(self, technician_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        query = {"$or": [{"status": "pending"}, {"technician_id": technician_id}]}
+        cursor = self.reader.find(query, session=current_session.get())
+        return await cursor.sort("created_at", -1).limit(limit).to_list(limit)
+
+    async def list_newest(self, filters: Optional[Dict[str, Any]] = None, before: Optional[Tuple[datetime, str]] = None,
+                          limit: int = 20) -> List[Dict[str, Any]]:
+        """Newest first by (created_at, id); `before` is the last (created_at, id) of the previous page"""
+        query = dict(filters or {})
+        if before:
+            query["$or"] = [
+                {"created_at": {"$lt": before[0]}},
+                {"created_at": before[0], "id": {"$lt": before[1]}}
+            ]
+        cursor = self.reader.find(query, session=current_session.get())
+        return await cursor.sort([("created_at", -1), ("id", -1)]).limit(limit).to_list(limit)
+
+    async def nearest(self, latitude: float, longitude: float, radius_km: float,
+                      filters: Optional[Dict[str, Any]] = None, limit: int = 20,
+                      after: Optional[Tuple[float, List[str]]] = None) -> List[Dict[str, Any]]:
+        """Interventions within radius_km of a point, nearest first, with a `distance` in meters.
+
+        Distances stay in meters, as $geoNear computes them, so `after` compares
+        exactly: it is the previous page's last distance and the ids served at
+        that distance, since jobs tied on distance come in no set order.
+        """
+        geo_near = {
+            "near": {"type": "Point", "coordinates": [longitude, latitude]},
+            "distanceField": "distance",
+            "maxDistance": radius_km * 1000,
+            "spherical": True,
+            "key": "user_location",
+            "query": filters or {}
+        }
+        pipeline = [{"$geoNear": geo_near}]
+        if after:
+            geo_near["minDistance"] = after[0]
+            pipeline.append({"$match": {"$or": [
+                {"distance": {"$gt": after[0]}},
+                {"distance": after[0], "id": {"$nin": after[1]}}
+            ]}})
+        pipeline.append({"$limit": limit})
+        return await self.reader.aggregate(pipeline, session=current_session.get()).to_list(limit)
+
+class MotorMessageRepository(MotorRepository):
+    async def list_for_intervention(self, intervention_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        cursor = self.reader.find({"intervention_id": intervention_id}, session=current_session.get())
+        return await cursor.sort("created_at", 1).to_list(limit)
+
+class MotorPaymentRepository(MotorRepository):
+    async def get_by_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self.reader.find_one({"session_id": session_id}, session=current_session.get())
+
+    async def update_by_session(self, session_id: str, fields: Dict[str, Any],
+                                unless_status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Apply fields and return the document as it was before the update
+
+        With unless_status, a transaction already in that status is left alone and None returned.
+        """
+        query = {"session_id": session_id}
+        if unless_status is not None:
+            query["payment_status"] = {"$ne": unless_status}
+        return await self.collection.find_one_and_update(
+            query,
+            {"$set": fields},
+            return_document=ReturnDocument.BEFORE,
+            session=current_session.get()
+        )
+
+    async def list_unsettled(self, final_statuses: List[str], updated_before: datetime,
+                             after: Optional[Tuple[datetime, str]] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Transactions in no final status, last updated before updated_before, by (updated_at, id)"""
+        query = {"payment_status": {"$nin": final_statuses}, "updated_at": {"$lt": updated_before}}
+        if after:
+            query["$or"] = [
+                {"updated_at": {"$gt": after[0]}},
+                {"updated_at": after[0], "id": {"$gt": after[1]}}
+            ]
+        cursor = self.reader.find(query, session=current_session.get())
+        return await cursor.sort([("updated_at", 1), ("id", 1)]).limit(limit).to_list(limit)
+
+    async def settle(self, doc_id: str, final_statuses: List[str], fields: Dict[str, Any]) -> bool:
+        """Apply fields unless the transaction already reached a final status"""
+        result = await self.collection.update_one(
+            {"id": doc_id, "payment_status": {"$nin": final_statuses}},
+            {"$set": fields},
+            session=current_session.get()
+        )
+        return result.modified_count > 0
+
+class MotorNotificationRepository(MotorRepository):
+    async def insert_if_absent(self, doc: Dict[str, Any]):
+        await self.collection.update_one({"id": doc["id"]}, {"$setOnInsert": doc}, upsert=True, session=current_session.get())
+
+    async def list_for_user(self, user_id: str, unread_only: bool = False, limit: int = 50) -> List[Dict[str, Any]]:
+        query = {"user_id": user_id}
+        if unread_only:
+            query["read"] = False
+        cursor = self.reader.find(query, session=current_session.get())
+        return await cursor.sort("created_at", -1).limit(limit).to_list(limit)
+
+    async def mark_read(self, doc_id: str, user_id: str, read_at: datetime) -> bool:
+        result = await self.collection.update_one(
+            {"id": doc_id, "user_id": user_id},
+            {"$set": {"read": True, "read_at": read_at}},
+            session=current_session.get()
+        )
+        return result.matched_count > 0
+
+class MotorReviewRepository(MotorRepository):
+    async def list_for_technician(self, technician_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        cursor = self.reader.find({"technician_id": technician_id}, session=current_session.get())
+        return await cursor.sort("created_at", -1).limit(limit).to_list(limit)
+
+class MotorStatsRepository:
+    """Named platform-wide counters, one document per name"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, name: str) -> Dict[str, Any]:
+        doc = await for_reads(self.collection).find_one({"_id": name}, session=current_session.get())
+        return doc or {}
+
+    async def increment(self, name: str, fields: Dict[str, float]):
+        await self.collection.update_one({"_id": name}, {"$inc": fields}, upsert=True, session=current_session.get())
+
+class MotorTaskRepository(MotorRepository):
+    """Background task queue; tasks out of attempts move to the dead letter collection"""
+
+    def __init__(self, collection, dead_letter):
+        super().__init__(collection)
+        self.dead_letter = dead_letter
+
+    async def claim(self, now: datetime, lease_until: datetime, exclude_types: List[str]) -> Optional[Dict[str, Any]]:
+        """Lease the due task with the earliest run_at, counting the attempt"""
+        # Running tasks whose lease expired belonged to a worker that died: take them over
+        return await self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued", "run_at": {"$lte": now}},
+                    {"status": "running", "locked_until": {"$lt": now}}
+                ],
+                "type": {"$nin": exclude_types}
+            },
+            {"$set": {"status": "running", "locked_until": lease_until}, "$inc": {"attempts": 1}},
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER,
+            session=current_session.get()
+        )
+
+    async def retry(self, doc_id: str, run_at: datetime, last_error: str):
+        await self.collection.update_one(
+            {"id": doc_id},
+            {"$set": {"status": "queued", "run_at": run_at, "last_error": last_error}},
+            session=current_session.get()
+        )
+
+    async def complete(self, doc_id: str):
+        await self.collection.delete_one({"id": doc_id}, session=current_session.get())
+
+    async def bury(self, doc: Dict[str, Any]):
+        """Move a task to the dead letter collection"""
+        await self.dead_letter.insert_one(dict(doc), session=current_session.get())
+        await self.collection.delete_one({"id": doc["id"]}, session=current_session.get())
+
+    async def count_queued(self) -> int:
+        return await self.collection.count_documents({"status": "queued"}, session=current_session.get())
+
+    async def count_dead(self) -> int:
+        return await self.dead_letter.estimated_document_count()
+
+class MotorStorage:
+    def __init__(self, db):
+        self.users = MotorUserRepository(db.users)
+        self.interventions = MotorInterventionRepository(db.interventions)
+        self.messages = MotorMessageRepository(db.messages)
+        self.payments = MotorPaymentRepository(db.payment_transactions)
+        self.notifications = MotorNotificationRepository(db.notifications)
+        self.reviews = MotorReviewRepository(db.reviews)
+        self.stats = MotorStatsRepository(db.platform_stats)
+        self.tasks = MotorTaskRepository(db.tasks, db.tasks_dead_letter)
+
+# In-memory implementation
+_RANGE_OPERATORS = {
+    "$gt": lambda value, bound: value > bound,
+    "$gte": lambda value, bound: value >= bound,
+    "$lt": lambda value, bound: value < bound,
+    "$lte": lambda value, bound: value <= bound
+}
+
+def _matches(value: Any, condition: Any) -> bool:
+    """Equality with Mongo's array containment, plus the $ne, $in, $nin, $all and range operators"""
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for operator, operand in condition.items():
+            if operator == "$ne":
+                if _matches(value, operand):
+                    return False
+            elif operator == "$in":
+                if not any(_matches(value, item) for item in operand):
+                    return False
+            elif operator == "$nin":
+                if any(_matches(value, item) for item in operand):
+                    return False
+            elif operator == "$all":
+                if not all(_matches(value, item) for item in operand):
+                    return False
+            elif operator in _RANGE_OPERATORS:
+                if value is None or not _RANGE_OPERATORS[operator](value, operand):
+                    return False
+            else:
+                raise ValueError(f"unsupported operator {operator}")
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+class MemoryRepository:
+    """Documents by id, ids kept sorted, plus hash indexes on selected fields"""
+
+    indexed_fields: Iterable[str] = ()
+    unique_fields: Iterable[str] = ()
+
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.order: List[str] = []
+        self.indexes: Dict[str, Dict[Any, set]] = {field: {} for field in self.indexed_fields}
+        self.unique: Dict[str, Dict[Any, str]] = {field: {} for field in self.unique_fields}
+
+    def _index(self, doc: Dict[str, Any]):
+        for field, index in self.indexes.items():
+            index.setdefault(doc.get(field), set()).add(doc["id"])
+        for field, index in self.unique.items():
+            index[doc.get(field)] = doc["id"]
+
+    def _unindex(self, doc: Dict[str, Any]):
+        for field, index in self.indexes.items():
+            index.get(doc.get(field), set()).discard(doc["id"])
+        for field, index in self.unique.items():
+            index.pop(doc.get(field), None)
+
+    def _ids_matching(self, filters: Dict[str, Any]) -> Iterable[str]:
+        # Narrow through the most selective indexed filter, then check the rest
+        candidates = None
+        for field, value in filters.items():
+            if field in self.indexes and not isinstance(value, (dict, list)):
+                ids = self.indexes[field].get(value, set())
+                if candidates is None or len(ids) < len(candidates):
+                    candidates = ids
+        pool = self.order if candidates is None else sorted(candidates)
+        for doc_id in pool:
+            doc = self.docs[doc_id]
+            if all(_matches(doc.get(field), value) for field, value in filters.items()):
+                yield doc_id
+
+    async def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        doc = self.docs.get(doc_id)
+        return copy.deepcopy(doc) if doc is not None else None
+
+    async def insert(self, doc: Dict[str, Any]):
+        if doc["id"] in self.docs:
+            raise DuplicateKeyError(f"duplicate id {doc['id']}")
+        for field, index in self.unique.items():
+            if doc.get(field) in index:
+                raise DuplicateKeyError(f"duplicate {field} {doc.get(field)}")
+        stored = copy.deepcopy(doc)
+        self.docs[stored["id"]] = stored
+        bisect.insort(self.order, stored["id"])
+        self._index(stored)
+
+    async def insert_many(self, docs: List[Dict[str, Any]]) -> Dict[int, str]:
+        failed = {}
+        for index, doc in enumerate(docs):
+            try:
+                await self.insert(doc)
+            except DuplicateKeyError as error:
+                failed[index] = str(error)
+        return failed
+
+    async def update(self, doc_id: str, fields: Dict[str, Any]) -> bool:
+        doc = self.docs.get(doc_id)
+        if doc is None:
+            return False
+        self._unindex(doc)
+        doc.update(copy.deepcopy(fields))
+        self._index(doc)
+        return True
+
+    async def increment(self, doc_id: str, fields: Dict[str, float]) -> bool:
+        doc = self.docs.get(doc_id)
+        if doc is None:
+            return False
+        return await self.update(doc_id, {field: (doc.get(field) or 0) + by for field, by in fields.items()})
+
+    async def update_many(self, doc_ids: List[str], fields: Dict[str, Any]) -> int:
+        modified = 0
+        for doc_id in dict.fromkeys(doc_ids):
+            doc = self.docs.get(doc_id)
+            if doc is not None and any(doc.get(field) != value for field, value in fields.items()):
+                await self.update(doc_id, fields)
+                modified += 1
+        return modified
+
+    async def list(self, filters: Optional[Dict[str, Any]] = None, after: Optional[str] = None,
+                   skip: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        results = []
+        for doc_id in self._ids_matching(filters or {}):
+            if after and doc_id <= after:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            results.append(copy.deepcopy(self.docs[doc_id]))
+            if len(results) >= limit:
+                break
+        return results
+
+    async def count(self, filters: Optional[Dict[str, Any]] = None) -> int:
+        if not filters:
+            return len(self.docs)
+        return sum(1 for _ in self._ids_matching(filters))
+
+    async def bulk_update(self, updates: Dict[str, Dict[str, Any]]):
+        for doc_id, fields in updates.items():
+            await self.update(doc_id, fields)
+
+    def _sorted(self, ids: Iterable[str], key: str, reverse: bool, limit: int) -> List[Dict[str, Any]]:
+        docs = sorted((self.docs[doc_id] for doc_id in ids), key=lambda doc: doc[key], reverse=reverse)
+        return [copy.deepcopy(doc) for doc in docs[:limit]]
+
+class MemoryUserRepository(MemoryRepository):
+    indexed_fields = ("user_type",)
+    unique_fields = ("email",)
+
+    def __init__(self):
+        super().__init__()
+        # Sorted (search key, id) pairs: prefix lookups are a bisect plus a short walk
+        self.search_index: List[Tuple[str, str]] = []
+
+    def _index(self, doc: Dict[str, Any]):
+        super()._index(doc)
+        for key in set(doc.get("search_keys") or ()):
+            bisect.insort(self.search_index, (key, doc["id"]))
+
+    def _unindex(self, doc: Dict[str, Any]):
+        super()._unindex(doc)
+        for key in set(doc.get("search_keys") or ()):
+            position = bisect.bisect_left(self.search_index, (key, doc["id"]))
+            if position < len(self.search_index) and self.search_index[position] == (key, doc["id"]):
+                del self.search_index[position]
+
+    async def search(self, prefix: str, filters: Optional[Dict[str, Any]] = None, after: Optional[str] = None,
+                     skip: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        upper = prefix_upper_bound(prefix)
+        start = search_position(self.docs.get(after), prefix, after)
+        position = bisect.bisect_right(self.search_index, start)
+        seen = set()
+        results = []
+        while position < len(self.search_index) and self.search_index[position][0] < upper:
+            doc_id = self.search_index[position][1]
+            position += 1
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            doc = self.docs[doc_id]
+            if search_position(doc, prefix, doc_id) <= start:
+                continue
+            if not all(_matches(doc.get(field), value) for field, value in (filters or {}).items()):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            results.append(copy.deepcopy(doc))
+            if len(results) >= limit:
+                break
+        return results
+
+    async def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        doc_id = self.unique["email"].get(email)
+        return await self.get(doc_id) if doc_id else None
+
+    async def existing_emails(self, emails: List[str]) -> set:
+        return {email for email in emails if email in self.unique["email"]}
+
+    async def near(self, latitude: float, longitude: float, radius_km: float,
+                   filters: Optional[Dict[str, Any]] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        results = []
+        for doc_id in self._ids_matching(filters or {}):
+            doc = self.docs[doc_id]
+            if doc.get("latitude") is None or doc.get("longitude") is None:
+                continue
+            distance = haversine_km(latitude, longitude, doc["latitude"], doc["longitude"])
+            if distance <= radius_km:
+                results.append(dict(copy.deepcopy(doc), distance=distance))
+        results.sort(key=lambda doc: doc["distance"])
+        return results[:limit]
+
+    async def add_rating(self, doc_id: str, rating: float):
+        doc = self.docs.get(doc_id)
+        if doc is None:
+            return
+        rating_sum = (doc.get("rating_sum") or 0) + rating
+        rating_count = (doc.get("rating_count") or 0) + 1
+        await self.update(doc_id, {"rating_sum": rating_sum, "rating_count": rating_count, "rating": rating_sum / rating_count})
+
+class MemoryInterventionRepository(MemoryRepository):
+    indexed_fields = ("user_id", "technician_id", "status")
+
+    async def assign(self, doc_id: str, technician_id: str, assigned_at: datetime) -> bool:
+        doc = self.docs.get(doc_id)
+        if doc is None or doc["status"] != "pending":
+            return False
+        return await self.update(doc_id, {"technician_id": technician_id, "status": "assigned", "assigned_at": assigned_at})
+
+    async def claim_flag(self, doc_id: str, flag: str) -> Optional[Dict[str, Any]]:
+        doc = self.docs.get(doc_id)
+        if doc is None or doc.get(flag) is True:
+            return None
+        before = copy.deepcopy(doc)
+        await self.update(doc_id, {flag: True})
+        return before
+
+    async def list_for_user(self, user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        return self._sorted(self.indexes["user_id"].get(user_id, ()), "created_at", True, limit)
+
+    async def list_for_technician(self, technician_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        ids = self.indexes["status"].get("pending", set()) | self.indexes["technician_id"].get(technician_id, set())
+        return self._sorted(ids, "created_at", True, limit)
+
+    async def list_newest(self, filters: Optional[Dict[str, Any]] = None, before: Optional[Tuple[datetime, str]] = None,
+                          limit: int = 20) -> List[Dict[str, Any]]:
+        docs = sorted(
+            (self.docs[doc_id] for doc_id in self._ids_matching(filters or {})),
+            key=lambda doc: (doc["created_at"], doc["id"]),
+            reverse=True
+        )
+        if before:
+            docs = [doc for doc in docs if (doc["created_at"], doc["id"]) < before]
+        return [copy.deepcopy(doc) for doc in docs[:limit]]
+
+    async def nearest(self, latitude: float, longitude: float, radius_km: float,
+                      filters: Optional[Dict[str, Any]] = None, limit: int = 20,
+                      after: Optional[Tuple[float, List[str]]] = None) -> List[Dict[str, Any]]:
+        results = []
+        for doc_id in self._ids_matching(filters or {}):
+            doc = self.docs[doc_id]
+            if doc.get("user_latitude") is None or doc.get("user_longitude") is None:
+                continue
+            distance = haversine_km(latitude, longitude, doc["user_latitude"], doc["user_longitude"]) * 1000
+            if distance > radius_km * 1000:
+                continue
+            if after and (distance < after[0] or (distance == after[0] and doc_id in after[1])):
+                continue
+            results.append(dict(copy.deepcopy(doc), distance=distance))
+        results.sort(key=lambda doc: (doc["distance"], doc["id"]))
+        return results[:limit]
+
+class MemoryMessageRepository(MemoryRepository):
+    indexed_fields = ("intervention_id",)
+
+    async def list_for_intervention(self, intervention_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        return self._sorted(self.indexes["intervention_id"].get(intervention_id, ()), "created_at", False, limit)
+
+class MemoryPaymentRepository(MemoryRepository):
+    indexed_fields = ("payment_status",)
+    unique_fields = ("session_id",)
+
+    async def get_by_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        doc_id = self.unique["session_id"].get(session_id)
+        return await self.get(doc_id) if doc_id else None
+
+    async def update_by_session(self, session_id: str, fields: Dict[str, Any],
+                                unless_status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        doc_id = self.unique["session_id"].get(session_id)
+        if doc_id is None or (unless_status is not None and self.docs[doc_id].get("payment_status") == unless_status):
+            return None
+        before = copy.deepcopy(self.docs[doc_id])
+        await self.update(doc_id, fields)
+        return before
+
+    async def list_unsettled(self, final_statuses: List[str], updated_before: datetime,
+                             after: Optional[Tuple[datetime, str]] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        query = {"payment_status": {"$nin": final_statuses}, "updated_at": {"$lt": updated_before}}
+        docs = sorted(
+            (self.docs[doc_id] for doc_id in self._ids_matching(query)),
+            key=lambda doc: (doc["updated_at"], doc["id"])
+        )
+        if after:
+            docs = [doc for doc in docs if (doc["updated_at"], doc["id"]) > after]
+        return [copy.deepcopy(doc) for doc in docs[:limit]]
+
+    async def settle(self, doc_id: str, final_statuses: List[str], fields: Dict[str, Any]) -> bool:
+        doc = self.docs.get(doc_id)
+        if doc is None or doc.get("payment_status") in final_statuses:
+            return False
+        return await self.update(doc_id, fields)
+
+class MemoryNotificationRepository(MemoryRepository):
+    indexed_fields = ("user_id",)
+
+    async def insert_if_absent(self, doc: Dict[str, Any]):
+        if doc["id"] not in self.docs:
+            await self.insert(doc)
+
+    async def list_for_user(self, user_id: str, unread_only: bool = False, limit: int = 50) -> List[Dict[str, Any]]:
+        ids = self.indexes["user_id"].get(user_id, set())
+        if unread_only:
+            ids = [doc_id for doc_id in ids if not self.docs[doc_id].get("read")]
+        return self._sorted(ids, "created_at", True, limit)
+
+    async def mark_read(self, doc_id: str, user_id: str, read_at: datetime) -> bool:
+        doc = self.docs.get(doc_id)
+        if doc is None or doc["user_id"] != user_id:
+            return False
+        return await self.update(doc_id, {"read": True, "read_at": read_at})
+
+class MemoryReviewRepository(MemoryRepository):
+    indexed_fields = ("technician_id",)
+    unique_fields = ("intervention_id",)
+
+    async def list_for_technician(self, technician_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        return self._sorted(self.indexes["technician_id"].get(technician_id, ()), "created_at", True, limit)
+
+class MemoryStatsRepository:
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+
+    async def get(self, name: str) -> Dict[str, Any]:
+        return dict(self.docs.get(name, {}))
+
+    async def increment(self, name: str, fields: Dict[str, float]):
+        doc = self.docs.setdefault(name, {"_id": name})
+        for field, by in fields.items():
+            doc[field] = doc.get(field, 0) + by
+
+class MemoryTaskRepository(MemoryRepository):
+    indexed_fields = ("status",)
+
+    def __init__(self):
+        super().__init__()
+        self.dead_letter: Dict[str, Dict[str, Any]] = {}
+
+    def _remove(self, doc_id: str):
+        doc = self.docs.pop(doc_id, None)
+        if doc is not None:
+            self._unindex(doc)
+            self.order.remove(doc_id)
+
+    async def claim(self, now: datetime, lease_until: datetime, exclude_types: List[str]) -> Optional[Dict[str, Any]]:
+        due = [
+            doc for doc in self.docs.values()
+            if doc["type"] not in exclude_types and (
+                (doc["status"] == "queued" and doc["run_at"] <= now) or
+                (doc["status"] == "running" and doc["locked_until"] < now)
+            )
+        ]
+        if not due:
+            return None
+        doc = min(due, key=lambda doc: (doc["run_at"], doc["id"]))
+        await self.update(doc["id"], {"status": "running", "locked_until": lease_until, "attempts": doc["attempts"] + 1})
+        return copy.deepcopy(doc)
+
+    async def retry(self, doc_id: str, run_at: datetime, last_error: str):
+        await self.update(doc_id, {"status": "queued", "run_at": run_at, "last_error": last_error})
+
+    async def complete(self, doc_id: str):
+        self._remove(doc_id)
+
+    async def bury(self, doc: Dict[str, Any]):
+        self.dead_letter[doc["id"]] = copy.deepcopy(doc)
+        self._remove(doc["id"])
+
+    async def count_queued(self) -> int:
+        return len(self.indexes["status"].get("queued", ()))
+
+    async def count_dead(self) -> int:
+        return len(self.dead_letter)
+
+class MemoryStorage:
+    def __init__(self):
+        self.users = MemoryUserRepository()
+        self.interventions = MemoryInterventionRepository()
+        self.messages = MemoryMessageRepository()
+        self.payments = MemoryPaymentRepository()
+        self.notifications = MemoryNotificationRepository()
+        self.reviews = MemoryReviewRepository()
+        self.stats = MemoryStatsRepository()
+        self.tasks = MemoryTaskRepository()
@@ -0,0 +1,36 @@
+"""Tests for the time-ordered UUIDv7 ids."""
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+import ids  # noqa: E402
+
+def timestamp_ms(value: str) -> int:
+    return uuid.UUID(value).int >> 80
+
+def test_ids_are_version_7_and_strictly_increasing():
+    generated = [ids.new_id() for _ in range(10_000)]
+    assert generated == sorted(generated) and len(set(generated)) == len(generated)
+    parsed = uuid.UUID(generated[0])
+    assert parsed.version == 7 and parsed.variant == uuid.RFC_4122
+
+def test_counter_overflow_within_one_millisecond_keeps_order(monkeypatch):
+    monkeypatch.setattr(ids.time, "time_ns", lambda: 4_000_000_000_000 * 1_000_000)
+    monkeypatch.setattr(ids, "_last_ms", ids._last_ms)  # later ids go back to the real clock
+    monkeypatch.setattr(ids, "_counter", ids._counter)
+    generated = [ids.new_id() for _ in range(5000)]
+    assert generated == sorted(generated)
+    # 4096 counter values per millisecond, so the clock is borrowed from the next one
+    assert timestamp_ms(generated[-1]) == timestamp_ms(generated[0]) + 1
+
+def test_ids_for_datetimes_sort_and_carry_the_timestamp():
+    start = datetime(2024, 3, 1, 12, 0, 0)
+    moments = [start + timedelta(milliseconds=5 * step) for step in range(100)]
+    generated = [ids.id_for_datetime(moment) for moment in moments]
+    assert generated == sorted(generated)
+    assert timestamp_ms(generated[0]) == 1709294400000
+    assert ids.is_time_ordered(generated[0])
+    assert not ids.is_time_ordered(str(uuid.uuid4())) and not ids.is_time_ordered("not-an-id")
@@ -0,0 +1,746 @@
+"""Unit tests for API components that run without MongoDB or Stripe.
+
+The server module is imported with the in-memory storage backend; the module
+is skipped when the backend's own dependencies are not installed.
+"""
+import os
+import sys
+import asyncio
+from pathlib import Path
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+pytest.importorskip("emergentintegrations")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+# The server reads its settings at import; keep them from leaking into the other test modules
+_SETTINGS = {"MONGO_URL": "mongodb://localhost:27017", "DB_NAME": "server_tests",
+             "STRIPE_SECRET_KEY": "sk_test", "STORAGE_BACKEND": "memory"}
+_previous = {key: os.environ.get(key) for key in _SETTINGS}
+os.environ.update(_SETTINGS)
+import server  # noqa: E402
+from ids import new_id  # noqa: E402
+for key, value in _previous.items():
+    if value is None:
+        os.environ.pop(key)
+    else:
+        os.environ[key] = value
+
+LOOP = asyncio.new_event_loop()
+
+def run(coroutine):
+    return LOOP.run_until_complete(coroutine)
+
+def make_request(path="/api/auth/login", method="POST", client="203.0.113.7", headers=None):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        "client": (client, 40000),
+        "route": SimpleNamespace(path=path)
+    }
+    return Request(scope)
+
+# Rate limiting
+def test_token_bucket_denies_when_empty_and_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    backend = server.LocalRateLimitBackend()
+
+    assert run(backend.take("k", 2, 1.0)) == (True, 0.0)
+    assert run(backend.take("k", 2, 1.0)) == (True, 0.0)
+    allowed, retry_after = run(backend.take("k", 2, 1.0))
+    assert not allowed and retry_after == pytest.approx(1.0)
+
+    now[0] += 1.5
+    assert run(backend.take("k", 2, 1.0))[0]
+    assert not run(backend.take("k", 2, 1.0))[0]
+
+def test_client_ip_trusts_forwarded_for_only_from_proxies(monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXIES", [server.ipaddress.ip_network("10.0.0.0/8")])
+    spoofed = {"X-Forwarded-For": "1.2.3.4, 198.51.100.9"}
+
+    assert server.client_ip(make_request(client="203.0.113.7", headers=spoofed)) == "203.0.113.7"
+    assert server.client_ip(make_request(client="10.0.0.2", headers=spoofed)) == "198.51.100.9"
+    chained = {"X-Forwarded-For": "1.2.3.4, 198.51.100.9, 10.0.0.5"}
+    assert server.client_ip(make_request(client="10.0.0.2", headers=chained)) == "198.51.100.9"
+    assert server.client_ip(make_request(client="10.0.0.2")) == "10.0.0.2"
+
+def test_rate_limit_denials_do_not_drain_the_shared_route_budget(monkeypatch):
+    monkeypatch.setattr(server, "rate_limit_backend", server.LocalRateLimitBackend())
+    monkeypatch.setitem(server.RATE_LIMITS, "routes", {"/api/auth/login": {"ip": [2, 0.001], "route": [3, 0.001]}})
+
+    outcomes = []
+    for _ in range(5):
+        try:
+            run(server.enforce_rate_limits(make_request(client="203.0.113.7")))
+            outcomes.append(200)
+        except HTTPException as error:
+            outcomes.append(error.status_code)
+    assert outcomes == [200, 200, 429, 429, 429]
+
+    # Only the two admitted attempts were charged to the route
+    run(server.enforce_rate_limits(make_request(client="198.51.100.20")))
+    with pytest.raises(HTTPException):
+        run(server.enforce_rate_limits(make_request(client="198.51.100.21")))
+
+# Job feed
+def test_decode_cursor_rejects_malformed_cursors():
+    fields = {"distance": (int, float), "id": str}
+    assert server.decode_cursor(server.encode_cursor({"distance": 1.5, "id": "a"}), fields)["id"] == "a"
+    for cursor in ["not base64!", server.encode_cursor({"id": "a"}), server.encode_cursor({"distance": "x", "id": "a"}),
+                   server.encode_cursor(["distance", "id"])]:
+        with pytest.raises(HTTPException) as error:
+            server.decode_cursor(cursor, fields)
+        assert error.value.status_code == 400
+
+def test_remote_feed_is_empty_without_a_remote_skill():
+    technician = SimpleNamespace(skills=[])
+    assert run(server._remote_feed(technician, 20, None)) == ([], None)
+
+# Admission control
+def test_admission_rejects_when_queue_is_full_and_after_the_deadline():
+    controller = server.AdmissionController({"api": [1, 1, 20, 1]}, 10)
+    group = controller.groups["api"]
+
+    async def scenario():
+        assert await controller.acquire(group)
+        queued = asyncio.ensure_future(controller.acquire(group))
+        await asyncio.sleep(0)
+        assert not await controller.acquire(group)  # queue of one is full
+        assert not await queued  # waited past 20 ms
+        controller.release(group)
+
+    run(scenario())
+    assert (group.rejected, group.timed_out, group.active, controller.in_flight) == (1, 1, 0, 0)
+
+def test_admission_hands_freed_slots_to_the_highest_priority_waiter():
+    controller = server.AdmissionController({"high": [1, 4, 1000, 1], "low": [2, 4, 1000, 2]}, 1)
+    high, low = controller.groups["high"], controller.groups["low"]
+
+    async def scenario():
+        assert await controller.acquire(high)
+        low_waiter = asyncio.ensure_future(controller.acquire(low))
+        high_waiter = asyncio.ensure_future(controller.acquire(high))
+        await asyncio.sleep(0)
+        controller.release(high)
+        assert (high.active, len(high.waiters), len(low.waiters)) == (1, 0, 1)
+        assert await high_waiter and not low_waiter.done()
+        controller.release(high)
+        assert await low_waiter
+
+    run(scenario())
+    assert (high.admitted, low.admitted, controller.in_flight) == (2, 1, 1)
+
+# Compression
+def test_negotiate_encoding_prefers_brotli_and_honours_q_values(monkeypatch):
+    monkeypatch.setattr(server, "brotli", object())
+    assert server.negotiate_encoding("gzip, deflate, br") == "br"
+    assert server.negotiate_encoding("br;q=0, gzip;q=0.5") == "gzip"
+    assert server.negotiate_encoding("*;q=0.1") == "br"
+    assert server.negotiate_encoding("identity") is None
+    assert server.negotiate_encoding("") is None
+
+    monkeypatch.setattr(server, "brotli", None)
+    assert server.negotiate_encoding("br, gzip") == "gzip"
+    assert server.negotiate_encoding("br") is None
+
+def test_compression_middleware_by_size_type_and_stream():
+    async def chunks():
+        for index in range(50):
+            yield f"{index:04d}{'y' * 100}\n".encode()
+
+    async def big(request):
+        return JSONResponse({"text": "x" * 4000})
+
+    async def small(request):
+        return JSONResponse({"text": "x"})
+
+    async def binary(request):
+        return Response(b"\0" * 4000, media_type="application/octet-stream")
+
+    async def stream(request):
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    async def unchanged(request):
+        return PlainTextResponse("", status_code=304)
+
+    app = Starlette(routes=[Route(f"/{endpoint.__name__}", endpoint) for endpoint in (big, small, binary, stream, unchanged)])
+    client = TestClient(server.CompressionMiddleware(app, minimum_size=1024), headers={"Accept-Encoding": "gzip"})
+
+    response = client.get("/big")
+    assert response.headers["content-encoding"] == "gzip" and "Accept-Encoding" in response.headers["vary"]
+    assert response.json() == {"text": "x" * 4000}
+    response = client.get("/stream")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text.splitlines()[-1] == f"0049{'y' * 100}"
+    for path in ("/small", "/binary", "/unchanged"):
+        assert "content-encoding" not in client.get(path).headers
+    assert "content-encoding" not in client.get("/big", headers={"Accept-Encoding": "identity"}).headers
+
+# Profiling
+def test_profiler_hands_samples_over_on_stop():
+    profiler = server.RequestProfiler(1)
+
+    async def handler():
+        profiler.start(asyncio.current_task())
+        for _ in range(20):
+            await asyncio.sleep(0.002)
+        samples = profiler.stop(asyncio.current_task())
+        total = sum(samples.values())
+        await asyncio.sleep(0.02)  # the sampler keeps running but no longer writes to them
+        return samples, total
+
+    samples, total = run(handler())
+    assert total > 0 and sum(samples.values()) == total
+    assert any(stack.endswith("[await]") for stack in samples)
+
+# Message write buffer
+def test_message_buffer_fails_only_the_rejected_documents_of_a_batch():
+    repository = server.MemoryStorage().messages
+    buffer = server.MessageWriteBuffer(repository, window_ms=5, max_size=100)
+    existing = {"id": new_id(), "content": "déjà là"}
+    run(repository.insert(existing))
+
+    async def scenario():
+        documents = [{"id": new_id(), "content": "un"}, dict(existing), {"id": new_id(), "content": "deux"}]
+        return documents, await asyncio.gather(*(buffer.submit(document) for document in documents),
+                                               return_exceptions=True)
+
+    documents, outcomes = run(scenario())
+    assert outcomes[0] is None and outcomes[2] is None and isinstance(outcomes[1], RuntimeError)
+    assert (buffer.batches, buffer.documents) == (1, 2)
+    assert run(repository.get(documents[2]["id"]))["content"] == "deux"
+
+def test_message_buffer_flushes_full_batches_and_fails_all_on_write_errors():
+    class Unavailable:
+        async def insert_many(self, documents):
+            raise ConnectionError("primary stepped down")
+
+    buffer = server.MessageWriteBuffer(Unavailable(), window_ms=60_000, max_size=2)
+
+    async def scenario():
+        # A full batch is written at once, without waiting for the minute-long window
+        return await asyncio.wait_for(asyncio.gather(
+            buffer.submit({"id": new_id()}), buffer.submit({"id": new_id()}), return_exceptions=True
+        ), timeout=1)
+
+    assert [type(outcome) for outcome in run(scenario())] == [ConnectionError, ConnectionError]
+    assert (buffer.batches, buffer.documents) == (1, 0)
+
+# Price suggestions
+def test_price_sketch_quantiles_within_relative_accuracy():
+    prices = [float(price) for price in range(1, 1001)]
+    sketch = server.PriceSketch()
+    for price in reversed(prices):
+        sketch.add(price)
+
+    for name, quantile in server.PRICING_QUANTILES.items():
+        exact = prices[int(quantile * (len(prices) - 1))]
+        assert sketch.quantiles[name] == pytest.approx(exact, rel=server.PRICING_RELATIVE_ACCURACY + 0.001)
+    # Persisted bucket counts rebuild the same sketch
+    assert server.PriceSketch(dict(sketch.buckets)).quantiles == sketch.quantiles
+
+def test_price_book_quotes_the_most_specific_level_with_enough_samples():
+    book = server.PriceBook()
+    keys = server.pricing_keys("computer", "onsite", "normal", 48.85, 2.35)
+    book.add(keys, 80.0)
+    for _ in range(3):
+        book.add(keys[1:], 120.0)
+
+    assert book.quote(keys, min_samples=1)["level"] == "cell"
+    quote = book.quote(keys, min_samples=3)
+    assert (quote["level"], quote["samples"]) == ("urgency", 4)
+    assert book.quote(keys, min_samples=5) == {"level": None, "samples": 0, **dict.fromkeys(server.PRICING_QUANTILES)}
+
+# Payment reconciliation
+class FakeCheckout:
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    async def get_checkout_status(self, session_id):
+        if session_id not in self.statuses:
+            raise ConnectionError("Stripe unavailable")
+        payment_status, status = self.statuses[session_id]
+        return SimpleNamespace(payment_status=payment_status, status=status)
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_reconcile_settles_abandoned_sessions(monkeypatch, dry_run):
+    monkeypatch.setattr(server, "repos", server.MemoryStorage())
+    stale = datetime.utcnow() - server.timedelta(hours=2)
+    sessions = {"paid": ("paid", "complete"), "expired": ("unpaid", "expired"), "open": ("unpaid", "open")}
+    for session_id, stored_status in [("paid", "unpaid"), ("expired", "pending"), ("open", "unpaid"),
+                                      ("error", "pending"), ("done", "paid")]:
+        intervention_id = new_id()
+        run(server.repos.interventions.insert({"id": intervention_id, "user_id": "u", "status": "assigned",
+                                               "created_at": stale}))
+        run(server.repos.payments.insert({
+            "id": new_id(), "session_id": session_id, "intervention_id": intervention_id, "user_id": "u",
+            "technician_id": None, "amount": 50.0, "commission_amount": 5.0, "technician_amount": 45.0,
+            "payment_status": stored_status, "created_at": stale, "updated_at": stale
+        }))
+
+    result = run(server.reconcile_payments(checkout_client=FakeCheckout(sessions), dry_run=dry_run))
+    assert {key: result[key] for key in ("scanned", "paid", "expired", "still_pending", "errors")} == \
+        {"scanned": 4, "paid": 1, "expired": 1, "still_pending": 1, "errors": 1}
+
+    def stored(session_id):
+        payment = run(server.repos.payments.get_by_session(session_id))
+        return payment["payment_status"], run(server.repos.interventions.get(payment["intervention_id"]))["status"]
+
+    if dry_run:
+        assert stored("paid") == ("unpaid", "assigned") and stored("expired") == ("pending", "assigned")
+    else:
+        assert stored("paid") == ("paid", "completed") and stored("expired") == ("expired", "assigned")
+        assert run(server.repos.payments.get_by_session("paid"))["paid_at"] is not None
+    assert stored("open") == ("unpaid", "assigned")
+    # Settled transactions are not rescanned
+    again = run(server.reconcile_payments(checkout_client=FakeCheckout(sessions), dry_run=dry_run))
+    assert again["scanned"] == (4 if dry_run else 2)
+
+def test_checkout_status_completes_the_intervention_only_on_the_transition_to_paid(monkeypatch):
+    monkeypatch.setattr(server, "repos", server.MemoryStorage())
+    sessions = {"session": ("unpaid", "open")}
+    monkeypatch.setattr(server, "stripe_checkout", FakeCheckout(sessions))
+    intervention_id = new_id()
+    run(server.repos.interventions.insert({"id": intervention_id, "user_id": "u", "status": "assigned",
+                                           "created_at": datetime.utcnow()}))
+    run(server.repos.payments.insert({
+        "id": new_id(), "session_id": "session", "intervention_id": intervention_id, "user_id": "u",
+        "technician_id": None, "amount": 50.0, "commission_amount": 5.0, "technician_amount": 45.0,
+        "payment_status": "pending", "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+    }))
+
+    def stored():
+        payment = run(server.repos.payments.get_by_session("session"))
+        return payment["payment_status"], run(server.repos.interventions.get(intervention_id))["status"]
+
+    run(server.get_checkout_status("session"))
+    assert stored() == ("unpaid", "assigned")
+    sessions["session"] = ("paid", "complete")
+    run(server.get_checkout_status("session"))
+    assert stored() == ("paid", "completed")
+    paid_at = run(server.repos.payments.get_by_session("session"))["paid_at"]
+    # An admin resolves the intervention; later polls must not reopen it as completed
+    run(server.repos.interventions.update(intervention_id, {"status": "resolved_by_admin"}))
+    run(server.get_checkout_status("session"))
+    assert stored() == ("paid", "resolved_by_admin")
+    assert run(server.repos.payments.get_by_session("session"))["paid_at"] == paid_at
+
+# Participant cache
+@pytest.fixture
+def participants(monkeypatch):
+    monkeypatch.setattr(server, "repos", server.MemoryStorage())
+    clock = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: clock[0])
+    cache = server.ParticipantCache(max_size=2, ttl_seconds=60)
+    monkeypatch.setattr(server, "participant_cache", cache)
+    intervention_id = new_id()
+    run(server.repos.interventions.insert({"id": intervention_id, "user_id": "client", "technician_id": None,
+                                           "status": "pending", "title": "Écran cassé"}))
+    return cache, clock, intervention_id
+
+def test_participant_cache_serves_entries_until_their_ttl(participants):
+    cache, clock, intervention_id = participants
+    assert run(cache.get(intervention_id))["status"] == "pending"
+    # Written by another worker: this process keeps its entry until the TTL runs out
+    run(server.repos.interventions.update(intervention_id, {"status": "assigned"}))
+    clock[0] += 59
+    assert run(cache.get(intervention_id))["status"] == "pending"
+    clock[0] += 2
+    assert run(cache.get(intervention_id))["status"] == "assigned"
+    assert cache.metrics() == {"size": 1, "hits": 1, "misses": 2}
+
+    cache.invalidate(intervention_id)
+    assert run(cache.get("missing")) is None and cache.metrics()["size"] == 0
+    others = [new_id(), new_id()]
+    for other in others:
+        run(server.repos.interventions.insert({"id": other, "user_id": "client"}))
+    for doc_id in [intervention_id, *others]:
+        run(cache.get(doc_id))
+    assert list(cache.entries) == others  # least recently used evicted
+
+def test_participant_denials_are_rechecked_against_the_database(participants):
+    cache, _, intervention_id = participants
+    run(cache.get(intervention_id))
+    # Assigned through another worker while the cached entry has no technician yet
+    run(server.repos.interventions.update(intervention_id, {"technician_id": "tech"}))
+    found = run(server.get_participants(intervention_id, server.is_participant(SimpleNamespace(id="tech"))))
+    assert found["technician_id"] == "tech" and cache.entries[intervention_id][1]["technician_id"] == "tech"
+
+    misses = cache.misses
+    with pytest.raises(HTTPException) as refused:
+        run(server.get_participants(intervention_id, server.is_participant(SimpleNamespace(id="stranger"))))
+    assert refused.value.status_code == 403 and cache.misses == misses + 1
+    assert run(server.get_participants("missing", server.is_participant(SimpleNamespace(id="tech")))) is None
+
+# Technician live locations
+def test_location_pings_coalesce_into_one_write_per_flush(monkeypatch):
+    monkeypatch.setattr(server, "repos", server.MemoryStorage())
+    clock = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: clock[0])
+    tracker = server.LocationTracker(persist_distance_m=100, flush_interval=5, live_ttl=300)
+    technicians = [new_id(), new_id()]
+    for technician_id in technicians:
+        run(server.repos.users.insert({"id": technician_id, "email": f"{technician_id}@example.com", "user_type": "technician"}))
+
+    for step in range(10):
+        tracker.ping(technicians[0], 48.8566 + step * 0.001, 2.3522)
+    tracker.ping(technicians[1], 45.7640, 4.8357)
+    run(tracker.flush())
+    stored = run(server.repos.users.get(technicians[0]))
+    assert (stored["latitude"], stored["longitude"]) == (48.8656, 2.3522)
+    assert stored["location"] == {"type": "Point", "coordinates": [2.3522, 48.8656]}
+    assert tracker.metrics() == {"live": 2, "pending": 0, "pings": 11, "writes": 2, "flushes": 1}
+
+    # About 55 m from the stored position: live only, nothing to write
+    tracker.ping(technicians[0], 48.8661, 2.3522)
+    run(tracker.flush())
+    assert tracker.position(technicians[0]) == (48.8661, 2.3522)
+    assert run(server.repos.users.get(technicians[0]))["latitude"] == 48.8656
+    assert tracker.metrics()["flushes"] == 1
+    clock[0] += 301
+    assert tracker.position(technicians[0]) is None
+
+    async def unavailable(updates):
+        raise ConnectionError("primary stepped down")
+
+    tracker.ping(technicians[1], 45.7700, 4.8357)
+    monkeypatch.setattr(server.repos.users, "bulk_update", unavailable)
+    with pytest.raises(ConnectionError):
+        run(tracker.flush())
+    assert tracker.dirty == {technicians[1]}  # kept for the next flush
+
+# Background task queue, against the in-memory task repository
+@pytest.fixture
+def task_queue(monkeypatch):
+    monkeypatch.setattr(server, "repos", server.MemoryStorage())
+    monkeypatch.setattr(server, "STORAGE_BACKEND", "mongo")  # queue tasks instead of running them inline
+    monkeypatch.setattr(server, "task_running", {})
+    monkeypatch.setattr(server, "task_stats", {"succeeded": 0, "retried": 0, "dead_lettered": 0})
+    monkeypatch.setattr(server, "task_claim_lock", asyncio.Lock())
+    monkeypatch.setattr(server, "task_handlers", dict(server.task_handlers))
+    return server.repos.tasks
+
+def test_task_retries_with_backoff_then_dead_letters(task_queue):
+    failures = []
+
+    async def flaky(payload):
+        failures.append(payload)
+        raise ValueError("smtp down")
+
+    server.task_handlers["flaky"] = flaky
+    run(server.enqueue_task("flaky", {"to": "jean"}, max_attempts=2))
+
+    task = run(server._claim_task())
+    assert task["attempts"] == 1 and server.task_running == {"flaky": 1}
+    run(server._run_task(task))
+    retried = run(task_queue.get(task["id"]))
+    assert retried["status"] == "queued" and retried["last_error"] == "ValueError('smtp down')"
+    # First retry waits TASK_BACKOFF_BASE_SECONDS, with up to 50% jitter either way
+    delay = (retried["run_at"] - datetime.utcnow()).total_seconds()
+    assert 0.5 * server.TASK_BACKOFF_BASE_SECONDS - 1 < delay <= 1.5 * server.TASK_BACKOFF_BASE_SECONDS
+    assert run(server._claim_task()) is None
+
+    run(task_queue.update(task["id"], {"run_at": datetime.utcnow()}))
+    task = run(server._claim_task())
+    run(server._run_task(task))
+    assert len(failures) == 2 and server.task_running == {"flaky": 0}
+    assert run(task_queue.get(task["id"])) is None
+    assert task_queue.dead_letter[task["id"]]["status"] == "dead"
+    assert server.task_stats == {"succeeded": 0, "retried": 1, "dead_lettered": 1}
+    metrics = run(server.task_queue_metrics())
+    assert metrics["queued"] == 0 and metrics["dead_letter_size"] == 1
+
+def test_concurrent_claims_respect_the_per_type_limit(task_queue, monkeypatch):
+    monkeypatch.setattr(server, "TASK_CONCURRENCY", {"notify": 2})
+    for _ in range(5):
+        run(server.enqueue_task("notify", {}))
+    claim = task_queue.claim
+
+    async def slow_claim(*args):
+        await asyncio.sleep(0)  # a database round trip: other workers run meanwhile
+        return await claim(*args)
+
+    monkeypatch.setattr(task_queue, "claim", slow_claim)
+
+    async def claim_all():
+        return await asyncio.gather(*(server._claim_task() for _ in range(5)))
+
+    claimed = [task for task in run(claim_all()) if task is not None]
+    assert len(claimed) == 2 and server.task_running == {"notify": 2}
+
+    async def succeed(payload):
+        pass
+
+    server.task_handlers["notify"] = succeed
+    run(server._run_task(claimed[0]))
+    assert server.task_running == {"notify": 1}
+    assert run(server._claim_task()) is not None and run(task_queue.count_queued()) == 2
+
+@pytest.mark.skipif("TASK_WORKERS" in os.environ, reason="worker count set explicitly")
+def test_default_worker_count_covers_every_concurrency_limit():
+    assert server.TASK_WORKERS == sum(server.TASK_CONCURRENCY.values())
+
+# Memory backend: admin endpoints
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(server, "rate_limit_backend", server.LocalRateLimitBackend())
+    with TestClient(server.app) as client:
+        yield client
+
+def register(api, user_type="user"):
+    body = {"email": f"{new_id()}@example.com", "password": "secret", "name": "Jean", "phone": "0600000000",
+            "user_type": user_type}
+    data = api.post("/api/auth/register", json=body).json()
+    return data["user"], {"Authorization": f"Bearer {data['token']}"}
+
+@pytest.mark.parametrize("path", [
+    "/api/admin/dashboard",
+    "/api/admin/bootstrap",
+    "/api/admin/metrics",
+    "/api/admin/users",
+    "/api/admin/users?q=jean",
+    "/api/admin/interventions",
+    "/api/admin/payments",
+    "/api/admin/analytics/timeseries?start=2026-01-01T00:00:00&end=2026-02-01T00:00:00",
+    "/api/admin/export/payments",
+    "/api/admin/export/interventions?format=csv",
+    "/api/admin/profiles"
+])
+def test_admin_reads_work_in_memory_mode(api, path):
+    _, admin = register(api, "admin")
+    assert api.get(path, headers=admin).status_code == 200
+
+@pytest.mark.parametrize("path", [
+    "/api/admin/analytics/rebuild",
+    "/api/admin/pricing/rebuild",
+    "/api/admin/payouts/rebuild",
+    "/api/admin/lifecycle/archive"
+])
+def test_mongo_maintenance_endpoints_are_unavailable_in_memory_mode(api, path):
+    _, admin = register(api, "admin")
+    assert api.post(path, headers=admin).status_code == 501
+
+@pytest.mark.parametrize("path, body", [
+    ("/api/admin/payments/reconcile", None),
+    ("/api/admin/users/bulk-status", {"filter": {"user_type": "user"}, "active": True}),
+    ("/api/admin/users/bulk-status", {"ids": ["missing"], "active": False, "dry_run": True}),
+    ("/api/admin/interventions/bulk-resolve", {"filter": {"status": "disputed"}, "resolution": "Remboursé"})
+])
+def test_admin_writes_work_in_memory_mode(api, path, body):
+    _, admin = register(api, "admin")
+    assert api.post(path, json=body, headers=admin).status_code == 200
+
+def test_job_feed_in_memory_mode(api):
+    technician, headers = register(api, "technician")
+    run(server.repos.users.update(technician["id"], {"latitude": 48.8566, "longitude": 2.3522, "skills": ["computer"]}))
+    now = datetime.utcnow()
+    jobs = {}
+    for name, service_type, latitude in [("near", "onsite", 48.86), ("far", "onsite", 48.95), ("away", "onsite", 45.0),
+                                         ("remote", "remote", None), ("older", "remote", None)]:
+        jobs[name] = new_id()
+        run(server.repos.interventions.insert({
+            "id": jobs[name], "user_id": "u", "title": name, "description": name, "intervention_type": "computer",
+            "service_type": service_type, "urgency": "low", "budget_min": 20, "budget_max": 40, "status": "pending",
+            "user_latitude": latitude, "user_longitude": 2.35 if latitude else None,
+            "created_at": now - server.timedelta(days=1 if name == "older" else 0)
+        }))
+
+    first = api.get("/api/interventions/feed?limit=1", headers=headers).json()
+    assert [job["id"] for job in first["onsite"]] == [jobs["near"]] and first["onsite"][0]["distance"] < 1
+    assert [job["id"] for job in first["remote"]] == [jobs["remote"]]
+    second = api.get("/api/interventions/feed", headers=headers, params={
+        "limit": 1, "onsite_cursor": first["onsite_cursor"], "remote_cursor": first["remote_cursor"]
+    }).json()
+    assert [job["id"] for job in second["onsite"]] == [jobs["far"]]
+    assert [job["id"] for job in second["remote"]] == [jobs["older"]]
+
+def test_review_updates_technician_and_dashboard_ratings_in_memory_mode(api):
+    user, headers = register(api)
+    technician, _ = register(api, "technician")
+    _, admin = register(api, "admin")
+    intervention_id = new_id()
+    run(server.repos.interventions.insert({
+        "id": intervention_id, "user_id": user["id"], "technician_id": technician["id"],
+        "status": "completed", "created_at": datetime.utcnow()
+    }))
+
+    review = {"intervention_id": intervention_id, "rating": 4}
+    assert api.post("/api/reviews", json=review, headers=headers).status_code == 200
+    assert api.post("/api/reviews", json=review, headers=headers).status_code == 400
+
+    reviews = api.get(f"/api/technicians/{technician['id']}/reviews").json()
+    assert [r["rating"] for r in reviews] == [4]
+    assert run(server.repos.users.get(technician["id"]))["rating"] == 4
+    assert api.get("/api/admin/dashboard", headers=admin).json()["average_rating"] == 4
+
+# Conditional GET
+def test_list_etags_answer_304_until_a_write_bumps_the_version(api):
+    user, headers = register(api)
+    _, other = register(api)
+    first = api.get("/api/interventions", headers=headers)
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and first.headers["cache-control"] == "private, no-cache"
+
+    cached = api.get("/api/interventions", headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304 and cached.headers["etag"] == etag and not cached.content
+    # The tag is per viewer
+    assert api.get("/api/interventions", headers={**other, "If-None-Match": etag}).status_code == 200
+
+    created = api.post("/api/interventions", headers=headers, json={
+        "title": "Écran noir", "description": "Le portable ne démarre plus", "intervention_type": "computer",
+        "service_type": "remote", "urgency": "medium", "budget_min": 30, "budget_max": 60
+    })
+    assert created.status_code == 200
+    fresh = api.get("/api/interventions", headers={**headers, "If-None-Match": etag})
+    assert fresh.status_code == 200 and fresh.headers["etag"] != etag
+    assert [intervention["id"] for intervention in fresh.json()] == [created.json()["id"]]
+
+# Bulk admin operations
+def test_bulk_status_filter_on_active_includes_users_never_suspended(api):
+    _, admin = register(api, "admin")
+    legacy, _ = register(api, "technician")
+    suspended, _ = register(api, "technician")
+    run(server.repos.users.update(suspended["id"], {"active": False}))
+    assert "active" not in run(server.repos.users.get(legacy["id"]))
+
+    body = {"filter": {"user_type": "technician", "active": True}, "active": False, "dry_run": True}
+    matched = api.post("/api/admin/users/bulk-status", json=body, headers=admin).json()["matched"]
+    assert matched == run(server.repos.users.count({"user_type": "technician", "active": {"$ne": False}}))
+    assert matched >= 1
+
+    body = {"ids": [legacy["id"], suspended["id"]], "filter": {"active": True}, "active": False}
+    results = api.post("/api/admin/users/bulk-status", json=body, headers=admin).json()["results"]
+    assert results == [{"id": suspended["id"], "status": "not_found"}, {"id": legacy["id"], "status": "updated"}]
+    assert run(server.repos.users.get(legacy["id"]))["active"] is False
+
+def test_technician_import_reports_each_row_and_hashes_passwords(api):
+    _, admin = register(api, "admin")
+    existing, _ = register(api, "technician")
+    fresh = [f"{new_id()}@example.com" for _ in range(2)]
+    body = "\n".join([
+        "email,password,name,phone,skills",
+        f"{fresh[0]},motdepasse1,Jean Martin,0600000001,écran;batterie",
+        f"{new_id()}@example.com,motdepasse2,Paul,,",
+        f"{fresh[0]},motdepasse3,Jean Bis,0600000003,",
+        f"{existing['email']},motdepasse4,Déjà Là,0600000004,",
+        f"{fresh[1]},motdepasse5,Marie Curie,0600000005,"
+    ])
+    report = api.post("/api/admin/users/import?format=csv", content=body.encode(), headers=admin).json()
+    assert report["counts"] == {"created": 2, "invalid": 1, "duplicate": 2}
+    assert [row["status"] for row in report["rows"]] == ["created", "invalid", "duplicate", "duplicate", "created"]
+    assert report["rows"][1]["error"].startswith("phone:")
+
+    for email, password in [(fresh[0], "motdepasse1"), (fresh[1], "motdepasse5")]:
+        user = run(server.repos.users.get_by_email(email))
+        assert user["user_type"] == "technician" and user["password"] != password
+        assert server.verify_password(password, user["password"])
+        login = api.post("/api/auth/login", json={"email": email, "password": password})
+        assert login.status_code == 200
+    assert run(server.repos.users.get_by_email(fresh[0]))["skills"] == ["écran", "batterie"]
+
+# Data lifecycle
+@pytest.fixture
+def mongo(monkeypatch):
+    """A throwaway database in place of server.db, when MONGO_URL points at a reachable MongoDB"""
+    if not _previous["MONGO_URL"]:
+        pytest.skip("MONGO_URL is not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(_previous["MONGO_URL"])
+    database = client[f"server_tests_{new_id()[:8]}"]
+    monkeypatch.setattr(server, "db", database)
+    yield database
+    run(client.drop_database(database.name))
+    client.close()
+
+def test_archive_moves_interventions_closed_before_the_cutoff(mongo):
+    now = datetime.utcnow()
+    long_ago, yesterday = now - server.timedelta(days=200), now - server.timedelta(days=1)
+    interventions = {
+        "completed_long_ago": {"status": "completed", "completed_at": long_ago},
+        "completed_yesterday": {"status": "completed", "completed_at": yesterday},
+        "cancelled_before_timestamps": {"status": "cancelled"},
+        "resolved_yesterday": {"status": "resolved_by_admin", "resolved_at": yesterday},
+        "still_pending": {"status": "pending"}
+    }
+    for name, fields in interventions.items():
+        run(mongo.interventions.insert_one({"id": name, "user_id": "u", "created_at": long_ago, **fields}))
+        run(mongo.messages.insert_one({"id": f"{name}-message", "intervention_id": name, "created_at": long_ago}))
+
+    result = run(server.archive_interventions(older_than_days=180))
+
+    assert (result["interventions"], result["messages"]) == (2, 2)
+    archived = {doc["id"] for doc in run(mongo.interventions_archive.find().to_list(None))}
+    assert archived == {"completed_long_ago", "cancelled_before_timestamps"}
+    assert {doc["id"] for doc in run(mongo.interventions.find().to_list(None))} == set(interventions) - archived
+    assert {doc["intervention_id"] for doc in run(mongo.messages_archive.find().to_list(None))} == archived
+    assert run(mongo.messages.count_documents({})) == 3
+
+def test_notification_ttl_backfills_read_at_of_old_read_notifications(mongo):
+    # Recent enough that the TTL monitor leaves them alone
+    created_at = datetime.utcnow().replace(microsecond=0) - server.timedelta(days=1)
+    read_at = created_at + server.timedelta(hours=1)
+    for name, fields in [("legacy", {"read": True}), ("unread", {"read": False}),
+                         ("dated", {"read": True, "read_at": read_at})]:
+        run(mongo.notifications.insert_one({"id": name, "user_id": "u", "created_at": created_at, **fields}))
+
+    run(server.ensure_notification_ttl())
+
+    stored = {doc["id"]: doc.get("read_at") for doc in run(mongo.notifications.find().to_list(None))}
+    assert stored == {"legacy": created_at, "unread": None, "dated": read_at}
+
+def test_exports_merge_live_and_archived_documents_in_creation_order():
+    async def cursor(days):
+        for day in days:
+            yield {"created_at": datetime(2026, 1, day)}
+
+    async def collect():
+        merged = server._merge_by_created_at([cursor([2, 5, 9]), cursor([1, 3, 4, 10]), cursor([])])
+        return [doc["created_at"].day async for doc in merged]
+
+    assert run(collect()) == [1, 2, 3, 4, 5, 9, 10]
+
+# Technician payouts
+def test_payout_buckets_match_a_rebuild_from_paid_transactions(mongo, monkeypatch):
+    monkeypatch.setattr(server, "STORAGE_BACKEND", "mongo")
+    january, february = datetime(2026, 1, 31, 23, 30), datetime(2026, 2, 1, 0, 15)
+    payments = [
+        {"technician_id": "tech", "amount": 100.0, "paid_at": january},
+        {"technician_id": "tech", "amount": 60.0, "paid_at": january - server.timedelta(days=3)},
+        {"technician_id": "tech", "amount": 80.0, "paid_at": february},
+        {"technician_id": "other", "amount": 50.0, "paid_at": february}
+    ]
+    for payment in payments:
+        payment.update(id=new_id(), intervention_id=new_id(), payment_status="paid",
+                       commission_amount=payment["amount"] / 10, technician_amount=payment["amount"] * 9 / 10)
+        run(mongo.payment_transactions.insert_one(dict(payment)))
+        run(server.record_payout(payment, payment["paid_at"]))
+    run(server.record_payout(payments[0], payments[0]["paid_at"]))  # replayed: counted once
+
+    def buckets():
+        return {doc["_id"]: doc for doc in run(mongo.payout_buckets.find().to_list(None))}
+
+    recorded = buckets()
+    assert sorted(recorded) == ["other:2026-02", "tech:2026-01", "tech:2026-02"]
+    january_bucket = recorded["tech:2026-01"]
+    assert (january_bucket["payments"], january_bucket["amount"], january_bucket["technician_amount"]) == (2, 160.0, 144.0)
+    assert january_bucket["month"] == datetime(2026, 1, 1)
+    assert [line["amount"] for line in january_bucket["lines"]] == [100.0, 60.0]
+
+    assert run(server.rebuild_payouts()) == {"technicians": 2, "buckets": 3}
+    rebuilt = buckets()
+    for key, bucket in recorded.items():
+        # The rebuild orders lines by paid_at, the incremental path by arrival
+        bucket["lines"].sort(key=lambda line: line["paid_at"])
+        assert rebuilt[key] == bucket
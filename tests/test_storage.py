@@ -0,0 +1,353 @@
+"""Contract tests shared by every storage backend.
+
+The in-memory backend always runs; the Motor backend runs too when
+MONGO_URL points at a reachable MongoDB (a throwaway database is used).
+"""
+import os
+import sys
+import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+from pymongo.read_preferences import SecondaryPreferred
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from ids import new_id  # noqa: E402
+from storage import MemoryStorage, MotorStorage, current_read_preference  # noqa: E402
+
+BACKENDS = ["memory"]
+if os.environ.get("MONGO_URL"):
+    BACKENDS.append("motor")
+
+# One loop for the whole module: Motor clients stay bound to the loop they started on
+LOOP = asyncio.new_event_loop()
+
+def run(coroutine):
+    return LOOP.run_until_complete(coroutine)
+
+@pytest.fixture(params=BACKENDS)
+def storage(request):
+    if request.param == "memory":
+        yield MemoryStorage()
+        return
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[f"storage_contract_{new_id()[:8]}"]
+    run(db.users.create_index("id", unique=True))
+    run(db.users.create_index("email", unique=True))
+    run(db.users.create_index([("location", "2dsphere")]))
+    run(db.users.create_index([("search_keys", 1), ("id", 1)]))
+    for collection in (db.interventions, db.messages, db.notifications, db.payment_transactions, db.tasks):
+        run(collection.create_index("id", unique=True))
+    run(db.payment_transactions.create_index("session_id", unique=True))
+    run(db.reviews.create_index("intervention_id", unique=True))
+    run(db.interventions.create_index([("user_location", "2dsphere")]))
+    yield MotorStorage(db)
+    run(client.drop_database(db.name))
+    client.close()
+
+def make_user(**fields):
+    user = {"id": new_id(), "email": f"{new_id()}@example.com", "user_type": "user", "name": "Jean"}
+    user.update(fields)
+    return user
+
+def make_intervention(user_id, **fields):
+    intervention = {
+        "id": new_id(),
+        "user_id": user_id,
+        "technician_id": None,
+        "status": "pending",
+        "title": "Écran cassé",
+        "created_at": datetime.utcnow()
+    }
+    intervention.update(fields)
+    return intervention
+
+def test_users_insert_get_and_unique_email(storage):
+    user = make_user()
+    run(storage.users.insert(user))
+
+    assert run(storage.users.get(user["id"]))["email"] == user["email"]
+    assert run(storage.users.get_by_email(user["email"]))["id"] == user["id"]
+    assert run(storage.users.get("missing")) is None
+    with pytest.raises(DuplicateKeyError):
+        run(storage.users.insert(make_user(email=user["email"])))
+
+def test_users_insert_many_and_existing_emails(storage):
+    existing = make_user()
+    run(storage.users.insert(existing))
+    batch = [make_user(), make_user(email=existing["email"]), make_user()]
+
+    assert run(storage.users.existing_emails([user["email"] for user in batch])) == {existing["email"]}
+    failed = run(storage.users.insert_many(batch))
+    assert list(failed) == [1]
+    assert run(storage.users.count()) == 3
+
+def test_reads_with_request_read_preference(storage):
+    user = make_user(user_type="technician")
+    run(storage.users.insert(user))
+
+    # Without secondaries the read falls back to the primary; it must still see the write
+    token = current_read_preference.set(SecondaryPreferred(max_staleness=90))
+    try:
+        assert run(storage.users.get(user["id"]))["email"] == user["email"]
+        assert run(storage.users.count({"user_type": "technician"})) == 1
+        assert [found["id"] for found in run(storage.users.list())] == [user["id"]]
+    finally:
+        current_read_preference.reset(token)
+
+def test_users_update_increment_list_and_count(storage):
+    technicians = [make_user(user_type="technician") for _ in range(3)]
+    for technician in technicians:
+        run(storage.users.insert(technician))
+    run(storage.users.insert(make_user()))
+
+    assert run(storage.users.update(technicians[0]["id"], {"available": False}))
+    assert not run(storage.users.update("missing", {"available": False}))
+    run(storage.users.increment(technicians[1]["id"], {"total_interventions": 2}))
+    run(storage.users.increment(technicians[1]["id"], {"total_interventions": 1}))
+
+    assert run(storage.users.get(technicians[0]["id"]))["available"] is False
+    assert run(storage.users.get(technicians[1]["id"]))["total_interventions"] == 3
+    assert run(storage.users.count({"user_type": "technician"})) == 3
+    assert run(storage.users.count()) == 4
+
+    first_page = run(storage.users.list({"user_type": "technician"}, limit=2))
+    assert [user["id"] for user in first_page] == [technician["id"] for technician in technicians[:2]]
+    second_page = run(storage.users.list({"user_type": "technician"}, after=first_page[-1]["id"], limit=2))
+    assert [user["id"] for user in second_page] == [technicians[2]["id"]]
+
+def test_users_search_by_prefix_with_filters(storage):
+    jean = make_user(user_type="technician", skills=["phone", "computer"], available=True,
+                     search_keys=["jean@example.com", "jean dupont", "jean", "dupont", "0612345678"])
+    jeanne = make_user(user_type="technician", skills=["phone"], available=True, active=False,
+                       search_keys=["jeanne@example.com", "jeanne martin", "jeanne", "martin", "0698765432"])
+    paul = make_user(search_keys=["paul@example.com", "paul jeandel", "paul", "jeandel", "0712345678"])
+    for user in (jean, jeanne, paul):
+        run(storage.users.insert(user))
+
+    def ids(*args, **kwargs):
+        return [user["id"] for user in run(storage.users.search(*args, **kwargs))]
+
+    # Ordered by first matching key ("jean" < "jeandel" < "jeanne"), then id
+    assert ids("jean") == [jean["id"], paul["id"], jeanne["id"]]
+    assert ids("jean", limit=2) == [jean["id"], paul["id"]]
+    assert ids("jean", after=jean["id"]) == [paul["id"], jeanne["id"]]
+    assert ids("jean", after=paul["id"]) == [jeanne["id"]]
+    assert ids("jean", skip=1, limit=1) == [paul["id"]]
+    assert ids("0612") == [jean["id"]]
+    assert ids("martin") == [jeanne["id"]]
+    assert ids("jean", {"user_type": "technician", "active": {"$ne": False}}) == [jean["id"]]
+    assert ids("jean", {"skills": {"$all": ["phone", "computer"]}}) == [jean["id"]]
+
+    run(storage.users.update(paul["id"], {"search_keys": ["paul@example.com", "paul"]}))
+    assert ids("jeandel") == []
+
+def test_users_search_pages_through_a_shared_key(storage):
+    # Every user's first key matching "mart" is "martin"; some also carry a later "martine"
+    users = [make_user(search_keys=["martin", "martine"] if index % 2 else ["martin"]) for index in range(7)]
+    # Keys on both sides of the "mart" range but none inside it
+    outsider = make_user(search_keys=["0600000000", "zoe"])
+    for user in users + [outsider]:
+        run(storage.users.insert(user))
+
+    pages = []
+    after = None
+    while True:
+        page = [user["id"] for user in run(storage.users.search("mart", after=after, limit=2))]
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]
+    assert [user_id for page in pages for user_id in page] == sorted(user["id"] for user in users)
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    assert [user["id"] for user in run(storage.users.search("martine"))] == sorted(user["id"] for user in users[1::2])
+
+def test_users_near_and_bulk_update(storage):
+    def located(latitude, longitude, **fields):
+        point = {"type": "Point", "coordinates": [longitude, latitude]}
+        return make_user(user_type="technician", latitude=latitude, longitude=longitude, location=point, **fields)
+
+    close = located(48.8570, 2.3525)
+    further = located(48.8738, 2.2950)
+    far = located(45.7640, 4.8357)
+    for user in (far, further, close):
+        run(storage.users.insert(user))
+
+    found = run(storage.users.near(48.8566, 2.3522, 20, {"user_type": "technician"}))
+    assert [user["id"] for user in found] == [close["id"], further["id"]]
+    assert found[0]["distance"] < 0.1
+
+    moved = {"latitude": 45.7641, "longitude": 4.8358, "location": {"type": "Point", "coordinates": [4.8358, 45.7641]}}
+    run(storage.users.bulk_update({close["id"]: moved, further["id"]: {"available": False}}))
+    found = run(storage.users.near(48.8566, 2.3522, 20, {"user_type": "technician", "available": True}))
+    assert found == []
+
+def test_reviews_unique_per_intervention_and_rating_counters(storage):
+    technician = make_user(user_type="technician")
+    run(storage.users.insert(technician))
+    now = datetime.utcnow()
+    older = {"id": new_id(), "intervention_id": new_id(), "technician_id": technician["id"], "rating": 5,
+             "created_at": now - timedelta(days=1)}
+    newer = {"id": new_id(), "intervention_id": new_id(), "technician_id": technician["id"], "rating": 3, "created_at": now}
+    run(storage.reviews.insert(older))
+    run(storage.reviews.insert(newer))
+    with pytest.raises(DuplicateKeyError):
+        run(storage.reviews.insert(dict(older, id=new_id())))
+    assert [r["id"] for r in run(storage.reviews.list_for_technician(technician["id"]))] == [newer["id"], older["id"]]
+
+    run(storage.users.add_rating(technician["id"], 5))
+    run(storage.users.add_rating(technician["id"], 3))
+    stored = run(storage.users.get(technician["id"]))
+    assert (stored["rating_sum"], stored["rating_count"], stored["rating"]) == (8, 2, 4)
+
+    assert run(storage.stats.get("ratings")) == {}
+    run(storage.stats.increment("ratings", {"rating_sum": 5, "rating_count": 1}))
+    run(storage.stats.increment("ratings", {"rating_sum": 3, "rating_count": 1}))
+    ratings = run(storage.stats.get("ratings"))
+    assert (ratings["rating_sum"], ratings["rating_count"]) == (8, 2)
+
+def test_interventions_assign_once_and_claim_flag(storage):
+    intervention = make_intervention(new_id())
+    run(storage.interventions.insert(intervention))
+
+    assert run(storage.interventions.assign(intervention["id"], "tech-1", datetime.utcnow()))
+    assert not run(storage.interventions.assign(intervention["id"], "tech-2", datetime.utcnow()))
+    stored = run(storage.interventions.get(intervention["id"]))
+    assert stored["technician_id"] == "tech-1"
+    assert stored["status"] == "assigned"
+
+    claimed = run(storage.interventions.claim_flag(intervention["id"], "completion_counted"))
+    assert claimed["technician_id"] == "tech-1"
+    assert run(storage.interventions.claim_flag(intervention["id"], "completion_counted")) is None
+
+def test_interventions_listings(storage):
+    now = datetime.utcnow()
+    user_id = new_id()
+    older = make_intervention(user_id, created_at=now - timedelta(hours=1))
+    newer = make_intervention(user_id, created_at=now)
+    mine = make_intervention(new_id(), status="assigned", technician_id="tech-1", created_at=now)
+    theirs = make_intervention(new_id(), status="assigned", technician_id="tech-2", created_at=now)
+    for intervention in (older, newer, mine, theirs):
+        run(storage.interventions.insert(intervention))
+
+    assert [i["id"] for i in run(storage.interventions.list_for_user(user_id))] == [newer["id"], older["id"]]
+    technician_ids = {i["id"] for i in run(storage.interventions.list_for_technician("tech-1"))}
+    assert technician_ids == {older["id"], newer["id"], mine["id"]}
+    assert run(storage.interventions.count({"status": "assigned"})) == 2
+
+def test_interventions_feed_pages_and_update_many(storage):
+    def located(latitude, **fields):
+        point = {"type": "Point", "coordinates": [2.35, latitude]}
+        return make_intervention(new_id(), user_latitude=latitude, user_longitude=2.35, user_location=point, **fields)
+
+    near, tied, far = located(48.86), located(48.86), located(48.9)
+    cancelled = located(48.86, status="cancelled")
+    for intervention in (near, tied, far, cancelled):
+        run(storage.interventions.insert(intervention))
+
+    first = run(storage.interventions.nearest(48.85, 2.35, 10, {"status": "pending"}, limit=1))
+    assert first[0]["id"] in (near["id"], tied["id"]) and 1000 < first[0]["distance"] < 1200
+    rest = run(storage.interventions.nearest(48.85, 2.35, 10, {"status": "pending"}, 5,
+                                             (first[0]["distance"], [first[0]["id"]])))
+    assert {i["id"] for i in rest} | {first[0]["id"]} == {near["id"], tied["id"], far["id"]} and rest[-1]["id"] == far["id"]
+
+    newest = run(storage.interventions.list_newest({"status": "pending"}, limit=2))
+    older = run(storage.interventions.list_newest({"status": "pending"}, (newest[-1]["created_at"], newest[-1]["id"])))
+    assert [i["id"] for i in newest + older] == [far["id"], tied["id"], near["id"]]
+
+    assert run(storage.interventions.update_many([near["id"], far["id"], "missing"], {"status": "cancelled"})) == 2
+    assert run(storage.interventions.update_many([near["id"], cancelled["id"]], {"status": "cancelled"})) == 0
+    assert run(storage.interventions.count({"status": "cancelled"})) == 3
+
+def test_messages_insert_many_reports_failures_and_lists_in_order(storage):
+    intervention_id = new_id()
+    now = datetime.utcnow()
+    first = {"id": new_id(), "intervention_id": intervention_id, "content": "1", "created_at": now}
+    second = {"id": new_id(), "intervention_id": intervention_id, "content": "2", "created_at": now + timedelta(seconds=1)}
+    run(storage.messages.insert(first))
+
+    failed = run(storage.messages.insert_many([second, dict(first)]))
+    assert list(failed) == [1]
+    contents = [message["content"] for message in run(storage.messages.list_for_intervention(intervention_id))]
+    assert contents == ["1", "2"]
+
+def test_payments_update_by_session_returns_previous(storage):
+    payment = {"id": new_id(), "session_id": f"cs_{new_id()}", "payment_status": "pending", "amount": 80.0}
+    run(storage.payments.insert(payment))
+
+    before = run(storage.payments.update_by_session(payment["session_id"], {"payment_status": "paid"}))
+    assert before["payment_status"] == "pending"
+    assert run(storage.payments.get_by_session(payment["session_id"]))["payment_status"] == "paid"
+    assert run(storage.payments.update_by_session("cs_missing", {"payment_status": "paid"})) is None
+    assert run(storage.payments.count({"payment_status": "paid"})) == 1
+
+def test_payments_unsettled_walk_and_guarded_settle(storage):
+    old = datetime.utcnow() - timedelta(hours=1)
+    final = ["paid", "expired"]
+    payments = [
+        {"id": new_id(), "session_id": f"cs_{new_id()}", "payment_status": status, "updated_at": old + timedelta(seconds=offset)}
+        for status, offset in [("unpaid", 0), ("pending", 0), ("paid", 1), ("pending", 2)]
+    ]
+    payments.append({"id": new_id(), "session_id": f"cs_{new_id()}", "payment_status": "pending", "updated_at": datetime.utcnow()})
+    for payment in payments:
+        run(storage.payments.insert(payment))
+
+    before = datetime.utcnow() - timedelta(minutes=5)
+    first = run(storage.payments.list_unsettled(final, before, limit=2))
+    assert [p["id"] for p in first] == sorted(p["id"] for p in payments[:2])
+    rest = run(storage.payments.list_unsettled(final, before, (first[-1]["updated_at"], first[-1]["id"])))
+    assert [p["id"] for p in rest] == [payments[3]["id"]]
+
+    assert run(storage.payments.settle(payments[0]["id"], final, {"payment_status": "expired"}))
+    assert not run(storage.payments.settle(payments[2]["id"], final, {"payment_status": "expired"}))
+    assert run(storage.payments.get(payments[2]["id"]))["payment_status"] == "paid"
+
+def test_notifications_idempotent_insert_and_read_state(storage):
+    user_id = new_id()
+    now = datetime.utcnow()
+    unread = {"id": new_id(), "user_id": user_id, "read": False, "created_at": now}
+    other = {"id": new_id(), "user_id": user_id, "read": False, "created_at": now - timedelta(minutes=1)}
+    run(storage.notifications.insert_if_absent(unread))
+    run(storage.notifications.insert_if_absent(dict(unread)))
+    run(storage.notifications.insert(other))
+
+    assert len(run(storage.notifications.list_for_user(user_id))) == 2
+    assert not run(storage.notifications.mark_read(other["id"], "someone-else", now))
+    assert run(storage.notifications.mark_read(other["id"], user_id, now))
+    assert [n["id"] for n in run(storage.notifications.list_for_user(user_id, unread_only=True))] == [unread["id"]]
+
+def test_tasks_claim_retry_and_dead_letter(storage):
+    now = datetime.utcnow()
+    lease = now + timedelta(minutes=1)
+    tasks = [
+        {"id": new_id(), "type": "notify", "status": "queued", "attempts": 0, "run_at": now - timedelta(seconds=2)},
+        {"id": new_id(), "type": "export", "status": "queued", "attempts": 0, "run_at": now - timedelta(seconds=3)},
+        {"id": new_id(), "type": "notify", "status": "queued", "attempts": 0, "run_at": now + timedelta(minutes=5)},
+        # Leased by a worker that died
+        {"id": new_id(), "type": "notify", "status": "running", "attempts": 1, "run_at": now - timedelta(seconds=1),
+         "locked_until": now - timedelta(seconds=1)}
+    ]
+    for task in tasks:
+        run(storage.tasks.insert(task))
+
+    claimed = run(storage.tasks.claim(now, lease, ["export"]))
+    assert claimed["id"] == tasks[0]["id"] and claimed["status"] == "running" and claimed["attempts"] == 1
+    taken_over = run(storage.tasks.claim(now, lease, ["export"]))
+    assert taken_over["id"] == tasks[3]["id"] and taken_over["attempts"] == 2
+    assert run(storage.tasks.claim(now, lease, ["export"])) is None
+
+    run(storage.tasks.retry(claimed["id"], now + timedelta(seconds=30), "boom"))
+    assert run(storage.tasks.count_queued()) == 3
+    assert run(storage.tasks.claim(now, lease, ["export"])) is None
+    assert run(storage.tasks.claim(now + timedelta(seconds=31), lease, ["export"]))["id"] == claimed["id"]
+
+    run(storage.tasks.complete(taken_over["id"]))
+    run(storage.tasks.bury({**claimed, "status": "dead"}))
+    assert run(storage.tasks.get(claimed["id"])) is None and run(storage.tasks.get(taken_over["id"])) is None
+    assert run(storage.tasks.count_queued()) == 2
+    assert run(storage.tasks.claim(now, lease, []))["id"] == tasks[1]["id"]